@@ -8,6 +8,15 @@ from selenic import Config
 
 SAUCELABS_CREDENTIALS = "userid:key"
 
+# When True, Builder.start_tunnel attaches to a tunnel shared by all
+# the processes on this host that use the same credentials, instead of
+# starting one tunnel per process. The tunnel is stopped when the last
+# process detaches, or SHARED_TUNNEL_LINGER seconds later. A process
+# gives up waiting for the tunnel after SHARED_TUNNEL_TIMEOUT seconds.
+SHARED_TUNNEL = False
+SHARED_TUNNEL_LINGER = 0
+SHARED_TUNNEL_TIMEOUT = 300
+
 caps = {
     "nativeEvents": True
 }
@@ -25,6 +34,12 @@ CHROMEDRIVER_PATH = "/blah/blah/chromedriver"
 # Only useful when running Chrome locally.
 SERVICE_LOG_PATH = "/tmp/log"
 
+# Only useful when running Chrome or Firefox locally. When True, the
+# builder starts one chromedriver (or geckodriver) service per process
+# and creates each driver as a session of that service, instead of
+# starting a service for each driver.
+SHARED_SERVICE = False
+
 from selenium.webdriver.chrome.options import Options
 CHROME_OPTIONS = Options()
 # Probably not something that makes sense remotely.
@@ -41,3 +56,21 @@ FIREFOX_PROFILE = FirefoxProfile()
 # Useful if you want to use a binary other than the one which is on
 # your PATH.
 FIREFOX_BINARY = FirefoxBinary("/opt/blah/firefox")
+
+# Only used when SHARED_SERVICE is True. Defaults to the geckodriver
+# found on your PATH.
+GECKODRIVER_PATH = "/blah/blah/geckodriver"
+
+# Only used when SHARED_SERVICE is True. The log of geckodriver, and
+# the arguments passed to it. The log defaults to geckodriver.log in
+# the current directory.
+GECKODRIVER_LOG_PATH = "/tmp/geckodriver.log"
+GECKODRIVER_ARGS = ["--log", "debug"]
+
+#
+# INSTRUMENTATION
+#
+
+# Record every WebDriver command issued by the drivers that the
+# builder creates. See selenic.instrument.CommandRecorder.
+INSTRUMENT_COMMANDS = False
@@ -1,30 +1,64 @@
-from distutils.version import StrictVersion
+import importlib
 
-from selenium.webdriver.common.action_chains import ActionChains
-import selenium
-
-# To re-export here.
+# To re-export here. The configuration module is cheap to import, but
+# the builder imports most of Selenium, so it is loaded only when one
+# of the names it provides is first accessed.
 from .config import *
-from .builder import *
 
-sel_ver = StrictVersion(selenium.__version__)
-v2_35_0 = StrictVersion("2.35.0")
+_BUILDER_NAMES = frozenset((
+    "Builder",
+    "CHROMEDRIVER_ELEMENT_CENTER_PATCH_FLAG",
+    "chromedriver_element_center_patch",
+    "clear_config_cache",
+    "get_shared_service",
+    "make_patched_find_element",
+    "preload_config",
+    "quit_drivers",
+    "stop_shared_services",
+    "wait_for_drivers",
+))
+
+_SUBMODULES = frozenset((
+    "builder",
+    "capabilities",
+    "config",
+    "datatables",
+    "instrument",
+    "outil",
+    "polling",
+    "pool",
+    "remote",
+    "shard",
+    "tables",
+    "util",
+))
+
+# ``from selenic import *`` exports the names loaded on demand too,
+# and thus loads the builder.
+__all__ = [
+    "Config",
+    "ConfigRegistry",
+    "ConfigTuple",
+    "configs",
+    "forget",
+    "get_config",
+    "query_configs",
+    "registry",
+] + sorted(_BUILDER_NAMES)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
 
-if sel_ver < v2_35_0:
-    raise Exception("please ascertain whether the ActionChains.send_keys "
-                    "patch is required for Selenium version: " +
-                    selenium.__version__)
+    if name in _BUILDER_NAMES:
+        value = getattr(importlib.import_module(".builder", __name__), name)
+        globals()[name] = value
+        return value
 
-if sel_ver >= v2_35_0 and sel_ver <= StrictVersion("2.37.2"):
-    # Work around bug
-    def send_keys(self, *keys_to_send):
-        """
-        Sends keys to current focused element.
+    raise AttributeError("module {!r} has no attribute {!r}"
+                         .format(__name__, name))
 
-        :Args:
-        - keys_to_send: The keys to send.
-        """
-        self.key_down(keys_to_send)
-        return self
 
-    ActionChains.send_keys = send_keys
+def __dir__():
+    return sorted(set(globals()) | _BUILDER_NAMES | _SUBMODULES)
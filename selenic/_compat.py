@@ -0,0 +1,49 @@
+#
+# Version checks and workarounds for the version of Selenium in
+# use. This module is imported by the modules of selenic that drive
+# browsers, rather than by the package itself, so that importing
+# ``selenic`` alone does not import Selenium. The workarounds are
+# therefore in effect once ``selenic.builder`` or ``selenic.util`` has
+# been imported.
+#
+import re
+
+import selenium
+from selenium.webdriver.common.action_chains import ActionChains
+
+
+def parse_version(version):
+    """
+    Parses the numeric part at the start of a version string.
+
+    :param version: The version, e.g. ``"2.40.0"`` or ``"4.0.0b1"``.
+    :type version: :class:`str`
+    :returns: The numbers, e.g. ``(2, 40, 0)`` or ``(4, 0, 0)``.
+    :rtype: :class:`tuple` of :class:`int`
+    """
+    match = re.match(r"\d+(?:\.\d+)*", version)
+    if not match:
+        raise ValueError("cannot parse version: " + version)
+    return tuple(int(part) for part in match.group(0).split("."))
+
+
+SELENIUM_VERSION = parse_version(selenium.__version__)
+
+if SELENIUM_VERSION < (2, 35, 0):
+    raise Exception("please ascertain whether the ActionChains.send_keys "
+                    "patch is required for Selenium version: " +
+                    selenium.__version__)
+
+if (2, 35, 0) <= SELENIUM_VERSION <= (2, 37, 2):
+    # Work around bug
+    def _send_keys(self, *keys_to_send):
+        """
+        Sends keys to current focused element.
+
+        :Args:
+        - keys_to_send: The keys to send.
+        """
+        self.key_down(keys_to_send)
+        return self
+
+    ActionChains.send_keys = _send_keys
@@ -1,25 +1,130 @@
+import atexit
 import re
 import os
-import subprocess
+import threading
 import types
-from distutils.version import StrictVersion
+import concurrent.futures
 
-import selenium
 from selenium import webdriver
 from selenium.webdriver.firefox.webdriver import FirefoxProfile, FirefoxBinary
+from selenium.webdriver.chrome.service import Service as ChromeService
+from selenium.webdriver.firefox.service import Service as FirefoxService
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webelement import WebElement
 
 from . import remote, outil
+from ._compat import parse_version, SELENIUM_VERSION
+from .remote import broker
 from .capabilities import NormalizedCapabilities
+from .instrument import CommandRecorder
 
 CHROMEDRIVER_ELEMENT_CENTER_PATCH_FLAG = \
     "_selenic_chromedriver_element_center_patch"
 
+_patch_lock = threading.Lock()
+
+_shared_services_lock = threading.Lock()
+_shared_services = {}
+
+
+_config_cache_lock = threading.Lock()
+_config_cache = {}
+_code_cache = {}
+
+
+def _freeze(value):
+    """
+    Converts a value to a hashable equivalent, so that it can be used
+    in a cache key.
+
+    :raises TypeError: If the value cannot be converted.
+    """
+    if isinstance(value, dict):
+        return (dict, frozenset((key, _freeze(item))
+                                for (key, item) in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(item) for item in value))
+    if isinstance(value, (set, frozenset)):
+        return (frozenset, frozenset(_freeze(item) for item in value))
+    hash(value)
+    return value
+
+
+def _load_config(config_path, options, cache):
+    """
+    Loads a configuration file. The namespace produced by executing
+    the file is cached, keyed by the path of the file, its
+    modification time, its size and ``options``, so that creating
+    builders repeatedly does not execute the file repeatedly. The
+    compiled code of the file is also cached so that it is compiled
+    once even if it is executed with different options.
+
+    :returns: A copy of the namespace.
+    :rtype: :class:`dict`
+    """
+    path = os.path.abspath(config_path)
+    stat = os.stat(path)
+    file_key = (path, stat.st_mtime_ns, stat.st_size)
+
+    key = None
+    if cache:
+        try:
+            key = (file_key, _freeze(options))
+        except TypeError:
+            pass  # Options we can't hash are not cached.
+
+    with _config_cache_lock:
+        namespace = _config_cache.get(key) if key is not None else None
+        code = _code_cache.get(file_key)
+
+    if namespace is None:
+        if code is None:
+            with open(config_path) as config_file:
+                code = compile(config_file.read(), config_path, 'exec')
+            with _config_cache_lock:
+                _code_cache[file_key] = code
+
+        namespace = {
+            'builder_args': options
+        }
+        exec(code, namespace)
+
+        if key is not None:
+            with _config_cache_lock:
+                namespace = _config_cache.setdefault(key, namespace)
+
+    # The builders may add to or modify their namespace, so they each
+    # get a copy. The values are shared.
+    return dict(namespace)
+
+
+def preload_config(config_path, options):
+    """
+    Loads a configuration file into the process-wide cache used by
+    :class:`Builder`. A process which preloads its configuration
+    before forking workers spares the workers the cost of loading the
+    configuration, as they inherit the cache.
+
+    :param config_path: Same as for :class:`Builder`.
+    :param options: Same as for :class:`Builder`.
+    """
+    _load_config(config_path, options, True)
+
+
+def clear_config_cache():
+    """
+    Empties the process-wide cache of configurations used by
+    :class:`Builder`.
+    """
+    with _config_cache_lock:
+        _config_cache.clear()
+        _code_cache.clear()
+
+
 class Builder(object):
 
-    def __init__(self, config_path, options):
+    def __init__(self, config_path, options, cache=True):
         """
         Initializes a configuration.
 
@@ -29,14 +134,20 @@ class Builder(object):
         :param options: A dictionary of key/value pairs with which the
                         global variable ``builder_args`` will be initialized
                         before the configuration is read.
+        :param cache: Whether to use the process-wide cache of
+                      configurations. When a builder was created
+                      earlier with the same file, unmodified since, and
+                      the same options, the result of reading the
+                      file is reused rather than the file being read
+                      again. Note that the values set by the
+                      configuration are then shared among builders,
+                      except for ``FIREFOX_PROFILE``, which
+                      :meth:`get_driver` copies for each driver.
+        :type cache: :class:`bool`
         """
         self.config_path = config_path
 
-        self.local_conf = {
-            'builder_args': options
-        }
-        exec(compile(open(self.config_path).read(), self.config_path, 'exec'),
-             self.local_conf)
+        self.local_conf = _load_config(config_path, options, cache)
 
         # This effectively lets the user force colon handling on or
         # off if COLON_HANDLING is defined.
@@ -47,8 +158,7 @@ class Builder(object):
         if colon_handling is None:
             self.colon_handling = self.config.browser == \
                 "INTERNETEXPLORER" and \
-                StrictVersion(
-                    selenium.__version__) <= StrictVersion("2.40.0")
+                SELENIUM_VERSION <= (2, 40, 0)
         elif colon_handling is True:
             self.colon_handling = True
         elif colon_handling is False:
@@ -64,6 +174,34 @@ class Builder(object):
             self.remote_service = \
                 remote.get_service_cls(remote_service)(self.local_conf)
 
+        self.shared_tunnel = bool(self.local_conf.get("SHARED_TUNNEL"))
+        """
+        Whether :meth:`start_tunnel` attaches to a tunnel shared by all
+        the processes of this host that use the same remote service
+        with the same credentials, rather than starting a tunnel for
+        this process. See :mod:`selenic.remote.broker`. This is set by
+        ``SHARED_TUNNEL`` in the configuration.
+        """
+        self._tunnel_lease = None
+
+        self.shared_service = bool(self.local_conf.get("SHARED_SERVICE"))
+        """
+        Whether local drivers are sessions of a chromedriver or
+        geckodriver service shared by all the drivers created in this
+        process, rather than each driver starting its own service. See
+        :func:`get_shared_service`. This is set by ``SHARED_SERVICE``
+        in the configuration.
+        """
+
+        self.command_recorder = CommandRecorder() \
+            if self.local_conf.get("INSTRUMENT_COMMANDS") else None
+        """
+        When not ``None``, the :class:`selenic.instrument.CommandRecorder`
+        which :meth:`get_driver` installs on the drivers it creates. It
+        is created if ``INSTRUMENT_COMMANDS`` is true in the
+        configuration, and may also be set directly.
+        """
+
     def __getattr__(self, name):
         if name in self.local_conf:
             return self.local_conf[name]
@@ -99,24 +237,64 @@ class Builder(object):
         else:
             if browser_string == "CHROME":
                 chromedriver_path = self.local_conf["CHROMEDRIVER_PATH"]
-                driver = webdriver.Chrome(
-                    chromedriver_path,
-                    chrome_options=self.local_conf.get("CHROME_OPTIONS"),
-                    desired_capabilities=desired_capabilities,
-                    service_log_path=self.local_conf["SERVICE_LOG_PATH"],
-                    service_args=self.local_conf.get("SERVICE_ARGS"))
-                version_line = subprocess.check_output(
-                    [chromedriver_path, "--version"]).decode("utf8")
+                # The probe is cached, but when it is not, it runs
+                # while the browser starts.
+                executor = concurrent.futures.ThreadPoolExecutor(1)
+                try:
+                    version_future = executor.submit(outil.probe_version,
+                                                     chromedriver_path)
+                finally:
+                    executor.shutdown(wait=False)
+                if self.shared_service:
+                    service = get_shared_service(
+                        browser_string, chromedriver_path,
+                        self.local_conf["SERVICE_LOG_PATH"],
+                        self.local_conf.get("SERVICE_ARGS"))
+                    driver = webdriver.Remote(
+                        command_executor=service.service_url,
+                        desired_capabilities=desired_capabilities,
+                        options=self.local_conf.get("CHROME_OPTIONS"))
+                else:
+                    driver = webdriver.Chrome(
+                        chromedriver_path,
+                        chrome_options=self.local_conf.get("CHROME_OPTIONS"),
+                        desired_capabilities=desired_capabilities,
+                        service_log_path=self.local_conf["SERVICE_LOG_PATH"],
+                        service_args=self.local_conf.get("SERVICE_ARGS"))
+                try:
+                    version_line = version_future.result()
+                except Exception:
+                    driver.quit()
+                    raise
                 version_str = re.match(r"^ChromeDriver (\d+\.\d+)",
                                        version_line).group(1)
-                chromedriver_version = StrictVersion(version_str)
+                chromedriver_version = parse_version(version_str)
             elif browser_string == "FIREFOX":
-                profile = self.local_conf.get("FIREFOX_PROFILE") or \
-                    FirefoxProfile()
+                profile = self.local_conf.get("FIREFOX_PROFILE")
+                # Quitting a Firefox driver deletes its profile, and
+                # the configuration may be shared by many builders, so
+                # each driver gets a copy of the configured profile.
+                profile = FirefoxProfile() if profile is None else \
+                    _copy_firefox_profile(profile)
                 binary = self.local_conf.get("FIREFOX_BINARY") or \
                     FirefoxBinary()
-                driver = webdriver.Firefox(profile, binary,
-                                           capabilities=desired_capabilities)
+                if self.shared_service:
+                    service = get_shared_service(
+                        browser_string,
+                        self.local_conf.get("GECKODRIVER_PATH",
+                                            "geckodriver"),
+                        self.local_conf.get("GECKODRIVER_LOG_PATH"),
+                        self.local_conf.get("GECKODRIVER_ARGS"))
+                    options = webdriver.FirefoxOptions()
+                    options.profile = profile
+                    options.binary = binary
+                    driver = webdriver.Remote(
+                        command_executor=service.service_url,
+                        desired_capabilities=desired_capabilities,
+                        options=options)
+                else:
+                    driver = webdriver.Firefox(
+                        profile, binary, capabilities=desired_capabilities)
             elif browser_string == "INTERNETEXPLORER":
                 driver = webdriver.Ie()
             elif browser_string == "OPERA":
@@ -151,15 +329,75 @@ class Builder(object):
         if (self.remote_service and
             self.remote_service.name == "browserstack") or \
            (chromedriver_version is not None and
-                chromedriver_version > StrictVersion("2.13")):
+                chromedriver_version > (2, 13)):
             # We patch ActionChains.
             chromedriver_element_center_patch()
             # We need to mark the driver as needing the patch.
             setattr(driver, CHROMEDRIVER_ELEMENT_CENTER_PATCH_FLAG, True)
 
+        if self.command_recorder is not None:
+            self.command_recorder.install(driver)
+
         driver = self.patch(driver)
         return driver
 
+    def get_driver_async(self, desired_capabilities=None, executor=None):
+        """
+        Starts creating a driver in a background thread.
+
+        :param desired_capabilities: Same as for :meth:`get_driver`.
+        :type desired_capabilities: class:`dict`
+        :param executor: The executor in which to create the
+                         driver. If ``None``, a new thread is used.
+        :type executor: :class:`concurrent.futures.Executor`
+        :returns: A future which resolves to the driver, or to the
+                  exception raised while creating it.
+        :rtype: :class:`concurrent.futures.Future`
+        """
+        if executor is not None:
+            return executor.submit(self.get_driver, desired_capabilities)
+
+        return self.get_drivers(1, desired_capabilities)[0]
+
+    def get_drivers(self, n, desired_capabilities=None, max_workers=None):
+        """
+        Creates ``n`` drivers concurrently. The time taken is roughly
+        that of the slowest driver to start rather than the sum of
+        the times taken by all drivers.
+
+        Each future carries its own result or its own error: a driver
+        that fails to start does not affect the others. Use
+        :func:`wait_for_drivers` to get all the drivers or none, and
+        :func:`quit_drivers` to tear down a batch.
+
+        Note that when drivers are created remotely, the remote
+        service records the last driver created, which is the one
+        whose status is set by :meth:`set_test_status`.
+
+        :param n: The number of drivers to create.
+        :type n: :class:`int`
+        :param desired_capabilities: Same as for :meth:`get_driver`.
+        :type desired_capabilities: class:`dict`
+        :param max_workers: The maximum number of drivers to create
+                            at the same time. Defaults to ``n``.
+        :type max_workers: :class:`int`
+        :returns: The futures that resolve to the drivers, in order.
+        :rtype: :class:`list` of :class:`concurrent.futures.Future`
+        """
+        if n < 1:
+            return []
+
+        # Shutting down the executor does not cancel the work already
+        # submitted. It only allows the threads to exit once they are
+        # done.
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(n, max_workers or n))
+        try:
+            return [executor.submit(self.get_driver, desired_capabilities)
+                    for _ in range(n)]
+        finally:
+            executor.shutdown(wait=False)
+
     def update_ff_binary_env(self, variable):
         """
         If a ``FIREFOX_BINARY`` was specified, this method updates an
@@ -196,13 +434,44 @@ class Builder(object):
         self.remote_service.set_test_status(passed)
 
     def get_unused_port(self):
-        return outil.get_unused_port() if not self.remote_service else \
+        """
+        Gets a port for a server that the browser will connect to. The
+        port is leased so that other processes using selenic on this
+        host do not get the same port. Release it with
+        :meth:`release_port` once the server is stopped. See
+        :class:`selenic.outil.PortAllocator`.
+
+        :returns: The port.
+        :rtype: :class:`int`
+        """
+        return outil.lease_port() if not self.remote_service else \
             self.remote_service.get_unused_port()
 
+    def release_port(self, port):
+        """
+        Releases a port obtained from :meth:`get_unused_port`, so that
+        other processes may use it. Releasing a port which is not
+        leased does nothing.
+
+        :param port: The port.
+        :type port: :class:`int`
+        """
+        outil.release_port(port)
+
     def start_tunnel(self):
         if not self.remote_service:
             return None
 
+        if self.shared_tunnel:
+            self._tunnel_lease = broker.attach(
+                self.remote_service.name, self.local_conf,
+                linger=self.local_conf.get("SHARED_TUNNEL_LINGER", 0),
+                timeout=self.local_conf.get("SHARED_TUNNEL_TIMEOUT",
+                                            broker.ATTACH_TIMEOUT))
+            tunnel_id = self._tunnel_lease.tunnel_id
+            self.remote_service.set_tunnel_id(tunnel_id)
+            return tunnel_id
+
         return self.remote_service.start_tunnel()
 
     def set_tunnel_id(self, tunnel_id):
@@ -215,6 +484,12 @@ class Builder(object):
         if not self.remote_service:
             return None
 
+        if self._tunnel_lease is not None:
+            self._tunnel_lease.detach()
+            self._tunnel_lease = None
+            self.remote_service.set_tunnel_id(None)
+            return None
+
         return self.remote_service.stop_tunnel()
 
     def patch(self, driver):
@@ -233,6 +508,147 @@ class Builder(object):
         return driver
 
 
+def _copy_firefox_profile(profile):
+    """
+    Copies a Firefox profile, including the preferences set on it.
+
+    :param profile: The profile to copy.
+    :type profile:
+        :class:`selenium.webdriver.firefox.firefox_profile.FirefoxProfile`
+    :returns: The copy, which has its own directory.
+    :rtype:
+        :class:`selenium.webdriver.firefox.firefox_profile.FirefoxProfile`
+    """
+    # The preferences are only written to the directory of the
+    # profile when the profile is used.
+    profile.update_preferences()
+    ret = FirefoxProfile(profile.path)
+    ret.native_events_enabled = profile.native_events_enabled
+    return ret
+
+
+def get_shared_service(browser, executable_path, log_path=None,
+                       service_args=None):
+    """
+    Gets a chromedriver or geckodriver service shared by the drivers
+    created in this process. The service is started on first use,
+    on a port leased with :func:`selenic.outil.lease_port`, and
+    is restarted if it has died. It is stopped when the process
+    exits, or by :func:`stop_shared_services`. Drivers are created
+    as ``webdriver.Remote`` sessions of the service, so the cost of
+    starting a service is paid once rather than for each driver.
+
+    A process which inherits a service from its parent through
+    ``fork`` starts its own service.
+
+    :param browser: ``"CHROME"`` or ``"FIREFOX"``.
+    :type browser: :class:`str`
+    :param executable_path: The path of chromedriver or geckodriver.
+    :type executable_path: :class:`str`
+    :param log_path: The path of the log of the service.
+    :type log_path: :class:`str`
+    :param service_args: Arguments to pass to the service.
+    :type service_args: :class:`list` of :class:`str`
+    :returns: The service.
+    :rtype: :class:`selenium.webdriver.common.service.Service`
+    """
+    if browser == "CHROME":
+        service_cls = ChromeService
+    elif browser == "FIREFOX":
+        service_cls = FirefoxService
+    else:
+        raise ValueError("no shared service for " + browser)
+
+    key = (os.getpid(), browser, executable_path, log_path,
+           tuple(service_args or ()))
+    with _shared_services_lock:
+        service = _shared_services.get(key)
+        if service is not None:
+            if service.process.poll() is None:
+                return service
+            outil.release_port(service.port)
+
+        port = outil.lease_port()
+        kwargs = {"port": port, "service_args": service_args}
+        if log_path is not None:
+            kwargs["log_path"] = log_path
+        service = service_cls(executable_path, **kwargs)
+        try:
+            service.start()
+        except Exception:
+            outil.release_port(port)
+            raise
+
+        _shared_services[key] = service
+        return service
+
+
+def stop_shared_services():
+    """
+    Stops the services started by :func:`get_shared_service` in this
+    process. The drivers using them must have been quit beforehand.
+    """
+    pid = os.getpid()
+    with _shared_services_lock:
+        services = [(key, service) for (key, service)
+                    in _shared_services.items() if key[0] == pid]
+        for (key, service) in services:
+            del _shared_services[key]
+            service.stop()
+            outil.release_port(service.port)
+
+
+atexit.register(stop_shared_services)
+
+
+def quit_drivers(futures):
+    """
+    Tears down a batch of drivers created by
+    :meth:`Builder.get_drivers`. Futures that have not started are
+    cancelled, futures that are running are waited for, and every
+    driver that was successfully created is quit. Errors are
+    swallowed, so this function is suitable for cleanup code.
+
+    :param futures: The futures to tear down.
+    :type futures: :class:`list` of :class:`concurrent.futures.Future`
+    """
+    for future in futures:
+        future.cancel()
+
+    for future in futures:
+        if future.cancelled() or future.exception() is not None:
+            continue
+
+        try:
+            future.result().quit()
+        # The driver may fail in many ways other than with a
+        # WebDriverException, e.g. if its browser is gone.
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+
+def wait_for_drivers(futures):
+    """
+    Waits for all the drivers of a batch created by
+    :meth:`Builder.get_drivers`. If any driver failed to start, the
+    whole batch is torn down with :func:`quit_drivers` and the first
+    error is raised.
+
+    :param futures: The futures to wait for.
+    :type futures: :class:`list` of :class:`concurrent.futures.Future`
+    :returns: The drivers, in the same order as the futures.
+    :rtype: :class:`list`
+    """
+    concurrent.futures.wait(futures)
+    for future in futures:
+        error = future.exception()
+        if error is not None:
+            quit_drivers(futures)
+            raise error
+
+    return [future.result() for future in futures]
+
+
 def make_patched_find_element(original):
 
     def method(self, by=By.ID, value=None):
@@ -257,29 +673,33 @@ def chromedriver_element_center_patch():
     """
 
     patch_name = "_selenic_chromedriver_element_center_patched"
-    if getattr(ActionChains, patch_name, None):
-        return  # We've patched ActionChains already!!
 
-    # This is the patched method, which uses getBoundingClientRect
-    # to get the location of the center.
-    def move_to_element(self, el):
-        pos = self._driver.execute_script("""
-        var rect = arguments[0].getBoundingClientRect();
-        return { x: rect.width / 2, y: rect.height / 2};
-        """, el)
-        self.move_to_element_with_offset(el, pos["x"], pos["y"])
-        return self
+    # Drivers may be created concurrently, hence the lock.
+    with _patch_lock:
+        if getattr(ActionChains, patch_name, None):
+            return  # We've patched ActionChains already!!
+
+        # This is the patched method, which uses getBoundingClientRect
+        # to get the location of the center.
+        def move_to_element(self, el):
+            pos = self._driver.execute_script("""
+            var rect = arguments[0].getBoundingClientRect();
+            return { x: rect.width / 2, y: rect.height / 2};
+            """, el)
+            self.move_to_element_with_offset(el, pos["x"], pos["y"])
+            return self
 
-    old_init = ActionChains.__init__
+        old_init = ActionChains.__init__
 
-    def init(self, driver):
-        old_init(self, driver)
+        def init(self, driver):
+            old_init(self, driver)
 
-        # Patch the instance, only if the driver needs it.
-        if getattr(driver, CHROMEDRIVER_ELEMENT_CENTER_PATCH_FLAG, None):
-            self.move_to_element = types.MethodType(move_to_element, self)
+            # Patch the instance, only if the driver needs it.
+            if getattr(driver, CHROMEDRIVER_ELEMENT_CENTER_PATCH_FLAG, None):
+                self.move_to_element = types.MethodType(move_to_element,
+                                                        self)
 
-    ActionChains.__init__ = init
+        ActionChains.__init__ = init
 
-    # Mark ActionChains as patched!
-    setattr(ActionChains, patch_name, True)
+        # Mark ActionChains as patched!
+        setattr(ActionChains, patch_name, True)
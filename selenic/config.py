@@ -1,5 +1,7 @@
-from selenium import webdriver
 import collections
+import fnmatch
+import itertools
+import operator
 
 class ConfigTuple(collections.namedtuple(
         'ConfigTuple',
@@ -9,18 +11,33 @@ class ConfigTuple(collections.namedtuple(
         return self.platform + separator + self.browser + separator \
             + self.version
 
-configs = collections.OrderedDict()
-_configs_by_platform = {}
-_configs_by_browser = {}
-_configs_by_version = {}
-
 _BROWSER_ABBRS = {
     "IE": "INTERNETEXPLORER",
     "FF": "FIREFOX",
     "CH": "CHROME"
 }
 
-def get_config(platform=None, browser=None, version=None):
+_FIELDS = ConfigTuple._fields
+
+# The patterns under which a configuration is indexed. Each pattern is
+# a tuple of booleans which says which fields of ``ConfigTuple`` are
+# part of the index key. There are 8 patterns: from no field (all
+# configurations) to all fields.
+_PATTERNS = tuple(itertools.product((False, True), repeat=len(_FIELDS)))
+
+_WILDCARD_CHARS = frozenset("*?[")
+
+_VERSION_OPS = collections.OrderedDict((
+    (">=", operator.ge),
+    ("<=", operator.le),
+    ("==", operator.eq),
+    ("!=", operator.ne),
+    (">", operator.gt),
+    ("<", operator.lt),
+))
+
+
+def _normalize(platform, browser, version):
     browser = browser.upper() if browser is not None else None
     platform = platform.upper() if platform is not None else None
 
@@ -28,45 +45,223 @@ def get_config(platform=None, browser=None, version=None):
     browser = _BROWSER_ABBRS.get(browser, browser) \
         if browser is not None else None
 
-    if platform is not None and browser is not None and version is not None:
-        return configs[ConfigTuple(platform, browser, version)]
+    return (platform, browser, version)
+
+
+def _parse_version(version):
+    """
+    :returns: The version as a tuple of integers, or ``None`` if the
+              version is not made of dot-separated numbers.
+    """
+    try:
+        return tuple(int(part) for part in version.split("."))
+    except ValueError:
+        return None
+
+
+def _is_range(spec):
+    return spec[:1] in ("<", ">", "=", "!")
+
+
+def _parse_range(spec):
+    """
+    Parses a version range like ``">=60,<70"``.
+
+    :returns: A list of ``(op, version)`` pairs.
+    """
+    ret = []
+    for clause in spec.split(","):
+        clause = clause.strip()
+        for (symbol, op) in _VERSION_OPS.items():
+            if clause.startswith(symbol):
+                break
+        else:
+            raise ValueError("invalid version range: " + spec)
+
+        version = _parse_version(clause[len(symbol):].strip())
+        if version is None:
+            raise ValueError("invalid version range: " + spec)
+        ret.append((op, version))
+    return ret
+
+
+def _is_exact(value, version):
+    return value is not None and not (version and _is_range(value)) and \
+        _WILDCARD_CHARS.isdisjoint(value)
+
+
+def _matcher(value, version):
+    """
+    :returns: A function which tests whether a field of a
+              configuration matches the value of a query, or ``None``
+              if the value matches everything.
+    """
+    if value is None:
+        return None
+
+    if version and _is_range(value):
+        clauses = _parse_range(value)
+
+        def match(candidate):
+            parsed = _parse_version(candidate)
+            if parsed is None:
+                return False
+            # Pad with zeros so that "60" and "60.0" compare equal.
+            width = max([len(parsed)] + [len(v) for (_, v) in clauses])
+            parsed += (0, ) * (width - len(parsed))
+            return all(op(parsed, v + (0, ) * (width - len(v)))
+                       for (op, v) in clauses)
+        return match
+
+    if not _WILDCARD_CHARS.isdisjoint(value):
+        return lambda candidate: fnmatch.fnmatchcase(candidate, value)
+
+    return lambda candidate: candidate == value
+
+
+class ConfigRegistry(object):
+
+    def __init__(self, configs=None):
+        """
+        The registry of the configurations created with
+        :class:`Config`. Each configuration is indexed under all
+        combinations of its platform, browser and version, so that
+        looking up configurations by any combination of these fields
+        does not require scanning or intersecting sets.
+
+        Iteration and queries return the configurations in the order
+        in which they were first registered.
 
-    ret = None
-    if browser is not None:
-        if browser not in _configs_by_browser:
-            raise ValueError("no configuration for browser: " + browser)
-        ret = _configs_by_browser[browser]
+        :param configs: The mapping in which to store the
+                        configurations, keyed by :class:`ConfigTuple`.
+        :type configs: :class:`collections.OrderedDict`
+        """
+        self.configs = configs if configs is not None \
+            else collections.OrderedDict()
+        self._index = {}
+        for config in list(self.configs.values()):
+            self._add_to_index(config)
 
-    if version is not None:
-        if version not in _configs_by_version:
-            raise ValueError("no configuration for version: " + version)
-        by_version = _configs_by_version[version]
-        ret = by_version if ret is None else ret & by_version
+    def _add_to_index(self, config):
+        key = ConfigTuple(config.platform, config.browser, config.version)
+        for pattern in _PATTERNS:
+            index_key = (pattern, ) + tuple(
+                value if used else None
+                for (used, value) in zip(pattern, key))
+            self._index.setdefault(index_key, []).append(key)
 
-    if platform is not None:
-        if platform not in _configs_by_platform:
-            raise ValueError("no configuration for platform: " + platform)
-        by_platform = _configs_by_platform[platform]
-        ret = by_platform if ret is None else ret & by_platform
+    def add(self, config):
+        """
+        Registers a configuration. A configuration which has the same
+        platform, browser and version as ``config`` is replaced, and
+        ``config`` keeps its position in the iteration order.
 
-    if len(ret) == 0:
-        raise ValueError("no configuration for the combination: {0}, {1}, {2}"
-                         .format(platform, browser, version))
-    elif len(ret) > 1:
-        raise ValueError("the combination {0}, {1}, {2} is ambiguous"
-                         .format(platform, browser, version))
+        :param config: The configuration.
+        :type config: :class:`Config`
+        """
+        key = ConfigTuple(config.platform, config.browser, config.version)
+        if key not in self.configs:
+            self._add_to_index(config)
+        self.configs[key] = config
 
-    return ret.pop()
+    def clear(self):
+        """
+        Forgets all configurations.
+        """
+        self.configs.clear()
+        self._index.clear()
+
+    def _keys(self, platform, browser, version):
+        key = (platform, browser, version)
+        pattern = tuple(value is not None for value in key)
+        return self._index.get((pattern, ) + key, [])
+
+    def get(self, platform=None, browser=None, version=None):
+        """
+        See :func:`get_config`.
+        """
+        (platform, browser, version) = _normalize(platform, browser, version)
+
+        if platform is not None and browser is not None and \
+           version is not None:
+            return self.configs[ConfigTuple(platform, browser, version)]
+
+        for (name, value) in (("browser", browser), ("version", version),
+                              ("platform", platform)):
+            if value is not None and \
+               not self._keys(*[value if field == name else None
+                                for field in _FIELDS]):
+                raise ValueError("no configuration for {0}: {1}"
+                                 .format(name, value))
+
+        keys = self._keys(platform, browser, version)
+        if len(keys) == 0:
+            raise ValueError("no configuration for the combination: "
+                             "{0}, {1}, {2}"
+                             .format(platform, browser, version))
+        elif len(keys) > 1:
+            raise ValueError("the combination {0}, {1}, {2} is ambiguous"
+                             .format(platform, browser, version))
+
+        return self.configs[keys[0]]
+
+    def query(self, platform=None, browser=None, version=None):
+        """
+        Finds the configurations that match a query. Each field of the
+        query may be ``None`` to match everything, a value to match
+        exactly, or a shell-style wildcard pattern as understood by
+        :mod:`fnmatch` (e.g. ``"WIN*"``). The platform and browser are
+        matched case-insensitively and browser abbreviations are
+        resolved, as in :func:`get_config`. The version may also be a
+        comma-separated list of comparisons, like ``">=60,<70"``,
+        which only match versions made of dot-separated numbers.
+
+        :returns: The matching configurations, in the order in which
+                  they were registered.
+        :rtype: :class:`list` of :class:`Config`
+        :raises ValueError: If the version range cannot be parsed.
+        """
+        (platform, browser, version) = _normalize(platform, browser, version)
+        values = (platform, browser, version)
+
+        # We use the index for the fields that must match exactly, and
+        # test the other fields one configuration at a time.
+        exact = [_is_exact(value, field == "version")
+                 for (field, value) in zip(_FIELDS, values)]
+        keys = self._keys(*[value if is_exact else None
+                            for (value, is_exact) in zip(values, exact)])
+
+        matchers = [(ix, _matcher(value, field == "version"))
+                    for (ix, (field, value)) in enumerate(zip(_FIELDS, values))
+                    if value is not None and not exact[ix]]
+
+        return [self.configs[key] for key in keys
+                if all(match(key[ix]) for (ix, match) in matchers)]
+
+    def __iter__(self):
+        return iter(list(self.configs.values()))
+
+    def __len__(self):
+        return len(self.configs)
+
+
+configs = collections.OrderedDict()
+registry = ConfigRegistry(configs)
+
+
+def get_config(platform=None, browser=None, version=None):
+    return registry.get(platform, browser, version)
+
+
+def query_configs(platform=None, browser=None, version=None):
+    """
+    See :meth:`ConfigRegistry.query`.
+    """
+    return registry.query(platform, browser, version)
 
 
 def forget():
-    # pylint: disable=global-statement
-    global configs, _configs_by_platform, _configs_by_browser, \
-        _configs_by_version
-    configs = {}
-    _configs_by_platform = {}
-    _configs_by_browser = {}
-    _configs_by_version = {}
+    registry.clear()
 
 
 class Config(object):
@@ -77,11 +272,7 @@ class Config(object):
         if desired_capabilities is None:
             desired_capabilities = {}
 
-        browser = browser.upper() if browser is not None else None
-        platform = platform.upper() if platform is not None else None
-
-        # Resolve abbreviation if it exists...
-        browser = _BROWSER_ABBRS.get(browser, browser)
+        (platform, browser, version) = _normalize(platform, browser, version)
 
         self.platform = platform
         self.browser = browser
@@ -89,25 +280,13 @@ class Config(object):
         self.remote = remote
         self.desired_capabilities = desired_capabilities
 
-        key = ConfigTuple(platform, browser, version)
-        old = configs.get(key, None)
-        configs[key] = self
-
-        ps = _configs_by_platform.setdefault(platform, set())
-        ps.add(self)
-
-        bs = _configs_by_browser.setdefault(browser, set())
-        bs.add(self)
-
-        vs = _configs_by_version.setdefault(version, set())
-        vs.add(self)
-
-        if old:
-            ps.remove(old)
-            bs.remove(old)
-            vs.remove(old)
+        registry.add(self)
 
     def make_selenium_desired_capabilities(self):
+        # Importing Selenium is costly, and this module must be cheap
+        # to import.
+        from selenium import webdriver
+
         ret = dict(getattr(webdriver.DesiredCapabilities, self.browser))
 
         ret.update(self.desired_capabilities)
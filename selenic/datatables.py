@@ -1,6 +1,6 @@
+import itertools
 import re
 
-from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import TimeoutException
 
 from .util import Condition, Result
@@ -9,45 +9,382 @@ from .tables import Table
 
 info_re = re.compile(r"^Showing (\d+) to (\d+) of (\d+) entries")
 
-_REDRAW_SETUP_FUNCTION = """
-function redrawSetup(cssid, done) {
-    window.__selenium_test_redrawn = false;
+_REDRAW_TRACKERS_FUNCTION = """
+function redrawTrackers() {
+    var trackers = window.__selenic_redraw_trackers;
+    if (!trackers)
+        trackers = window.__selenic_redraw_trackers = {};
+    return trackers;
+}
+
+function dropTracker(trackers, token) {
+    var tracker = trackers[token];
+    if (!tracker)
+        return;
+    tracker.cancel();
+    delete trackers[token];
+}
+"""
+
+_REDRAW_SETUP_SNIPPET = _REDRAW_TRACKERS_FUNCTION + """
+var tables = arguments[0];
+var done = arguments[arguments.length - 1];
+var trackers = redrawTrackers();
+var pending = tables.length;
+
+function armed() {
+    if (--pending === 0)
+        done();
+}
+
+function setup(cssid, token) {
+    // A check on the same table that was never waited on would
+    // otherwise stay in the page forever.
+    Object.keys(trackers).forEach(function (old) {
+        if (trackers[old].cssid === cssid)
+            dropTracker(trackers, old);
+    });
+
+    var tracker = trackers[token] = {cssid: cssid, redrawn: false,
+                                     waiters: []};
+    var $table = jQuery(document.getElementById(cssid));
     var processing = document.getElementById(cssid + "_processing");
-    var table = document.getElementById(cssid);
-    function check() {
-        // We do this to make sure that the table is not currently
-        // refreshing when we put in our event handler.
-        if (processing.style.display !== "none") {
-            setTimeout(check, 100);
-            return;
-        }
-        jQuery(table).one("draw.dt", function () {
-            window.__selenium_test_redrawn = true;
+
+    function onDraw() {
+        tracker.redrawn = true;
+        tracker.cancel = function () {};
+        tracker.waiters.forEach(function (waiter) {
+            waiter();
         });
-        done();
+        tracker.waiters = [];
+    }
+
+    function arm() {
+        $table.one("draw.dt", onDraw);
+        tracker.cancel = function () {
+            $table.off("draw.dt", onDraw);
+        };
+        armed();
+    }
+
+    function onProcessing(ev, settings, isProcessing) {
+        if (isProcessing)
+            return;
+        $table.off("processing.dt", onProcessing);
+        arm();
+    }
+
+    // We do this to make sure that the table is not currently
+    // refreshing when we put in our event handler.
+    if (processing && processing.style.display !== "none") {
+        $table.on("processing.dt", onProcessing);
+        tracker.cancel = function () {
+            $table.off("processing.dt", onProcessing);
+        };
+    }
+    else
+        arm();
+}
+
+if (!tables.length) {
+    done();
+    return;
+}
+
+tables.forEach(function (table) {
+    setup(table[0], table[1]);
+});
+"""
+
+_REDRAW_CHECK_SNIPPET = _REDRAW_TRACKERS_FUNCTION + """
+var tokens = arguments[0];
+var done = arguments[arguments.length - 1];
+var trackers = redrawTrackers();
+var pending = tokens.length;
+
+if (!pending) {
+    done();
+    return;
+}
+
+tokens.forEach(function (token) {
+    var tracker = trackers[token];
+    if (!tracker)
+        throw new Error("no redraw check set up for token " + token);
+
+    function redrawn() {
+        delete trackers[token];
+        if (--pending === 0)
+            done();
     }
-    check();
+
+    if (tracker.redrawn)
+        redrawn();
+    else
+        tracker.waiters.push(redrawn);
+});
+"""
+
+_REDRAW_DROP_SNIPPET = _REDRAW_TRACKERS_FUNCTION + """
+var trackers = redrawTrackers();
+arguments[0].forEach(function (token) {
+    dropTracker(trackers, token);
+});
+"""
+
+_redraw_tokens = itertools.count()
+
+
+def setup_redraw_checks(util, tables):
+    """
+    Sets up redraw checks on several tables in a single round trip.
+
+    :param util: The util object to use to access Selenium.
+    :type util: :class:`selenic.util.Util`
+    :param tables: The tables.
+    :type tables: :class:`list` of :class:`Datatable`
+    :returns: The tokens that identify the checks, in the same order
+              as ``tables``. Pass them to :func:`wait_for_redraws`.
+    :rtype: :class:`list` of :class:`str`
+    """
+    pairs = [(table.cssid, "{0}-{1}".format(table.cssid, next(_redraw_tokens)))
+             for table in tables]
+    util.driver.execute_async_script(_REDRAW_SETUP_SNIPPET,
+                                     [list(pair) for pair in pairs])
+    tokens = [token for (_, token) in pairs]
+    for (table, token) in zip(tables, tokens):
+        table.redraw_token = token
+    return tokens
+
+
+def wait_for_redraws(util, tokens):
+    """
+    Waits for the redraws of the checks identified by ``tokens``, in a
+    single round trip. The page resolves the wait as soon as the last
+    table is redrawn, without polling. If the wait times out, the
+    checks are dropped.
+
+    :param util: The util object to use to access Selenium.
+    :type util: :class:`selenic.util.Util`
+    :param tokens: The tokens returned by :func:`setup_redraw_checks`
+                   or :meth:`Datatable.setup_redraw_check`.
+    :type tokens: :class:`list` of :class:`str`
+    :raises selenium.common.exceptions.TimeoutException: If the
+            timeout occurs.
+    """
+    tokens = list(tokens)
+    try:
+        util.driver.execute_async_script(_REDRAW_CHECK_SNIPPET, tokens)
+    except TimeoutException:
+        util.driver.execute_script(_REDRAW_DROP_SNIPPET, tokens)
+        raise
+
+
+_RESULTS_SNIPPET = """
+var cssid = arguments[0];
+var expected = arguments[1];
+var timeout = arguments[2];
+var done = arguments[arguments.length - 1];
+var $table = jQuery(document.getElementById(cssid));
+var api = $table.DataTable();
+var processing = document.getElementById(cssid + "_processing");
+var timer;
+
+function total() {
+    return api.page.info().recordsDisplay;
+}
+
+function finish() {
+    clearTimeout(timer);
+    $table.off("draw.dt", check);
+    done(total());
+}
+
+function check() {
+    if (total() === expected)
+        finish();
+}
+
+if ((!processing || processing.style.display === "none") &&
+    total() === expected) {
+    done(expected);
+    return;
+}
+
+$table.on("draw.dt", check);
+timer = setTimeout(finish, timeout);
+"""
+
+_RECORDS_DISPLAY_SNIPPET = """
+return jQuery(document.getElementById(arguments[0]))
+    .DataTable().page.info().recordsDisplay;
+"""
+
+_ROWS_FUNCTIONS = """
+function rowsText(api, rows, columns) {
+    // We use an inert document so that rendering HTML does not load
+    // anything or run event handlers.
+    var scratch = document.implementation.createHTMLDocument("")
+        .createElement("div");
+    var cols = api.columns(columns === null ? undefined : columns)
+        .indexes().toArray();
+    return rows.map(function (row) {
+        return cols.map(function (col) {
+            var value = api.cell(row, col).render("display");
+            if (value === null || value === undefined)
+                return "";
+            scratch.innerHTML = String(value);
+            return scratch.textContent.trim();
+        });
+    });
+}
+"""
+
+_ROWS_INFO_SNIPPET = """
+var api = jQuery(document.getElementById(arguments[0])).DataTable();
+var info = api.page.info();
+return {
+    serverSide: !!api.settings()[0].oFeatures.bServerSide,
+    page: info.page,
+    pages: info.pages
 };
 """
 
-_REDRAW_SETUP_SNIPPET = _REDRAW_SETUP_FUNCTION + """
-redrawSetup(arguments[0], arguments[1]);
+_ROWS_SNIPPET = _ROWS_FUNCTIONS + """
+var api = jQuery(document.getElementById(arguments[0])).DataTable();
+var start = arguments[1];
+var count = arguments[2];
+var columns = arguments[3];
+var rows = api.rows({search: "applied", order: "applied"}).indexes()
+    .toArray();
+return {
+    total: rows.length,
+    rows: rowsText(api, rows.slice(start, start + count), columns)
+};
 """
 
-_REDRAW_CHECK_SNIPPET = """
-var cb = arguments[0];
-function test() {
-    if (window.__selenium_test_redrawn) {
-        cb();
+_PAGE_ROWS_SNIPPET = _ROWS_FUNCTIONS + """
+var $table = jQuery(document.getElementById(arguments[0]));
+var api = $table.DataTable();
+var page = arguments[1];
+var columns = arguments[2];
+var done = arguments[arguments.length - 1];
+$table.one("draw.dt", function () {
+    if (columns === false) {
+        done(null);
         return;
     }
-    setTimeout(test, 100);
+    var rows = api.rows({page: "current"}).indexes().toArray();
+    done(rowsText(api, rows, columns));
+});
+api.page(page).draw("page");
+"""
+
+_RESULT_ROWS_SNIPPET = """
+var rows = document.querySelectorAll(arguments[0]);
+var start = arguments[1];
+var stop = arguments[2];
+var step = arguments[3] === null ? 1 : arguments[3];
+var length = rows.length;
+if (!length)
+    return null;
+
+// This follows the semantics of slice.indices in Python.
+function normalize(ix, dflt, lower, upper) {
+    if (ix === null)
+        return dflt;
+    if (ix < 0) {
+        ix += length;
+        return ix < lower ? lower : ix;
+    }
+    return ix > upper ? upper : ix;
+}
+
+if (step > 0) {
+    start = normalize(start, 0, 0, length);
+    stop = normalize(stop, length, 0, length);
+}
+else {
+    start = normalize(start, length - 1, -1, length - 1);
+    stop = normalize(stop, -1, -1, length - 1);
 }
-test();
+
+var ret = [];
+for (var i = start; step > 0 ? i < stop : i > stop; i += step)
+    ret.push(rows[i]);
+return {rows: ret};
+"""
+
+_SEARCH_SNIPPET = """
+var $table = jQuery(document.getElementById(arguments[0]));
+var api = $table.DataTable();
+var searches = arguments[1];
+var done = arguments[arguments.length - 1];
+
+// The value for a ``select`` field is the text of an option, but
+// the page searches for the value of the option selected, so we
+// search for that too. We resolve all the values before setting any
+// search, so that a missing option leaves the table alone.
+var resolved = searches.map(function (search) {
+    var value = search[1];
+    var field = search[2];
+    if (!field || field.localName !== "select")
+        return {column: search[0], value: value, field: field, index: -1};
+
+    for (var i = 0, option; (option = field.options[i]); ++i) {
+        if (option.text.trim() === value.trim())
+            return {column: search[0], value: option.value, field: field,
+                    index: i};
+    }
+    throw new Error("cannot locate option with visible text: " + value);
+});
+
+resolved.forEach(function (search) {
+    if (search.column === null)
+        api.search(search.value);
+    else
+        api.column(search.column).search(search.value);
+
+    // Keep the field in sync with the search.
+    var field = search.field;
+    if (!field)
+        return;
+    if (search.index > -1)
+        field.selectedIndex = search.index;
+    else
+        field.value = search.value;
+});
+
+$table.one("draw.dt", function () {
+    done();
+});
+api.draw();
 """
 
+
 class Datatable(Table):
 
+    filter_columns = None
+    """
+    Maps the names of search fields to the DataTables column selectors
+    (e.g. a column index) of the columns they search. ``None`` as a
+    selector stands for the global search. When all the fields passed
+    to :meth:`apply_filters` are mapped here, the searches are set
+    through the DataTables API.
+    """
+
+    results_from_api = False
+    """
+    When ``True``, :meth:`wait_for_results` gets the number of results
+    from the DataTables API rather than from the information text
+    shown below the table.
+    """
+
+    redraw_token = None
+    """
+    The token of the last redraw check set up on this table.
+    """
+
     def __init__(self, *args, **kwargs):
         super(Datatable, self).__init__(*args, **kwargs)
         self.field_selectors.append("#" + self.cssid + "_filter")
@@ -90,13 +427,40 @@ class Datatable(Table):
             return False
 
     def setup_redraw_check(self):
-        self.util.driver.execute_async_script(_REDRAW_SETUP_SNIPPET,
-                                              self.cssid)
+        """
+        Sets up a check that detects the next redraw of the table. The
+        check is identified by a token, so checks on several tables
+        can be pending at the same time.
 
-    def wait_for_redraw(self):
-        self.util.driver.execute_async_script(_REDRAW_CHECK_SNIPPET)
+        :returns: The token of the check. It is also stored in
+                  :attr:`redraw_token`.
+        :rtype: :class:`str`
+        """
+        return setup_redraw_checks(self.util, [self])[0]
+
+    def wait_for_redraw(self, token=None):
+        """
+        Waits for the redraw detected by a check.
+
+        :param token: The token of the check. Defaults to the token of
+                      the last check set up on this table.
+        :type token: :class:`str`
+        """
+        wait_for_redraws(self.util, [token or self.redraw_token])
 
     def wait_for_results(self, expected_total):
+        """
+        Waits until the table shows ``expected_total`` results, or the
+        timeout occurs.
+
+        :param expected_total: The number of results expected.
+        :type expected_total: :class:`int`
+        :returns: The number of results last seen.
+        :rtype: :class:`int`
+        """
+        if self.results_from_api:
+            return self.wait_for_results_from_api(expected_total)
+
         def check(driver):
             text = driver.find_element_by_id(self.cssid + "_info").text
             match = info_re.match(text)
@@ -110,6 +474,183 @@ class Datatable(Table):
 
         return result.payload
 
+    def wait_for_results_from_api(self, expected_total):
+        """
+        Like :meth:`wait_for_results` but the number of results is
+        read from the ``recordsDisplay`` value of the DataTables
+        API. Rather than poll, the page checks the number of results
+        anew on each ``draw.dt`` event. The whole wait is a single
+        round trip, and it does not depend on the language of the
+        information text.
+
+        :param expected_total: The number of results expected.
+        :type expected_total: :class:`int`
+        :returns: The number of results last seen.
+        :rtype: :class:`int`
+        """
+        timeout = self.util.timeout
+        driver = self.util.driver
+        try:
+            with self.util.allow_script_timeout(timeout):
+                return driver.execute_async_script(
+                    _RESULTS_SNIPPET, self.cssid, expected_total,
+                    int(timeout * 1000))
+        except TimeoutException:
+            # Selenium timed out the script before the page did.
+            return driver.execute_script(_RECORDS_DISPLAY_SNIPPET,
+                                         self.cssid)
+
+    def apply_filters(self, filters):
+        """
+        Like :meth:`Table.apply_filters` but if all the fields are
+        mapped by :attr:`filter_columns`, the searches are set through
+        the DataTables API and the table is redrawn just once. The
+        search fields are updated to show the values searched. As
+        when the option is selected by the user, the search for a
+        ``select`` field is for the value of the option whose visible
+        text is given.
+        """
+        if not filters:
+            return
+
+        mapping = self.filter_columns or {}
+        if not all(name in mapping for name in filters):
+            super(Datatable, self).apply_filters(filters)
+            return
+
+        fields = self._search_fields
+        self._search([[mapping[name], value, fields.get(name)]
+                      for (name, value) in filters.items()])
+
+    def apply_column_searches(self, searches):
+        """
+        Sets searches through the DataTables API, and waits for the
+        single redraw that applies them all.
+
+        :param searches: Maps DataTables column selectors (e.g. a
+                         column index) to the values to search. The
+                         selector ``None`` stands for the global search.
+        :type searches: :class:`dict`
+        """
+        self._search([[column, value, None]
+                      for (column, value) in searches.items()])
+
+    def _search(self, searches):
+        """
+        Sets searches through the DataTables API and waits for the
+        redraw, which may involve a request to the server.
+
+        :param searches: The searches. Each is a list of a column
+                         selector, a value and the search field to
+                         update, or ``None``.
+        :type searches: :class:`list`
+        """
+        timeout = self.util.timeout
+        with self.util.allow_script_timeout(timeout):
+            self.util.driver.execute_async_script(_SEARCH_SNIPPET,
+                                                  self.cssid, searches)
+
+    def iter_rows(self, chunk=500, columns=None):
+        """
+        Iterates over the rows of the table, across all pages, in the
+        order in which they are displayed and with the current search
+        applied. The rows are read through the DataTables API and are
+        transferred as plain strings, a chunk at a time, rather than
+        as ``WebElement`` objects. Memory use is bounded by the size
+        of a chunk.
+
+        For tables that use server-side processing, the data only
+        exists for the page being displayed, so the table is paged
+        through and redrawn once per page, ``chunk`` is ignored, and
+        the page initially displayed is restored at the end. If you
+        stop iterating early, close the iterator (e.g. with
+        :func:`contextlib.closing`) while the driver is still alive, so
+        that the page is restored. An iterator that is merely
+        garbage-collected restores the page only if it still can.
+
+        :param chunk: The number of rows to fetch per round trip.
+        :type chunk: :class:`int`
+        :param columns: The columns to read. Anything that the
+                        DataTables ``columns()`` method accepts as a
+                        column selector can be used, e.g. a list of
+                        column indexes. ``None`` reads all columns.
+        :returns: An iterator over the rows. Each row is a list of
+                  the texts of its cells.
+        """
+        driver = self.util.driver
+        info = driver.execute_script(_ROWS_INFO_SNIPPET, self.cssid)
+
+        if not info["serverSide"]:
+            start = 0
+            while True:
+                ret = driver.execute_script(_ROWS_SNIPPET, self.cssid, start,
+                                            chunk, columns)
+                rows = ret["rows"]
+                for row in rows:
+                    yield row
+                start += len(rows)
+                if not rows or start >= ret["total"]:
+                    break
+            return
+
+        def draw_page(page, columns):
+            # Fetching a page from the server may take longer than the
+            # script timeout allows.
+            with self.util.allow_script_timeout(self.util.timeout):
+                return driver.execute_async_script(
+                    _PAGE_ROWS_SNIPPET, self.cssid, page, columns)
+
+        completed = False
+        try:
+            for page in range(info["pages"]):
+                for row in draw_page(page, columns):
+                    yield row
+            completed = True
+        finally:
+            try:
+                draw_page(info["page"], False)
+            except Exception:  # pylint: disable=broad-except
+                # If the iteration was abandoned, we may be run when
+                # the iterator is garbage-collected, after the driver
+                # quit, or while another error propagates. Restoring
+                # the page is then best effort.
+                if completed:
+                    raise
+
     def get_result(self, number):
-        return self.util.find_elements((By.CSS_SELECTOR,
-                                        "#" + self.cssid + ">tbody>tr"))[number]
+        """
+        Gets rows of the table. This waits until the table has rows,
+        and only the rows requested are transferred from the page.
+
+        :param number: The index of the row to get, or a slice to get
+                       a range of rows. Indexes and slices have the
+                       same meaning as for Python lists.
+        :type number: :class:`int` or :class:`slice`
+        :returns: The row, or a list of rows if ``number`` is a slice.
+        :rtype: :class:`selenium.webdriver.remote.webelement.WebElement`
+                or :class:`list` of them.
+        :raises IndexError: If ``number`` is an index which is out of
+                            range.
+        :raises ValueError: If ``number`` is a slice whose step is 0.
+        """
+        if isinstance(number, slice):
+            # The page would loop forever.
+            if number.step == 0:
+                raise ValueError("slice step cannot be zero")
+            indices = (number.start, number.stop, number.step)
+        else:
+            # -1 is a special case because -1 + 1 is 0...
+            indices = (number, number + 1 if number != -1 else None, None)
+
+        # The script returns null until the table has rows.
+        rows = self.util.wait(lambda driver: driver.execute_script(
+            _RESULT_ROWS_SNIPPET, "#" + self.cssid + ">tbody>tr",
+            *indices))["rows"]
+
+        if isinstance(number, slice):
+            return rows
+
+        if not rows:
+            raise IndexError("list index out of range")
+
+        return rows[0]
@@ -0,0 +1,258 @@
+import collections
+import contextlib
+import json
+import sys
+import threading
+import time
+
+#
+# The upper bounds of the buckets of the latency histograms, in
+# milliseconds. The last bucket catches everything above the last
+# bound.
+#
+DEFAULT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+DIRECT = "<direct>"
+"""
+The helper name under which commands that were not issued by a
+selenic helper are recorded.
+"""
+
+_RECORDER_ATTR = "_selenic_command_recorder"
+
+
+class _Stats(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(buckets) + 1)
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        ms = duration * 1000
+        for (ix, bound) in enumerate(self.buckets):
+            if ms <= bound:
+                break
+        else:
+            ix = len(self.buckets)
+        self.histogram[ix] += 1
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "histogram": list(self.histogram),
+        }
+
+
+class _TestRecord(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.all = _Stats(buckets)
+        self.by_command = collections.OrderedDict()
+        self.by_helper = collections.OrderedDict()
+
+    def add(self, command, helper, duration):
+        self.all.add(duration)
+
+        stats = self.by_command.get(command)
+        if stats is None:
+            stats = self.by_command[command] = _Stats(self.buckets)
+        stats.add(duration)
+
+        helper_rec = self.by_helper.get(helper)
+        if helper_rec is None:
+            helper_rec = self.by_helper[helper] = \
+                (_Stats(self.buckets), collections.Counter())
+        helper_rec[0].add(duration)
+        helper_rec[1][command] += 1
+
+
+def _find_helper():
+    """
+    Finds the selenic helper responsible for the current command. This
+    is the outermost selenic frame in the sequence of selenic and
+    selenium frames that precede the command.
+    """
+    helper = DIRECT
+    frame = sys._getframe(2)  # pylint: disable=protected-access
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("selenic.") and module != __name__:
+            code = frame.f_code
+            helper = module + "." + getattr(code, "co_qualname",
+                                            code.co_name)
+        elif not module.startswith("selenium."):
+            break
+        frame = frame.f_back
+    return helper
+
+
+class CommandRecorder(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Records the WebDriver commands issued by the drivers on which
+        it is installed. Each command is counted by type (the name of
+        the WebDriver command) and by the selenic helper which issued
+        it, and its latency is added to histograms. Commands are
+        grouped by test: see :meth:`test`.
+
+        :param buckets: The upper bounds of the buckets of the latency
+                        histograms, in milliseconds, in increasing
+                        order.
+        :type buckets: :class:`tuple` of numbers
+        """
+        self.buckets = tuple(buckets)
+        self._tests = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def current_test(self):
+        """
+        The identifier of the test under which the commands issued by
+        the current thread are recorded. Each thread has its own
+        current test, so tests that run in different threads are
+        recorded separately. A new thread starts with ``None``.
+        """
+        return getattr(self._local, "test_id", None)
+
+    @current_test.setter
+    def current_test(self, test_id):
+        self._local.test_id = test_id
+
+    def install(self, driver):
+        """
+        Installs the recorder on a driver. Installing the same
+        recorder twice on a driver is a no-op.
+
+        :param driver: The driver.
+        :raises ValueError: If another recorder is installed on the
+                            driver.
+        """
+        executor = driver.command_executor
+        installed = getattr(executor, _RECORDER_ATTR, None)
+        if installed is self:
+            return
+
+        if installed is not None:
+            raise ValueError("another recorder is installed on the driver")
+
+        original = executor.execute
+
+        def execute(command, params):
+            start = time.monotonic()
+            try:
+                return original(command, params)
+            finally:
+                self.record(command, _find_helper(),
+                            time.monotonic() - start)
+
+        executor.execute = execute
+        setattr(executor, _RECORDER_ATTR, self)
+
+    def record(self, command, helper, duration):
+        """
+        Records a command in the current test.
+
+        :param command: The name of the command.
+        :type command: :class:`str`
+        :param helper: The name of the helper which issued the command.
+        :type helper: :class:`str`
+        :param duration: The time the command took, in seconds.
+        :type duration: :class:`float`
+        """
+        with self._lock:
+            test = self._tests.get(self.current_test)
+            if test is None:
+                test = self._tests[self.current_test] = \
+                    _TestRecord(self.buckets)
+            test.add(command, helper, duration)
+
+    @contextlib.contextmanager
+    def test(self, test_id):
+        """
+        A context manager which records the commands issued in the
+        block under ``test_id``, in the current thread. Commands issued
+        outside such a block are recorded under ``None``.
+
+        :param test_id: The identifier of the test.
+        :type test_id: :class:`str`
+        """
+        previous = self.current_test
+        self.current_test = test_id
+        try:
+            yield
+        finally:
+            self.current_test = previous
+
+    def summary(self, test_id):
+        """
+        :param test_id: The identifier of the test.
+        :type test_id: :class:`str`
+        :returns: The summary of the commands recorded for the
+                  test. The field ``all`` holds the statistics for
+                  all commands. The field ``by_command`` maps command
+                  names to statistics. The field ``by_helper`` maps
+                  helper names to statistics, with an added field
+                  ``commands`` giving the number of commands of each
+                  type issued by the helper. Statistics are
+                  dictionaries with the fields ``count``, ``total``,
+                  ``mean``, ``max`` (times are in seconds) and
+                  ``histogram`` (counts per bucket).
+        :rtype: :class:`dict`
+        :raises KeyError: If nothing was recorded for the test.
+        """
+        with self._lock:
+            test = self._tests[test_id]
+            by_helper = collections.OrderedDict()
+            for (helper, (stats, commands)) in test.by_helper.items():
+                entry = stats.as_dict()
+                entry["commands"] = dict(commands)
+                by_helper[helper] = entry
+
+            return {
+                "test": test_id,
+                "all": test.all.as_dict(),
+                "by_command": collections.OrderedDict(
+                    (command, stats.as_dict())
+                    for (command, stats) in test.by_command.items()),
+                "by_helper": by_helper,
+            }
+
+    def summaries(self):
+        """
+        :returns: The summaries of all tests, in the order in which
+                  the tests first recorded a command.
+        :rtype: :class:`list` of :class:`dict`
+        """
+        with self._lock:
+            test_ids = list(self._tests.keys())
+        return [self.summary(test_id) for test_id in test_ids]
+
+    def export_json(self, path):
+        """
+        Writes the summaries of all tests to a JSON file.
+
+        :param path: The path of the file.
+        :type path: :class:`str`
+        """
+        with open(path, 'w') as out:
+            json.dump({"buckets": list(self.buckets),
+                       "tests": self.summaries()}, out, indent=2)
+
+    def reset(self):
+        """
+        Forgets everything recorded so far.
+        """
+        with self._lock:
+            self._tests.clear()
@@ -1,4 +1,18 @@
+import atexit
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
 import socket
+import subprocess
+import tempfile
+import threading
+
+_version_cache_lock = threading.Lock()
+_version_cache = {}
+
 
 def get_unused_port():
     """
@@ -22,3 +36,519 @@ def get_unused_port():
     port = sock.getsockname()[1]
     sock.close()
     return port
+
+
+PROC_NET_TCP_PATHS = ("/proc/net/tcp", "/proc/net/tcp6")
+
+
+def parse_proc_net_tcp(text):
+    """
+    Parses the content of ``/proc/net/tcp`` or ``/proc/net/tcp6``.
+
+    Sockets which do not belong to any process (e.g. those in the
+    ``TIME_WAIT`` state) have an inode of 0 and are skipped. They do
+    not prevent binding the port, and ``lsof`` does not report them
+    either.
+
+    :param text: The content of the file.
+    :type text: :class:`str`
+    :returns: The local ports of the sockets listed.
+    :rtype: :class:`set` of :class:`int`
+    """
+    ports = set()
+    # The first line is a header.
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 10:
+            continue
+        if fields[9] == "0":
+            continue
+        ports.add(int(fields[1].rsplit(":", 1)[1], 16))
+    return ports
+
+
+def get_local_ports(paths=PROC_NET_TCP_PATHS):
+    """
+    Gets the ports used locally by TCP sockets, in a single snapshot
+    read from ``/proc``.
+
+    :param paths: The files to read.
+    :type paths: :class:`tuple` of :class:`str`
+    :returns: The ports, or ``None`` if none of the files could be
+              read (e.g. on a platform which has no ``/proc``).
+    :rtype: :class:`set` of :class:`int`
+    """
+    ports = None
+    for path in paths:
+        try:
+            with open(path) as f:
+                text = f.read()
+        except OSError:
+            continue
+        ports = (ports or set()) | parse_proc_net_tcp(text)
+    return ports
+
+
+def lsof_uses_port(port):
+    """
+    Checks with ``lsof`` whether a port is used locally. This is much
+    slower than :func:`get_local_ports` and is meant for platforms
+    which have no ``/proc``.
+
+    :param port: The port.
+    :type port: :class:`int`
+    :returns: Whether the port is used.
+    :rtype: :class:`bool`
+    """
+    port_str = str(port)
+
+    # lsof will report a hit whenever *either* the source *or*
+    # the destination is using the port we are interested
+    # in. There does not seem to be a reliable way to tell
+    # lsof to just get ports used on the source side
+    # (localhost). We'd have to get all addresses on which the
+    # host can listen and list them all. Rather than do this,
+    # we check the output to see whether the port is used
+    # locally.
+    try:
+        out = subprocess.check_output(["lsof", "-n", "-P", "-i",
+                                       ":" + port_str]).decode("utf8")
+    except subprocess.CalledProcessError as ex:
+        # When lsof returns an empty list, the exit code is 1,
+        # even if there was no actual error. We handle this
+        # here.
+        if ex.returncode != 1:
+            # returncode other than 1 is a real error...
+            raise
+        # else we swallow the exception...
+        out = ""
+
+    # Slice in the next line to skip the header line.
+    for line in out.splitlines(True)[1:]:
+        # Grab the NAME column.
+        name = line.split()[8]
+        # The file is of the form ``source->destination``. We
+        # only care about the source.
+        src = name.split("->")[0]
+
+        if src.endswith(":" + port_str):
+            # We've found that we are actually using the port...
+            return True
+
+    return False
+
+
+def get_cache_dir():
+    """
+    :returns: The directory in which selenic caches data across
+              processes. This is ``SELENIC_CACHE_DIR`` if set in the
+              environment, otherwise ``selenic`` in the XDG cache
+              directory. The directory is not created by this
+              function.
+    :rtype: :class:`str`
+    """
+    ret = os.environ.get("SELENIC_CACHE_DIR")
+    if ret:
+        return ret
+
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "selenic")
+
+
+def probe_version(path):
+    """
+    Gets the output of ``<path> --version``. Running a binary is
+    costly, so the output is cached in memory and in the cache
+    directory (see :func:`get_cache_dir`), where other processes can
+    find it. The cache is keyed by the path, size and modification
+    time of the binary so that replacing the binary invalidates the
+    cache.
+
+    :param path: The path of the binary. If it is not a path, it is
+                 searched for in ``PATH``.
+    :type path: :class:`str`
+    :returns: The output of the binary, stripped.
+    :rtype: :class:`str`
+    """
+    resolved = shutil.which(path) or path
+    try:
+        stat = os.stat(resolved)
+    except OSError:
+        # We cannot key the cache. Let the binary report the problem.
+        return _run_version(path)
+
+    key = (os.path.realpath(resolved), stat.st_size, stat.st_mtime_ns)
+    with _version_cache_lock:
+        ret = _version_cache.get(key)
+    if ret is not None:
+        return ret
+
+    cache_path = os.path.join(
+        get_cache_dir(), "versions",
+        hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest() + ".json")
+    try:
+        with open(cache_path) as cache_file:
+            ret = json.load(cache_file)["output"]
+    except (OSError, ValueError, KeyError):
+        ret = _run_version(path)
+        try:
+            write_atomically(cache_path,
+                             json.dumps({"key": key, "output": ret}))
+        except OSError:
+            pass  # The cache is an optimization only.
+
+    with _version_cache_lock:
+        _version_cache[key] = ret
+    return ret
+
+
+def _run_version(path):
+    output = subprocess.check_output([path, "--version"])
+    return output.decode("utf8").strip()
+
+
+def write_atomically(path, content):
+    """
+    Writes a file so that readers see either the old or the new
+    content, never a partial file. The directory of the file is
+    created if needed.
+
+    :param path: The path of the file.
+    :type path: :class:`str`
+    :param content: The content to write.
+    :type content: :class:`str`
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    (fd, tmp) = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class PortAllocatorStats(object):
+
+    """
+    Statistics about the leases made by a :class:`PortAllocator`.
+    """
+
+    def __init__(self):
+        self.leases = 0
+        """The number of ports leased."""
+
+        self.attempts = 0
+        """The number of ports tried."""
+
+        self.contended = 0
+        """
+        The number of ports tried which were leased by another
+        allocator.
+        """
+
+        self.in_use = 0
+        """
+        The number of ports tried which were used by a socket, as seen
+        in ``/proc/net/tcp``.
+        """
+
+        self.reused = 0
+        """
+        The number of leases which handed out again a port already
+        leased by the same allocator.
+        """
+
+        self.returned = 0
+        """
+        The number of leases given back because their port was seen
+        bound by a socket.
+        """
+
+        self.failures = 0
+        """The number of calls to :meth:`PortAllocator.lease` that failed."""
+
+    @property
+    def contention(self):
+        """
+        The fraction of the attempts that found the port leased by
+        another allocator.
+        """
+        return self.contended / self.attempts if self.attempts else 0.0
+
+    def summary(self):
+        """
+        :returns: The statistics.
+        :rtype: :class:`dict`
+        """
+        return {
+            "leases": self.leases,
+            "attempts": self.attempts,
+            "contended": self.contended,
+            "in_use": self.in_use,
+            "reused": self.reused,
+            "returned": self.returned,
+            "failures": self.failures,
+            "contention": self.contention,
+        }
+
+
+class PortAllocator(object):
+
+    def __init__(self, lock_dir=None, attempts=20, max_held=32):
+        """
+        Leases ports so that processes which use allocators with the
+        same ``lock_dir`` (e.g. parallel test workers) do not get the
+        same port. A lease is an exclusive ``flock`` on a lock file
+        named after the port, so the operating system releases the
+        leases of a process when it exits, even if it crashes. The
+        lock file is deleted when the port is released.
+
+        Leases only exclude other allocators. A port may still be
+        taken by a process which does not use an allocator between the
+        time it is leased and the time it is used.
+
+        Ports should be released with :meth:`release` once they are no
+        longer used. Because callers often do not release them, a
+        lease is also given back when its port is seen bound by a
+        socket the next time a port is leased, since other allocators
+        then skip the port anyway. And a port already leased by this
+        allocator, which no socket uses, is handed out again as a last
+        resort, or when this allocator holds ``max_held`` leases.
+
+        :param lock_dir: The directory of the lock files. Defaults to
+                         ``ports`` in the cache directory (see
+                         :func:`get_cache_dir`).
+        :type lock_dir: :class:`str`
+        :param attempts: How many ports obtained from the OS to try
+                         before giving up, when leasing without
+                         candidates.
+        :type attempts: :class:`int`
+        :param max_held: The number of leases after which this
+                         allocator hands out its own unused ports
+                         rather than leasing new ones, when leasing
+                         without candidates. Each lease holds a file
+                         descriptor.
+        :type max_held: :class:`int`
+        """
+        self.lock_dir = lock_dir or os.path.join(get_cache_dir(), "ports")
+        self.attempts = attempts
+        self.max_held = max_held
+        self.stats = PortAllocatorStats()
+        # The leases, from the least recently to the most recently
+        # handed out.
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @property
+    def leased(self):
+        """
+        The ports leased by this allocator.
+        """
+        self._check_fork()
+        with self._lock:
+            return sorted(self._leases)
+
+    def _check_fork(self):
+        # A child process inherits the descriptors that hold the
+        # leases of its parent. The child must not unlock them, since
+        # that would unlock them for the parent too, but it must
+        # close them so that the parent's leases end with the parent.
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+
+        with self._lock:
+            for fd in self._leases.values():
+                os.close(fd)
+            self._leases = {}
+            self._pid = pid
+
+    def _lock_path(self, port):
+        return os.path.join(self.lock_dir, "{0}.lock".format(port))
+
+    def _try_lease(self, port):
+        # Must be called with self._lock held.
+        self.stats.attempts += 1
+        path = self._lock_path(port)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as ex:
+                os.close(fd)
+                if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                self.stats.contended += 1
+                return False
+
+            # The file may have been deleted by a release between the
+            # time we opened it and the time we locked it. We then
+            # hold a lock which excludes no one, and must start over.
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            locked = os.fstat(fd)
+            if current is not None and \
+               (current.st_dev, current.st_ino) == \
+               (locked.st_dev, locked.st_ino):
+                break
+            os.close(fd)
+
+        self._leases[port] = fd
+        self.stats.leases += 1
+        return True
+
+    def _release(self, port):
+        # Must be called with self._lock held.
+        fd = self._leases.pop(port, None)
+        if fd is None:
+            return
+        # We delete the file while we hold the lock. See _try_lease.
+        try:
+            os.unlink(self._lock_path(port))
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _reuse(self, ports):
+        # Must be called with self._lock held. We hand out the first
+        # of ``ports`` in the order of self._leases, that is, the one
+        # least recently handed out.
+        port = next((port for port in self._leases if port in ports), None)
+        if port is None:
+            return None
+        # Move the lease to the end, so that the next reuse hands out
+        # another port.
+        self._leases[port] = self._leases.pop(port)
+        self.stats.leases += 1
+        self.stats.reused += 1
+        return port
+
+    def lease(self, candidates=None):
+        """
+        Leases a port.
+
+        :param candidates: The ports among which to choose, in order of
+                           preference. Ports used by a socket are
+                           skipped. If ``None``, ports are obtained
+                           from the OS with :func:`get_unused_port`.
+        :type candidates: :class:`list` of :class:`int`
+        :returns: The port.
+        :rtype: :class:`int`
+        :raises Exception: If no port can be leased.
+        """
+        self._check_fork()
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+        local_ports = get_local_ports()
+
+        def used(port):
+            return port in local_ports if local_ports is not None \
+                else lsof_uses_port(port)
+
+        with self._lock:
+            if local_ports is not None:
+                for port in [port for port in self._leases
+                             if port in local_ports]:
+                    self._release(port)
+                    self.stats.returned += 1
+
+            if candidates is None:
+                for _ in range(self.attempts):
+                    if len(self._leases) >= self.max_held:
+                        break
+                    port = get_unused_port()
+                    if port not in self._leases and self._try_lease(port):
+                        return port
+
+                unused = next((port for port in self._leases
+                               if not used(port)), None)
+                if unused is not None:
+                    return self._reuse([unused])
+            else:
+                held = []
+                for port in candidates:
+                    if used(port):
+                        self.stats.in_use += 1
+                        continue
+
+                    if port in self._leases:
+                        held.append(port)
+                        continue
+
+                    if self._try_lease(port):
+                        return port
+
+                # Whoever leased a held port has not bound it, and
+                # most likely is done with it.
+                port = self._reuse(held)
+                if port is not None:
+                    return port
+
+            self.stats.failures += 1
+
+        if candidates is None:
+            raise Exception("cannot lease a port")
+        raise Exception("cannot lease any of the ports: " +
+                        ", ".join(str(port) for port in candidates))
+
+    def release(self, port):
+        """
+        Releases a port leased by this allocator. Releasing a port
+        which is not leased does nothing.
+
+        :param port: The port.
+        :type port: :class:`int`
+        """
+        self._check_fork()
+        with self._lock:
+            self._release(port)
+
+    def close(self):
+        """
+        Releases all the ports leased by this allocator.
+        """
+        self._check_fork()
+        with self._lock:
+            for port in list(self._leases):
+                self._release(port)
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_port_allocator():
+    """
+    :returns: The allocator used by :func:`lease_port`. It is created
+              on first use and its leases are released at exit.
+    :rtype: :class:`PortAllocator`
+    """
+    global _allocator  # pylint: disable=global-statement
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = PortAllocator()
+            atexit.register(_allocator.close)
+        return _allocator
+
+
+def lease_port(candidates=None):
+    """
+    Leases a port with the allocator returned by
+    :func:`get_port_allocator`. See :meth:`PortAllocator.lease`.
+    """
+    return get_port_allocator().lease(candidates)
+
+
+def release_port(port):
+    """
+    Releases a port leased with :func:`lease_port`.
+    """
+    get_port_allocator().release(port)
@@ -0,0 +1,202 @@
+import time
+
+from selenium.common.exceptions import NoSuchElementException, \
+    TimeoutException
+
+
+class FixedPoll(object):
+
+    """
+    Polls at a fixed interval. This is what ``WebDriverWait`` does.
+    """
+
+    def __init__(self, interval=0.5):
+        """
+        :param interval: The interval between polls, in seconds.
+        :type interval: :class:`float`
+        """
+        self.interval = interval
+
+    def next_interval(self, polls, duration):
+        """
+        Computes the time to sleep before the next poll.
+
+        :param polls: The number of polls made so far in this wait.
+        :type polls: :class:`int`
+        :param duration: The time the last poll took, in seconds.
+        :type duration: :class:`float`
+        :returns: The time to sleep, in seconds.
+        :rtype: :class:`float`
+        """
+        return self.interval
+
+
+class ExponentialBackoff(object):
+
+    """
+    Polls quickly at first, and then less and less often. Conditions
+    that are met quickly are detected quickly, and conditions that
+    take long to be met do not flood the driver with commands.
+    """
+
+    def __init__(self, floor=0.05, ceiling=1.0, factor=2.0):
+        """
+        :param floor: The first interval, in seconds.
+        :type floor: :class:`float`
+        :param ceiling: The maximum interval, in seconds.
+        :type ceiling: :class:`float`
+        :param factor: The factor by which the interval grows after
+                       each poll.
+        :type factor: :class:`float`
+        """
+        if floor <= 0 or ceiling < floor:
+            raise ValueError("floor must be positive and not greater than "
+                             "ceiling")
+        if factor < 1:
+            raise ValueError("factor must be at least 1")
+
+        self.floor = floor
+        self.ceiling = ceiling
+        self.factor = factor
+
+    def next_interval(self, polls, duration):
+        """
+        See :meth:`FixedPoll.next_interval`.
+        """
+        # We cap the exponent so as to not compute huge numbers for
+        # very long waits.
+        exponent = min(polls - 1, 64)
+        return min(self.floor * self.factor ** exponent, self.ceiling)
+
+
+class LatencyAware(object):
+
+    """
+    Polls at an interval proportional to the round-trip time of the
+    driver. Each poll executes at least one driver command, so the
+    time a poll takes is a measure of the round-trip time. The
+    measure is smoothed and kept across waits, so a single scheduler
+    should be used for a single driver.
+
+    With a local browser, the round-trip time is a few milliseconds
+    and polls happen often. With a remote service, the round-trip
+    time is much larger and polls are spaced accordingly.
+    """
+
+    def __init__(self, multiplier=1.0, floor=0.01, ceiling=1.0,
+                 smoothing=0.3):
+        """
+        :param multiplier: The interval is the round-trip time times
+                           this number.
+        :type multiplier: :class:`float`
+        :param floor: The minimum interval, in seconds.
+        :type floor: :class:`float`
+        :param ceiling: The maximum interval, in seconds.
+        :type ceiling: :class:`float`
+        :param smoothing: The weight of the last measure in the
+                          running estimate of the round-trip time. It
+                          must be in the range (0, 1].
+        :type smoothing: :class:`float`
+        """
+        if floor < 0 or ceiling < floor:
+            raise ValueError("floor must not be negative nor greater than "
+                             "ceiling")
+        if not 0 < smoothing <= 1:
+            raise ValueError("smoothing must be in the range (0, 1]")
+
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+        self.smoothing = smoothing
+        self.round_trip = None
+        """The current estimate of the round-trip time, in seconds."""
+
+    def next_interval(self, polls, duration):
+        """
+        See :meth:`FixedPoll.next_interval`.
+        """
+        if self.round_trip is None:
+            self.round_trip = duration
+        else:
+            self.round_trip += self.smoothing * (duration - self.round_trip)
+
+        return min(max(self.round_trip * self.multiplier, self.floor),
+                   self.ceiling)
+
+
+class WaitStats(object):
+
+    """
+    Statistics about a wait.
+    """
+
+    def __init__(self):
+        self.polls = 0
+        """The number of times the condition was checked."""
+
+        self.elapsed = 0.0
+        """The time the wait took, in seconds."""
+
+
+def wait_until(driver, condition, timeout, scheduler, until_not=False,
+               stats=None, ignored_exceptions=(NoSuchElementException,)):
+    """
+    Waits for a condition. This function behaves like
+    ``WebDriverWait.until`` (or ``WebDriverWait.until_not`` if
+    ``until_not`` is true) except that the interval between polls is
+    set by ``scheduler``.
+
+    :param driver: The driver to pass to the condition.
+    :param condition: Should be a callable that operates in the same
+                      way ``WebDriverWait.until`` expects.
+    :param timeout: The timeout, in seconds.
+    :type timeout: :class:`float`
+    :param scheduler: The object which sets the interval between polls.
+    :type scheduler: :class:`FixedPoll`, :class:`ExponentialBackoff`,
+                     :class:`LatencyAware` or any object with a
+                     compatible ``next_interval`` method.
+    :param until_not: Whether to wait for the condition to be false
+                      rather than true.
+    :type until_not: :class:`bool`
+    :param stats: An object in which to record statistics about the
+                  wait. It is updated even if the wait times out.
+    :type stats: :class:`WaitStats`
+    :param ignored_exceptions: Exceptions which, when raised by the
+                               condition, count as the condition being
+                               false.
+    :returns: The last value returned by the condition.
+    :raises selenium.common.exceptions.TimeoutException: If the
+            timeout occurs.
+    """
+    if stats is None:
+        stats = WaitStats()
+
+    screen = None
+    stacktrace = None
+    start = time.monotonic()
+    end = start + timeout
+    while True:
+        poll_start = time.monotonic()
+        stats.polls += 1
+        try:
+            value = condition(driver)
+            if bool(value) != until_not:
+                stats.elapsed = time.monotonic() - start
+                return value
+        except ignored_exceptions as ex:
+            if until_not:
+                stats.elapsed = time.monotonic() - start
+                return True
+            screen = getattr(ex, "screen", None)
+            stacktrace = getattr(ex, "stacktrace", None)
+
+        now = time.monotonic()
+        if now >= end:
+            break
+
+        time.sleep(min(scheduler.next_interval(stats.polls, now - poll_start),
+                       end - now))
+
+    stats.elapsed = time.monotonic() - start
+    raise TimeoutException(
+        "timed out after {0} poll(s)".format(stats.polls), screen, stacktrace)
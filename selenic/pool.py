@@ -0,0 +1,279 @@
+import concurrent.futures
+import contextlib
+import threading
+import time
+
+from selenium.common.exceptions import WebDriverException
+
+_CLEAR_STORAGE_SNIPPET = """
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+"""
+
+
+class PoolStats(object):
+
+    """
+    Timings collected by a :class:`DriverPool`. All times are in
+    seconds.
+    """
+
+    def __init__(self):
+        self.spawn_times = []
+        """The time taken by each call to ``Builder.get_driver``."""
+
+        self.lease_times = []
+        """The time taken to hand out each lease."""
+
+        self.reset_times = []
+        """The time taken by each reset between leases."""
+
+        self.retired = 0
+        """The number of drivers that have been retired."""
+
+    def summary(self):
+        """
+        :returns: A summary of the timings. For each of ``spawn``,
+                  ``lease`` and ``reset`` there is a dictionary with
+                  the keys ``count``, ``total``, ``mean`` and ``max``.
+                  The key ``retired`` gives the number of retired
+                  drivers.
+        :rtype: :class:`dict`
+        """
+        ret = {"retired": self.retired}
+        for (name, times) in (("spawn", self.spawn_times),
+                              ("lease", self.lease_times),
+                              ("reset", self.reset_times)):
+            count = len(times)
+            total = sum(times)
+            ret[name] = {
+                "count": count,
+                "total": total,
+                "mean": total / count if count else 0.0,
+                "max": max(times) if count else 0.0,
+            }
+        return ret
+
+
+class _PooledDriver(object):
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.home_handle = driver.current_window_handle
+
+
+class DriverPool(object):
+
+    def __init__(self, builder, max_uses=50, desired_capabilities=None,
+                 blank_url="about:blank"):
+        """
+        A pool of drivers created by a :class:`selenic.builder.Builder`.
+        Starting a browser is expensive, so the pool keeps drivers
+        that have been returned to it and leases them out again after
+        resetting them. A reset navigates to ``blank_url``, clears
+        the cookies and the storage of the page that was loaded, and
+        closes all windows but the one the driver started with.
+
+        Note that the reset only clears the cookies and storage of the
+        last page loaded in the driver. Tests that visit multiple
+        origins and depend on the absence of cookies on all of them
+        should not use a pool.
+
+        :param builder: The builder with which to create drivers.
+        :type builder: :class:`selenic.builder.Builder`
+        :param max_uses: The number of leases after which a driver is
+                         retired rather than reused.
+        :type max_uses: :class:`int`
+        :param desired_capabilities: Passed to ``Builder.get_driver``
+                                     when a driver is created.
+        :type desired_capabilities: :class:`dict`
+        :param blank_url: The URL to load when resetting a driver.
+        :type blank_url: :class:`str`
+        """
+        if max_uses < 1:
+            raise ValueError("max_uses must be at least 1")
+
+        self.builder = builder
+        self.max_uses = max_uses
+        self.desired_capabilities = desired_capabilities
+        self.blank_url = blank_url
+        self.stats = PoolStats()
+        self._idle = []
+        self._leased = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _spawn(self):
+        start = time.monotonic()
+        driver = self.builder.get_driver(self.desired_capabilities)
+        self.stats.spawn_times.append(time.monotonic() - start)
+        try:
+            return _PooledDriver(driver)
+        except Exception:
+            _quit(driver)
+            raise
+
+    def prewarm(self, count, max_workers=None):
+        """
+        Starts drivers until the pool holds at least ``count`` idle
+        drivers. The drivers are started concurrently.
+
+        :param count: The number of idle drivers wanted.
+        :type count: :class:`int`
+        :param max_workers: The maximum number of drivers to start at
+                            the same time. Defaults to all of them.
+        :type max_workers: :class:`int`
+        """
+        with self._lock:
+            missing = count - len(self._idle)
+
+        if missing <= 0:
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(missing, max_workers or missing)) as executor:
+            futures = [executor.submit(self._spawn) for _ in range(missing)]
+
+        # We add whatever was created before raising any error, so
+        # that the drivers are not leaked.
+        error = None
+        for future in futures:
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            with self._lock:
+                self._idle.append(future.result())
+
+        if error is not None:
+            raise error
+
+    def acquire(self):
+        """
+        Leases a driver. An idle driver is used if there is one,
+        otherwise a new driver is started. The driver must be returned
+        with :meth:`release`.
+
+        :returns: A driver.
+        """
+        if self._closed:
+            raise Exception("the pool is closed")
+
+        start = time.monotonic()
+        with self._lock:
+            record = self._idle.pop() if self._idle else None
+
+        if record is None:
+            record = self._spawn()
+
+        record.uses += 1
+        with self._lock:
+            self._leased[id(record.driver)] = record
+        self.stats.lease_times.append(time.monotonic() - start)
+        return record.driver
+
+    def release(self, driver, failed=False):
+        """
+        Returns a driver to the pool. The driver is reset and made
+        available for the next lease, unless it has reached
+        ``max_uses``, ``failed`` is true or the reset fails. In these
+        cases, the driver is retired. Errors raised by the driver
+        while it is reset or retired are not propagated.
+
+        :param driver: A driver obtained from :meth:`acquire`.
+        :param failed: Whether the driver is known to be in a bad state.
+        :type failed: :class:`bool`
+        """
+        with self._lock:
+            record = self._leased.pop(id(driver), None)
+
+        if record is None:
+            raise ValueError("the driver was not leased from this pool")
+
+        if failed or self._closed or record.uses >= self.max_uses:
+            self._retire(record)
+            return
+
+        try:
+            self._reset(record)
+        # A driver whose browser or driver process is gone raises
+        # errors other than WebDriverException, e.g. ConnectionError.
+        except Exception:  # pylint: disable=broad-except
+            self._retire(record)
+            return
+
+        with self._lock:
+            self._idle.append(record)
+
+    @contextlib.contextmanager
+    def lease(self):
+        """
+        A context manager which leases a driver for the duration of
+        the block. If the block raises a ``WebDriverException``, the
+        driver is deemed broken and is retired. Any other exception
+        (e.g. a failed assertion) returns the driver to the pool
+        normally.
+        """
+        driver = self.acquire()
+        failed = False
+        try:
+            yield driver
+        except WebDriverException:
+            failed = True
+            raise
+        finally:
+            self.release(driver, failed)
+
+    def _reset(self, record):
+        start = time.monotonic()
+        driver = record.driver
+
+        handles = driver.window_handles
+        if record.home_handle not in handles:
+            raise Exception("the window the driver started with is closed")
+
+        if len(handles) > 1:
+            for handle in handles:
+                if handle != record.home_handle:
+                    driver.switch_to.window(handle)
+                    driver.close()
+            driver.switch_to.window(record.home_handle)
+
+        # Storage and cookies are bound to the page that is loaded, so
+        # we must clear them before navigating away.
+        driver.execute_script(_CLEAR_STORAGE_SNIPPET)
+        driver.delete_all_cookies()
+        driver.get(self.blank_url)
+        self.stats.reset_times.append(time.monotonic() - start)
+
+    def _retire(self, record):
+        self.stats.retired += 1
+        _quit(record.driver)
+
+    def close(self):
+        """
+        Retires all idle drivers. Drivers currently leased are retired
+        when they are released.
+        """
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+
+        for record in idle:
+            self._retire(record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def _quit(driver):
+    try:
+        driver.quit()
+    # The driver may fail in many ways other than with a
+    # WebDriverException, e.g. if its browser is gone.
+    except Exception:  # pylint: disable=broad-except
+        pass
@@ -3,6 +3,11 @@ from selenium import webdriver
 class Remote(object):
     name = None
     url_template = None
+    tunnel_conf_keys = ()
+    """
+    The configuration keys needed to start a tunnel. They are passed to
+    the tunnel broker. See :mod:`selenic.remote.broker`.
+    """
 
     def __init__(self, conf):
         self.conf = conf
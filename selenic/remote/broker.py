@@ -0,0 +1,329 @@
+"""
+A broker which lets the processes of a host share a tunnel to a
+remote service. The first process which asks for a tunnel starts a
+broker daemon, which starts the tunnel and listens on a Unix
+socket. Each process holds a connection to the daemon for as long as
+it uses the tunnel. The daemon stops the tunnel and exits once no
+connection remains. Because a connection is closed by the OS when a
+process dies, processes that crash do not keep the tunnel alive.
+
+Run ``python -m selenic.remote.broker --socket <path>`` with the
+service name and the configuration of the service, as JSON, on
+standard input, to start a daemon by hand.
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# The time a daemon waits for the first connection before giving up.
+_STARTUP_GRACE = 30
+
+ATTACH_TIMEOUT = 300
+"""
+The default time :func:`attach` waits for a tunnel, in seconds.
+Starting a tunnel may take a few minutes.
+"""
+
+_ATTACH = b"attach\n"
+
+
+def get_broker_dir():
+    """
+    :returns: The default directory of the sockets of the brokers. It
+              is private to the user, and short enough for socket
+              paths.
+    :rtype: :class:`str`
+    """
+    return os.path.join(tempfile.gettempdir(),
+                        "selenic-{0}".format(os.getuid()))
+
+
+class TunnelLease(object):
+
+    def __init__(self, sock, tunnel_id):
+        """
+        A process's use of a tunnel shared through a broker. Use
+        :func:`attach` to get one.
+        """
+        self._sock = sock
+        self.tunnel_id = tunnel_id
+        """The identifier of the tunnel."""
+
+    def detach(self):
+        """
+        Stops using the tunnel. The tunnel is stopped once all the
+        processes that use it have detached or exited.
+        """
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def _connect(socket_path, timeout):
+    """
+    Attaches to a running daemon.
+
+    :param timeout: How long to wait for the daemon, in seconds.
+    :type timeout: :class:`float`
+    :returns: The lease, or ``None`` if no daemon accepted in time.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(_ATTACH)
+        reply = b""
+        while not reply.endswith(b"\n"):
+            data = sock.recv(1024)
+            if not data:
+                # The daemon was shutting down.
+                raise ConnectionError()
+            reply += data
+    except OSError:
+        sock.close()
+        return None
+
+    # The lease only holds the connection open.
+    sock.settimeout(None)
+    return TunnelLease(sock, reply.decode("utf8").strip())
+
+
+def _spawn(service_name, conf, socket_path, linger):
+    log_path = socket_path[:-len(".sock")] + ".log"
+    env = dict(os.environ)
+    # The daemon must be able to import the package this module comes
+    # from, even if it is not installed.
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [p for p in [env.get("PYTHONPATH")] if p])
+
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "selenic.remote.broker",
+             "--socket", socket_path, "--linger", str(linger)],
+            stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT,
+            env=env, start_new_session=True)
+
+    # The configuration holds credentials, so we do not pass it on
+    # the command line.
+    process.stdin.write(json.dumps({"service": service_name,
+                                    "conf": conf}).encode("utf8"))
+    process.stdin.close()
+
+    # Reap the daemon when it exits, if we are still around.
+    threading.Thread(target=process.wait, daemon=True).start()
+    return (process, log_path)
+
+
+def attach(service_name, conf, directory=None, linger=0,
+           timeout=ATTACH_TIMEOUT):
+    """
+    Attaches to the tunnel shared by the processes which use the same
+    service with the same configuration, starting the tunnel if
+    needed.
+
+    :param service_name: The name of the remote service, as set in
+                         ``REMOTE_SERVICE``.
+    :type service_name: :class:`str`
+    :param conf: The configuration of the service. Only the keys
+                 listed in the ``tunnel_conf_keys`` attribute of the
+                 class of the service are used.
+    :type conf: :class:`dict`
+    :param directory: The directory of the socket and lock files of
+                      the broker. Defaults to :func:`get_broker_dir`.
+    :type directory: :class:`str`
+    :param linger: How long the daemon keeps the tunnel open after the
+                   last process detaches, in seconds. This spares a
+                   handshake when processes come and go.
+    :type linger: :class:`float`
+    :param timeout: How long to wait for the tunnel, in seconds. This
+                    includes waiting for another process which is
+                    starting the tunnel.
+    :type timeout: :class:`float`
+    :returns: The lease on the tunnel.
+    :rtype: :class:`TunnelLease`
+    :raises Exception: If the tunnel cannot be started, or the timeout
+                       occurs. A daemon started by this call which
+                       is not ready when the timeout occurs is
+                       terminated, along with its tunnel.
+    """
+    # Importing here avoids a circular import.
+    from . import get_service_cls
+    keys = get_service_cls(service_name).tunnel_conf_keys
+    conf = {key: conf[key] for key in keys}
+
+    directory = directory or get_broker_dir()
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    name = hashlib.sha1(json.dumps([service_name, conf], sort_keys=True)
+                        .encode("utf8")).hexdigest()[:16]
+    base = os.path.join(directory, "tunnel-" + name)
+    socket_path = base + ".sock"
+
+    deadline = time.monotonic() + timeout
+
+    def connect():
+        # A daemon which does not answer must not make us wait past
+        # the deadline.
+        return _connect(socket_path, max(deadline - time.monotonic(), 0.1))
+
+    while True:
+        lease = connect()
+        if lease is not None:
+            return lease
+
+        if time.monotonic() >= deadline:
+            raise Exception("timed out waiting for the tunnel broker")
+
+        # Only one process may start a daemon.
+        with open(base + ".lock", 'w') as lock:
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise Exception("timed out waiting for another "
+                                        "process to start the tunnel")
+                    time.sleep(0.1)
+
+            lease = connect()
+            if lease is not None:
+                return lease
+
+            (process, log_path) = _spawn(service_name, conf, socket_path,
+                                         linger)
+            while process.poll() is None:
+                lease = connect()
+                if lease is not None:
+                    return lease
+                if time.monotonic() >= deadline:
+                    # The daemon leads its own process group, which
+                    # includes the tunnel it is starting.
+                    try:
+                        os.killpg(process.pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+                    raise Exception("timed out waiting for the tunnel "
+                                    "broker; see " + log_path)
+                time.sleep(0.1)
+
+            if process.returncode != 0:
+                raise Exception("the tunnel broker exited prematurely; "
+                                "see " + log_path)
+            # Otherwise, the daemon started and stopped before we
+            # could attach. Try again.
+
+
+def serve(listener, socket_path, tunnel_id, linger):
+    """
+    Serves the tunnel identifier to the processes that attach, until
+    none remain attached.
+
+    :param listener: The listening socket.
+    :type listener: :class:`socket.socket`
+    :param socket_path: The path of the socket.
+    :type socket_path: :class:`str`
+    :param tunnel_id: The identifier of the tunnel.
+    :type tunnel_id: :class:`str`
+    :param linger: See :func:`attach`.
+    :type linger: :class:`float`
+    """
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    attached = set()
+    deadline = time.monotonic() + max(linger, _STARTUP_GRACE)
+    try:
+        while True:
+            timeout = None
+            if not attached:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+            for (key, _) in selector.select(timeout):
+                sock = key.fileobj
+                if sock is listener:
+                    try:
+                        (conn, _) = listener.accept()
+                    except OSError:
+                        # The process gave up before we accepted.
+                        continue
+                    selector.register(conn, selectors.EVENT_READ)
+                    continue
+
+                # A process which dies while attaching must not bring
+                # down the tunnel of the other processes.
+                try:
+                    data = sock.recv(1024)
+                    if data:
+                        if sock not in attached:
+                            sock.sendall(tunnel_id.encode("utf8") + b"\n")
+                            attached.add(sock)
+                        continue
+                except OSError:
+                    pass
+
+                selector.unregister(sock)
+                sock.close()
+                if sock in attached:
+                    attached.remove(sock)
+                    if not attached:
+                        deadline = time.monotonic() + linger
+    finally:
+        # We remove the socket before closing it so that a process
+        # which cannot connect is sure that it may start a new daemon.
+        os.unlink(socket_path)
+        listener.close()
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Shares a tunnel to a remote service.")
+    parser.add_argument("--socket", required=True,
+                        help="The path of the socket to listen on.")
+    parser.add_argument("--linger", type=float, default=0,
+                        help="How long to keep the tunnel after the last "
+                        "process detaches, in seconds.")
+    args = parser.parse_args(argv)
+
+    request = json.load(sys.stdin)
+
+    from . import get_service_cls
+    service = get_service_cls(request["service"])(request["conf"])
+
+    def terminate(*_):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    tunnel_id = service.start_tunnel()
+    try:
+        # A daemon which crashed may have left its socket behind. The
+        # process which started us holds the lock, so no other daemon
+        # is using the path.
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(args.socket)
+        listener.listen(16)
+        serve(listener, args.socket, tunnel_id, args.linger)
+    finally:
+        service.stop_tunnel()
+
+
+if __name__ == "__main__":
+    main()
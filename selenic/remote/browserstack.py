@@ -11,7 +11,7 @@ except ImportError:
     import simplejson as json
 
 from .base import Remote
-from ..outil import get_unused_port
+from ..outil import lease_port
 
 def set_test_status(jobid, credentials, passed=True):
     """
@@ -105,6 +105,7 @@ class Tunnel(object):
 class BrowserStack(Remote):
     name = "browserstack"
     url_template = "http://{credentials}@hub.browserstack.com:80/wd/hub"
+    tunnel_conf_keys = ("BROWSERSTACK_CREDENTIALS", "BSLOCAL_PATH")
 
     def __init__(self, *args, **kwargs):
         super(BrowserStack, self).__init__(*args, **kwargs)
@@ -129,7 +130,7 @@ class BrowserStack(Remote):
         return super(BrowserStack, self).build_driver(capabilities)
 
     def get_unused_port(self):
-        return get_unused_port()
+        return lease_port()
 
     def start_tunnel(self):
         _, key = self.credentials.split(":")
@@ -0,0 +1,267 @@
+import json
+import os
+
+from .config import ConfigTuple, registry
+from .outil import write_atomically
+
+
+def _as_tuple(config):
+    if isinstance(config, ConfigTuple):
+        return config
+    return ConfigTuple(config.platform, config.browser, config.version)
+
+
+class TimingStore(object):
+
+    def __init__(self, path, smoothing=0.5):
+        """
+        A store of the durations of past runs, kept in a JSON file. For
+        each configuration, the store records the time it takes to
+        start a browser, the time a whole run of the configuration
+        took, and the time each test took. New measures are blended
+        with the old ones so that a single slow run does not throw
+        the estimates off.
+
+        The file is read when the store is created, if it exists, and
+        written by :meth:`save`.
+
+        :param path: The path of the JSON file.
+        :type path: :class:`str`
+        :param smoothing: The weight of a new measure in the
+                          estimate. 1 means the estimate is the last
+                          measure. It must be in the range (0, 1].
+        :type smoothing: :class:`float`
+        """
+        if not 0 < smoothing <= 1:
+            raise ValueError("smoothing must be in the range (0, 1]")
+
+        self.path = path
+        self.smoothing = smoothing
+        self.data = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def _entry(self, config, create=False):
+        key = _as_tuple(config).as_parameter()
+        if create:
+            return self.data.setdefault(key, {"tests": {}})
+        return self.data.get(key, {"tests": {}})
+
+    def _blend(self, old, new):
+        if old is None:
+            return new
+        return old + self.smoothing * (new - old)
+
+    def record_startup(self, config, duration):
+        """
+        Records the time it took to start a browser.
+
+        :param config: The configuration.
+        :type config: :class:`selenic.config.Config` or
+                      :class:`selenic.config.ConfigTuple`
+        :param duration: The duration, in seconds.
+        :type duration: :class:`float`
+        """
+        entry = self._entry(config, True)
+        entry["startup"] = self._blend(entry.get("startup"), duration)
+
+    def record_run(self, config, duration):
+        """
+        Records the time a whole run of a configuration took, excluding
+        the startup of the browser.
+
+        :param config: See :meth:`record_startup`.
+        :param duration: The duration, in seconds.
+        :type duration: :class:`float`
+        """
+        entry = self._entry(config, True)
+        entry["run"] = self._blend(entry.get("run"), duration)
+
+    def record_test(self, config, test_id, duration):
+        """
+        Records the time a test took.
+
+        :param config: See :meth:`record_startup`.
+        :param test_id: The identifier of the test.
+        :type test_id: :class:`str`
+        :param duration: The duration, in seconds.
+        :type duration: :class:`float`
+        """
+        tests = self._entry(config, True)["tests"]
+        tests[test_id] = self._blend(tests.get(test_id), duration)
+
+    def startup(self, config):
+        """
+        :returns: The estimated startup time of the configuration, or
+                  ``None`` if unknown.
+        """
+        return self._entry(config).get("startup")
+
+    def run(self, config):
+        """
+        :returns: The estimated time of a whole run of the
+                  configuration, or ``None`` if unknown. If no run was
+                  recorded, the sum of the recorded tests is used.
+        """
+        entry = self._entry(config)
+        if "run" in entry:
+            return entry["run"]
+        tests = entry["tests"]
+        return sum(tests.values()) if tests else None
+
+    def test(self, config, test_id):
+        """
+        :returns: The estimated time of a test, or ``None`` if unknown.
+        """
+        return self._entry(config)["tests"].get(test_id)
+
+    def save(self):
+        """
+        Writes the store to its file. The file is replaced atomically
+        so that concurrent readers never see a partial file.
+        """
+        write_atomically(self.path,
+                         json.dumps(self.data, indent=2, sort_keys=True))
+
+
+class Shard(object):
+
+    """
+    A share of the work assigned to a worker.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        """The index of the shard."""
+
+        self.items = []
+        """
+        The work assigned to the shard: a list of ``(config, test_id)``
+        pairs, where ``config`` is a
+        :class:`selenic.config.ConfigTuple` and ``test_id`` is ``None``
+        when whole configurations are sharded.
+        """
+
+        self.estimate = 0.0
+        """The estimated time the shard will take, in seconds."""
+
+        self.configs = []
+        """
+        The configurations for which the shard must start a browser, in
+        the order in which they were first assigned.
+        """
+
+    def __repr__(self):
+        return "<Shard {0}: {1} item(s), {2:.1f}s>".format(
+            self.index, len(self.items), self.estimate)
+
+
+def _mean(values, default):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else default
+
+
+def shard(workers, configs=None, tests=None, store=None,
+          default_duration=60.0, default_startup=10.0):
+    """
+    Splits the work of running a configuration matrix among workers
+    so that the workers finish at about the same time. This is a
+    greedy "longest processing time first" assignment: the items of
+    work are taken from the longest to the shortest, and each is
+    given to the shard which would finish earliest with it. A shard
+    which does not yet run a configuration pays the startup cost of
+    the configuration when it is given an item of that configuration.
+
+    The durations come from ``store``. Unknown durations are estimated
+    as the mean of the known durations of the same kind, or with the
+    defaults when nothing is known.
+
+    The assignment is deterministic: the same inputs always produce
+    the same shards, so independent CI nodes can each compute the
+    shards and pick theirs by index.
+
+    :param workers: The number of shards to create.
+    :type workers: :class:`int`
+    :param configs: The configurations to run. Defaults to all the
+                    registered configurations.
+    :type configs: iterable of :class:`selenic.config.Config` or
+                   :class:`selenic.config.ConfigTuple`
+    :param tests: If ``None``, whole configurations are assigned to
+                  shards. Otherwise, the identifiers of the tests to
+                  run for each configuration, and ``(config,
+                  test_id)`` pairs are assigned to shards. A
+                  dictionary maps configurations to the tests to run
+                  for them.
+    :type tests: :class:`list` of :class:`str`, or :class:`dict`
+    :param store: The store of past durations.
+    :type store: :class:`TimingStore`
+    :param default_duration: The duration of a configuration (or of a
+                             test if ``tests`` is set) when nothing is
+                             known, in seconds.
+    :type default_duration: :class:`float`
+    :param default_startup: The startup time of a configuration when
+                            nothing is known, in seconds.
+    :type default_startup: :class:`float`
+    :returns: The shards, in index order. Some shards may be empty if
+              there are fewer items than workers.
+    :rtype: :class:`list` of :class:`Shard`
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    configs = [_as_tuple(config) for config in
+               (configs if configs is not None else registry)]
+
+    if tests is None:
+        items = [(config, None) for config in configs]
+    else:
+        if isinstance(tests, dict):
+            tests = {_as_tuple(config): config_tests
+                     for (config, config_tests) in tests.items()}
+            items = [(config, test_id) for config in configs
+                     for test_id in tests.get(config, ())]
+        else:
+            items = [(config, test_id) for config in configs
+                     for test_id in tests]
+
+    if store is None:
+        startups = dict.fromkeys(configs)
+        durations = dict.fromkeys(items)
+    else:
+        startups = {config: store.startup(config) for config in configs}
+        durations = {item: store.run(item[0]) if item[1] is None
+                     else store.test(*item) for item in items}
+
+    default_startup = _mean(startups.values(), default_startup)
+    startups = {config: default_startup if startup is None else startup
+                for (config, startup) in startups.items()}
+
+    default_duration = _mean(durations.values(), default_duration)
+    durations = {item: default_duration if duration is None else duration
+                 for (item, duration) in durations.items()}
+
+    shards = [Shard(ix) for ix in range(workers)]
+    started = [set() for _ in shards]
+
+    # We sort on the item too so that ties are broken the same way on
+    # every run.
+    for item in sorted(items, key=lambda item: (-durations[item],
+                                                item[0], item[1] or "")):
+        config = item[0]
+
+        def cost(ix):
+            ret = shards[ix].estimate + durations[item]
+            if config not in started[ix]:
+                ret += startups[config]
+            return ret
+
+        best = min(range(workers), key=lambda ix: (cost(ix), ix))
+        target = shards[best]
+        target.estimate = cost(best)
+        target.items.append(item)
+        if config not in started[best]:
+            started[best].add(config)
+            target.configs.append(config)
+
+    return shards
@@ -1,7 +1,126 @@
+import json
+import time
+
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select
 from selenium.common.exceptions import StaleElementReferenceException
 
+_SEARCH_FIELDS_SNIPPET = """
+var key = arguments[0];
+var selectors = arguments[1];
+var known = arguments[2];
+var force = arguments[3];
+
+var registry = window.__selenic_search_fields;
+if (!registry)
+    registry = window.__selenic_search_fields = {};
+
+var state = registry[key];
+var fresh = !state;
+if (fresh) {
+    state = registry[key] = {
+        generation: 0,
+        dirty: true,
+        scopes: [],
+        fields: {},
+        removed: {}
+    };
+    state.observer = new MutationObserver(function () {
+        state.dirty = true;
+    });
+    known = -1;
+}
+
+var scopes = selectors.map(function (selector) {
+    return document.querySelector(selector);
+});
+
+// The observer does not see a scope being replaced.
+for (var scope_ix = 0; scope_ix < scopes.length; ++scope_ix) {
+    if (!scopes[scope_ix] || scopes[scope_ix] !== state.scopes[scope_ix])
+        state.dirty = true;
+}
+
+function search_scope(scope, found) {
+    var types = ["input", "select"];
+    for (var type_ix = 0, type; (type = types[type_ix]); ++type_ix) {
+        var els = scope.getElementsByTagName(type);
+        for (var el_ix = 0, el; (el = els[el_ix]); ++el_ix) {
+            var label = el.closest("label");
+            if (!label)
+                throw new Error("no label for " + el);
+
+            // We clone the label, and clean out the form controls.
+            // ``select`` elements in particular will produce text
+            // due to the  ``option`` elements.
+
+            var clone = label.cloneNode(true);
+            var child = clone.firstElementChild;
+            while (child) {
+                var next = child.nextElementSibling;
+                if (types.indexOf(child.localName) > -1) {
+                    child.parentNode.removeChild(child);
+                }
+                child = next;
+            }
+
+            label = clone.textContent.trim().replace(/:$/, '');
+            found[label] = el;
+        }
+    }
+}
+
+if (state.dirty || force) {
+    state.observer.disconnect();
+    var found = {};
+    scopes.forEach(function (scope) {
+        if (!scope)
+            return;
+        state.observer.observe(scope, {childList: true, subtree: true,
+                                       characterData: true});
+        search_scope(scope, found);
+    });
+    state.scopes = scopes;
+
+    Object.keys(found).forEach(function (label) {
+        var old = state.fields[label];
+        if (!old || old.el !== found[label] || force) {
+            state.fields[label] = {el: found[label],
+                                   generation: ++state.generation};
+            delete state.removed[label];
+        }
+    });
+
+    Object.keys(state.fields).forEach(function (label) {
+        if (!(label in found)) {
+            delete state.fields[label];
+            state.removed[label] = ++state.generation;
+        }
+    });
+
+    state.dirty = false;
+}
+
+var changed = [];
+Object.keys(state.fields).forEach(function (label) {
+    var field = state.fields[label];
+    if (field.generation > known)
+        changed.push(label, field.el);
+});
+
+var removed = Object.keys(state.removed).filter(function (label) {
+    return state.removed[label] > known;
+});
+
+return {
+    fresh: fresh,
+    generation: state.generation,
+    changed: changed,
+    removed: removed
+};
+"""
+
+
 class Table(object):
     name = None
     cssid = None
@@ -50,73 +169,59 @@ class Table(object):
             self.field_selectors = []
 
         self._found_fields = None
+        self._fields_generation = -1
+        self._force_fields_rescan = False
 
     def add_field_selector(self, selector):
         self.field_selectors.append(selector)
 
     @property
     def _search_fields(self):
-        if not self._found_fields:
-            self._find_search_fields()
-
+        self._find_search_fields()
         return self._found_fields
 
     def _find_search_fields(self):
-        self.wait_for_initialized()
-
-        found = self.util.driver.execute_script("""
-        var cssid = arguments[0];
-        var selectors = arguments[1];
-        var found = {};
-
-        function search_selector(selector) {
-          var scope = document.querySelector(selector);
-          var types = ["input", "select"];
-          for (var type_ix = 0, type; (type = types[type_ix]); ++type_ix) {
-            var els = scope.getElementsByTagName(type);
-            for (var el_ix = 0, el; (el = els[el_ix]); ++el_ix) {
-              var label = el.closest("label");
-              if (!label)
-                throw new Error("no label for " + el);
-
-              // We clone the label, and clean out the form controls.
-              // ``select`` elements in particular will produce text
-              // due to the  ``option`` elements.
-
-              var clone = label.cloneNode(true);
-              var child = clone.firstElementChild;
-              while (child) {
-                var next = child.nextElementSibling;
-                if (types.indexOf(child.localName) > -1) {
-                  child.parentNode.removeChild(child);
-                }
-                child = next;
-              }
-
-              label = clone.textContent.trim().replace(/:$/, '');
-              found[label] = el;
-            }
-          }
-        }
+        """
+        Brings the cache of search fields up to date. The page keeps,
+        for each table, a registry of the search fields and a
+        generation counter which is incremented whenever a field
+        appears, disappears or is replaced. A ``MutationObserver``
+        scoped to ``field_selectors`` marks the registry dirty when
+        the DOM changes there, so the page only rescans the fields
+        after a change, and only the fields that changed since the
+        generation we know about are sent back.
+        """
+        if self._found_fields is None:
+            self.wait_for_initialized()
+            known = -1
+        else:
+            known = self._fields_generation
+
+        force = self._force_fields_rescan
+        self._force_fields_rescan = False
+        ret = self.util.driver.execute_script(
+            _SEARCH_FIELDS_SNIPPET,
+            json.dumps([self.cssid, self.field_selectors]),
+            self.field_selectors, known, force)
+
+        if ret["fresh"] and known != -1:
+            # The page was reloaded since we last looked. Start over.
+            self._found_fields = None
+            self._find_search_fields()
+            return
 
-        for (var selector_ix = 0, selector; (selector = selectors[selector_ix]);
-          ++selector_ix) {
-            search_selector(selector);
-        }
+        fields = self._found_fields or {}
+        for label in ret["removed"]:
+            fields.pop(label, None)
 
-        // We cannot just return the dictionary we populated, because Selenium
-        // won't convert the values to proper WebElements. Flattening
-        // the dictionary like this does the trick.
+        # We cannot just return a dictionary from the page, because
+        # Selenium won't convert the values to proper WebElements. So
+        # the changes come flattened.
+        changed = ret["changed"]
+        fields.update(zip(changed[::2], changed[1::2]))
 
-        var ret = [];
-        var keys = Object.keys(found);
-        for (var key_ix = 0, key; (key = keys[key_ix]); ++key_ix) {
-            ret.push(key, found[key]);
-        }
-        return ret;
-        """, self.cssid, self.field_selectors)
-        # Reconstitute the dictionary
-        self._found_fields = dict(zip(found[::2], found[1::2]))
+        self._found_fields = fields
+        self._fields_generation = ret["generation"]
 
     def call_with_search_field(self, name, callback):
         """
@@ -124,8 +229,10 @@ class Table(object):
         a search field of the table.
 
         If the callback causes a ``StaleElementReferenceException``,
-        this method will refetch the search fields and try
-        again. Consequently **the callback should be designed to be
+        this method will force the page to rescan the search fields
+        and try again, until the callback succeeds or the field has
+        been stale for longer than the timeout of the ``Util``
+        object. Consequently **the callback should be designed to be
         callable multiple times and should only interact with the
         search field passed to it.** It should not fetch or interact
         with other DOM elements.
@@ -134,24 +241,21 @@ class Table(object):
         :param callback: The callback to call. The first parameter
         will be the Selenium ``WebElement`` that is the search field.
         """
-        done = False
-        while not done:
-            def check(*_):
-                if name in self._search_fields:
-                    return True
-
-                # Force a refetch
-                self._found_fields = None
-                return False
-
-            self.util.wait(check)
-            field = self._search_fields[name]
+        stale_since = None
+        while True:
+            self.util.wait(lambda *_: name in self._search_fields)
+            # The wait brought the cache up to date.
+            field = self._found_fields[name]
             try:
                 callback(field)
-                done = True
+                return
             except StaleElementReferenceException:
-                # We force a refetch of the fields
-                self._found_fields = None
+                now = time.monotonic()
+                if stale_since is None:
+                    stale_since = now
+                elif now - stale_since > self.util.timeout:
+                    raise
+                self._force_fields_rescan = True
 
     def wait_for_initialized(self):
         """
@@ -166,25 +270,63 @@ class Table(object):
         return len(self.util.find_elements(self.initialized_locator)) > 0
 
     def fill_field(self, name, value):
-        driver = self.util.driver
+        self.call_with_search_field(
+            name, lambda el: self._fill(el, value, True))
+
+    def set_select_option(self, name, value):
+        self.call_with_search_field(
+            name, lambda el: self._select(el, value, True))
 
-        def fill(el):
-            driver.execute_script("arguments[0].value = arguments[1];",
-                                  el, value[:-1])
+    def _fill(self, el, value, wait):
+        self.util.driver.execute_script("arguments[0].value = arguments[1];",
+                                        el, value[:-1])
+        if wait:
             self.setup_redraw_check()
-            el.send_keys(value[-1])
+        el.send_keys(value[-1])
+        if wait:
             self.wait_for_redraw()
 
-        self.call_with_search_field(name, fill)
-
-    def set_select_option(self, name, value):
-        def select(el):
-            select = Select(el)
+    def _select(self, el, value, wait):
+        select = Select(el)
+        if wait:
             self.setup_redraw_check()
-            select.select_by_visible_text(value)
+        select.select_by_visible_text(value)
+        if wait:
             self.wait_for_redraw()
 
-        self.call_with_search_field(name, select)
+    def apply_filters(self, filters):
+        """
+        Sets several search fields, and waits once for the table to
+        redraw. Setting each field with :meth:`fill_field` or
+        :meth:`set_select_option` would set up and wait for a redraw
+        for every field.
+
+        The redraw check is set up before the first field is set and
+        waited for after the last field is set, so the wait ends with
+        the first redraw caused by the fields. This is the redraw for
+        all the fields if the table delays its searches (e.g. with the
+        ``searchDelay`` option of DataTables) for longer than it takes
+        to set them.
+
+        :param filters: Maps the names of the fields to their
+                        values. For ``select`` fields, the value is the
+                        visible text of the option to select. If the
+                        mapping is ordered, the fields are set in order.
+        :type filters: :class:`dict`
+        """
+        if not filters:
+            return
+
+        self.setup_redraw_check()
+        for (name, value) in filters.items():
+            def apply(el, value=value):
+                if el.tag_name == "select":
+                    self._select(el, value, False)
+                else:
+                    self._fill(el, value, False)
+
+            self.call_with_search_field(name, apply)
+        self.wait_for_redraw()
 
     def setup_redraw_check(self):
         raise NotImplementedError()
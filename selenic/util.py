@@ -1,20 +1,502 @@
 import contextlib
+import hashlib
+import json
 import math
+import time
 
-from selenium.webdriver.support.ui import WebDriverWait
 import selenium.webdriver.support.expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.wait import TimeoutException
+from selenium.common.exceptions import WebDriverException
 
+from selenium.webdriver.common.by import By
+
+# Imported for the workarounds it applies to ActionChains.
+from . import _compat  # pylint: disable=unused-import
 from .capabilities import NormalizedCapabilities
+from .polling import FixedPoll, WaitStats, wait_until
+
+_SCREEN_POSITION_SNIPPET = """
+var rect = arguments[0].getBoundingClientRect();
+return {left: rect.left, top: rect.top};
+"""
+
+_IS_DISPLAYED_FUNCTION = """
+function isDisplayed(el) {
+    if (!document.documentElement.contains(el))
+        return false;
+
+    for (var node = el; node && node.nodeType === Node.ELEMENT_NODE;
+         node = node.parentNode) {
+        if (window.getComputedStyle(node).display === "none")
+            return false;
+    }
+
+    var style = window.getComputedStyle(el);
+    if (style.visibility !== "visible" || Number(style.opacity) === 0)
+        return false;
+
+    var rect = el.getBoundingClientRect();
+    return rect.width > 0 || rect.height > 0;
+}
+"""
+
+_GEOMETRY_SNIPPET = """
+var el = arguments[0];
+var rect = el.getBoundingClientRect();
+return {
+    rect: {
+        top: rect.top,
+        left: rect.left,
+        bottom: rect.bottom,
+        right: rect.right,
+        width: rect.width,
+        height: rect.height
+    },
+    size: {width: rect.width, height: rect.height},
+    viewport: {width: window.innerWidth, height: window.innerHeight},
+    scroll: {x: window.pageXOffset, y: window.pageYOffset},
+    displayed: isDisplayed(el)
+};
+"""
+
+_CORNERS_VISIBLE_FUNCTION = """
+function cornersVisible(el) {
+    var rect = el.getBoundingClientRect();
+    // Sigh... we need to round the numbers to avoid running into
+    // factional pixels causing the following test to fail.
+    rect = {
+      left: Math.ceil(rect.left),
+      right: Math.floor(rect.right),
+      top: Math.ceil(rect.top),
+      bottom: Math.floor(rect.bottom)
+    };
+
+    var efp = document.elementFromPoint.bind(document);
+    var at_corner;
+    return ((at_corner = efp(rect.left, rect.top)) === el) ||
+            el.contains(at_corner) ||
+           ((at_corner = efp(rect.left, rect.bottom)) === el) ||
+            el.contains(at_corner) ||
+           ((at_corner = efp(rect.right, rect.top)) === el) ||
+            el.contains(at_corner) ||
+           ((at_corner = efp(rect.right, rect.bottom)) === el) ||
+            el.contains(at_corner);
+}
+
+function withIgnorable(ignorable, fn) {
+    var old_displays = ignorable.map(function (x) {
+        var old = x.style.display;
+        x.style.display = "none";
+        return old;
+    });
+    try {
+        return fn();
+    }
+    finally {
+        var ix = 0;
+        ignorable.forEach(function (x) {
+            x.style.display = old_displays[ix];
+            ix++;
+        });
+    }
+}
+"""
+
+_VISIBLE_TO_USER_SNIPPET = """
+var el = arguments[0];
+var ignorable = arguments[1];
+return withIgnorable(ignorable, function () {
+    return cornersVisible(el);
+});
+"""
+
+_ELEMENTS_LAYOUT_SNIPPET = """
+var els = arguments[0];
+var ignorable = arguments[1];
+var check_visibility = arguments[2];
+var with_elements = arguments[3];
+if (typeof els === "string")
+    els = Array.prototype.slice.call(document.querySelectorAll(els));
+
+var ret = {top: [], left: [], bottom: [], right: [], width: [], height: []};
+for (var i = 0, el; (el = els[i]); ++i) {
+    var rect = el.getBoundingClientRect();
+    ret.top.push(rect.top);
+    ret.left.push(rect.left);
+    ret.bottom.push(rect.bottom);
+    ret.right.push(rect.right);
+    ret.width.push(rect.width);
+    ret.height.push(rect.height);
+}
+
+if (check_visibility) {
+    ret.displayed = els.map(isDisplayed);
+    ret.visible = withIgnorable(ignorable, function () {
+        return els.map(function (el, ix) {
+            return ret.displayed[ix] && cornersVisible(el);
+        });
+    });
+}
+
+if (with_elements)
+    ret.elements = els;
+
+return ret;
+"""
+
+_PAGE_WAIT_SNIPPET = """
+var predicate = new Function(arguments[0]);
+var args = arguments[1];
+var timeout = arguments[2];
+var done = arguments[arguments.length - 1];
+
+var finished = false;
+var last = null;
+var observer = null;
+var timer = null;
+var fallback = null;
+
+function finish(result) {
+    if (finished)
+        return;
+    finished = true;
+    if (observer)
+        observer.disconnect();
+    clearTimeout(timer);
+    clearInterval(fallback);
+    done(result);
+}
+
+function check() {
+    if (finished)
+        return;
+    try {
+        last = predicate.apply(null, args);
+    }
+    catch (e) {
+        finish({error: String(e)});
+        return;
+    }
+    if (last)
+        finish({value: last});
+}
+
+function frame() {
+    check();
+    if (!finished)
+        window.requestAnimationFrame(frame);
+}
+
+check();
+if (!finished) {
+    observer = new MutationObserver(check);
+    observer.observe(document, {childList: true, subtree: true,
+                                attributes: true, characterData: true});
+    if (window.requestAnimationFrame)
+        window.requestAnimationFrame(frame);
+    fallback = setInterval(check, 250);
+    timer = setTimeout(function () {
+        finish({timeout: true, value: last});
+    }, timeout);
+}
+"""
+
+_IN_PAGE_LOCATORS = (By.ID, By.NAME, By.CLASS_NAME, By.TAG_NAME,
+                     By.CSS_SELECTOR, By.XPATH)
+
+_FIND_PREDICATE = """
+var by = arguments[0];
+var value = arguments[1];
+var all = arguments[2];
+var found;
+if (by === "xpath") {
+    var result = document.evaluate(value, document, null,
+                                   XPathResult.ORDERED_NODE_SNAPSHOT_TYPE,
+                                   null);
+    found = [];
+    for (var i = 0; i < result.snapshotLength; ++i)
+        found.push(result.snapshotItem(i));
+}
+else {
+    var selector = {
+        "id": "[id=" + JSON.stringify(value) + "]",
+        "name": "[name=" + JSON.stringify(value) + "]",
+        "class name": "." + CSS.escape(value),
+        "tag name": value,
+        "css selector": value
+    }[by];
+    found = Array.prototype.slice.call(document.querySelectorAll(selector));
+}
+if (!found.length)
+    return null;
+return all ? found : found[0];
+"""
+
+_TEXT_SEARCH_SNIPPET = """
+var parent = arguments[0];
+var source = arguments[1];
+var limit = arguments[2];
+if (typeof parent === "string")
+    parent = document.querySelector(parent);
+
+var state = window.__selenic_text_search;
+if (!state) {
+    state = window.__selenic_text_search = {
+        regexps: {},
+        regexpCount: 0,
+        indexes: new WeakMap()
+    };
+}
+
+var re = state.regexps[source];
+if (!re) {
+    // Don't let the cache grow without bounds.
+    if (state.regexpCount >= 100) {
+        state.regexps = {};
+        state.regexpCount = 0;
+    }
+    re = state.regexps[source] = new RegExp(source);
+    state.regexpCount++;
+}
+
+var index = state.indexes.get(parent);
+if (index && (index.dirty || index.observer.takeRecords().length)) {
+    index.observer.disconnect();
+    index = undefined;
+}
+
+if (!index) {
+    index = {dirty: false, nodes: [], texts: []};
+    index.observer = new MutationObserver(function () {
+        index.dirty = true;
+    });
+    index.observer.observe(parent, {childList: true, subtree: true,
+                                    characterData: true});
+    var walker = document.createTreeWalker(parent, NodeFilter.SHOW_ELEMENT,
+                                           null, false);
+    // The walker starts on the parent itself, which we skip.
+    while (walker.nextNode())
+        index.nodes.push(walker.currentNode);
+    state.indexes.set(parent, index);
+}
+
+var ret = [];
+var nodes = index.nodes;
+var texts = index.texts;
+for (var i = 0; i < nodes.length; ++i) {
+    var text = texts[i];
+    if (text === undefined)
+        text = texts[i] = nodes[i].textContent.trim();
+    if (re.test(text)) {
+        ret.push(nodes[i]);
+        if (limit !== null && ret.length >= limit)
+            break;
+    }
+}
+return ret;
+"""
+
+#
+# The helpers of :class:`Util` are installed once per document as a
+# library in ``window.__selenic``, and are then called by name. This
+# avoids sending their source with every call. The functions in the
+# library take their parameters through ``arguments``.
+#
+_LIBRARY_FUNCTIONS = (
+    ("textExcludingChildren", """
+var parent = arguments[0];
+var child = parent.firstChild;
+var ret = "";
+while(child) {
+    if (child.nodeType === Node.TEXT_NODE)
+        ret += child.textContent;
+    child = child.nextSibling;
+}
+return ret;
+"""),
+    ("screenPosition", _SCREEN_POSITION_SNIPPET),
+    ("screenCoordinates", """
+var rect = arguments[0].getBoundingClientRect();
+return {
+    top: rect.top,
+    left: rect.left,
+    bottom: rect.bottom,
+    right: rect.right,
+    width: rect.width,
+    height: rect.height,
+};
+"""),
+    ("pageCoordinates", """
+var rect = arguments[0].getBoundingClientRect();
+return {
+    top: rect.top + document.body.scrollTop,
+    left: rect.left + document.body.scrollLeft,
+    bottom: rect.bottom + document.body.scrollTop,
+    right: rect.right + document.body.srollLeft,
+    width: rect.width,
+    height: rect.height,
+};
+"""),
+    ("geometry", _GEOMETRY_SNIPPET),
+    ("visibleToUser", _VISIBLE_TO_USER_SNIPPET),
+    ("elementsLayout", _ELEMENTS_LAYOUT_SNIPPET),
+    ("windowInnerSize", """
+return {height: window.innerHeight, width: window.innerWidth};
+"""),
+    ("selectionText", """
+var texts = [];
+var sel = window.getSelection();
+var limit = sel.rangeCount;
+for (var i = 0; i < limit; ++i) {
+   texts.push(sel.getRangeAt(i).toString());
+}
+return texts.join("");
+"""),
+    ("isSomethingSelected", """
+var sel = window.getSelection();
+return sel.rangeCount && !sel.getRangeAt(0).collapsed;
+"""),
+    ("scrollTop", "return arguments[0].scrollTop;"),
+    ("windowScrollTop", "return window.scrollY;"),
+    ("windowScrollLeft", "return window.scrollX;"),
+    ("html", "return arguments[0].outerHTML;"),
+    ("numberOfSiblings", "return arguments[0].parentNode.childNodes.length;"),
+    ("textSearch", _TEXT_SEARCH_SNIPPET),
+)
+
+
+def _build_library(functions):
+    fns = ",\n".join(
+        json.dumps(name) + ": function () {\n" + body + "\n}"
+        for (name, body) in functions)
+    source = "(function () {\n" + _IS_DISPLAYED_FUNCTION + \
+        _CORNERS_VISIBLE_FUNCTION + "window.__selenic = {\n" + \
+        "version: __VERSION__,\nfns: {\n" + fns + "\n}\n};\n})();\n"
+    version = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+    return (version, source.replace("__VERSION__", json.dumps(version), 1))
+
+
+_LIBRARY_VERSION, _LIBRARY_SOURCE = _build_library(_LIBRARY_FUNCTIONS)
+
+_LIBRARY_MISSING = "__selenic_missing"
+
+# This prefix makes a script return a marker if the library is not
+# installed in the page, or is not the version we expect. It is used
+# for the first attempt at a call.
+_LIBRARY_CHECK = """
+var lib = window.__selenic;
+if (!lib || lib.version !== {0})
+    return {{{1}: true}};
+""".format(json.dumps(_LIBRARY_VERSION), _LIBRARY_MISSING)
+
+# This prefix installs the library and is used when the first attempt
+# at a call reported that the library is missing.
+_LIBRARY_INSTALL = _LIBRARY_SOURCE + """
+var lib = window.__selenic;
+"""
+
+_CALL_BODY = """
+return lib.fns[arguments[0]].apply(null, arguments[1]);
+"""
+
+_BATCH_BODY = """
+var ret = [];
+for (var i = 0; i < arguments.length; ++i) {
+    var call = arguments[i];
+    try {
+        ret.push({value: lib.fns[call[0]].apply(null, call[1])});
+    }
+    catch (e) {
+        ret.push({error: String(e)});
+    }
+}
+return ret;
+"""
+
+_UNRESOLVED = object()
+
+
+def _to_numpy_columns(columns):
+    import numpy
+
+    return {key: value if key == "elements" else numpy.asarray(value)
+            for (key, value) in columns.items()}
+
+
+class BatchResult(object):
+
+    """
+    A handle on the result of a script queued by :meth:`Util.batch`.
+    The handle is resolved when the batch is executed, that is, when
+    the ``with`` block of the batch exits.
+    """
+
+    def __init__(self, transform=None):
+        self._transform = transform
+        self._value = _UNRESOLVED
+        self._error = None
+
+    @property
+    def resolved(self):
+        """
+        ``True`` if the batch to which this handle belongs has been
+        executed.
+        """
+        return self._value is not _UNRESOLVED or self._error is not None
+
+    @property
+    def value(self):
+        """
+        The value returned by the script.
+
+        :raises Exception: If the batch has not been executed yet.
+        :raises selenium.common.exceptions.WebDriverException: If the
+                script failed.
+        """
+        if not self.resolved:
+            raise Exception("the batch has not been executed yet")
+
+        if self._error is not None:
+            raise self._error
+
+        return self._value
+
+    def _resolve(self, value):
+        self._value = self._transform(value) if self._transform else value
+
+    def _fail(self, error):
+        self._error = error
+
 
 class Util(object):
 
-    def __init__(self, driver, default_timeout=2):
+    def __init__(self, driver, default_timeout=2, in_page_waits=False,
+                 poll_scheduler=None):
         self.driver = driver
         self.timeouts = [default_timeout]
+        self._batch = None
         self.driver.set_script_timeout(default_timeout)
+        self._script_timeout = default_timeout
+
+        self.in_page_waits = in_page_waits
+        """
+        When ``True``, :meth:`find_element` and :meth:`find_elements`
+        wait in the page with :meth:`wait_in_page` rather than by
+        polling from Python.
+        """
+
+        self.poll_scheduler = poll_scheduler or FixedPoll()
+        """
+        The object which sets the interval between polls when waiting
+        from Python. See :mod:`selenic.polling`.
+        """
+
+        self.last_wait = None
+        """
+        The :class:`selenic.polling.WaitStats` of the last wait.
+        """
         self.capabilities = NormalizedCapabilities(driver.desired_capabilities)
 
         platform = self.capabilities["platformName"]
@@ -72,19 +554,137 @@ class Util(object):
                             "the stack")
         return self.timeouts.pop(0)
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Queues the calls made by the helpers of this object while the
+        ``with`` block executes, and sends them to the browser as a
+        single script when the block exits. This saves
+        round trips, which are costly on remote services.
+
+        Inside the block, the helpers that support batching return a
+        :class:`BatchResult` rather than their value. The value is
+        available once the block has exited. The helpers that support
+        batching are those which only call a page-side helper:
+        :meth:`get_text_excluding_children`,
+        :meth:`element_geometry`, :meth:`element_screen_position`,
+        :meth:`element_screen_center`,
+        :meth:`completely_visible_to_user`,
+        :meth:`element_screen_coordinates`, :meth:`elements_layout`,
+        :meth:`elements_screen_coordinates`,
+        :meth:`elements_visible_to_user`,
+        :meth:`element_page_coordinates`,
+        :meth:`get_window_inner_size`, :meth:`get_selection_text`,
+        :meth:`is_something_selected`, :meth:`scroll_top`,
+        :meth:`window_scroll_top`, :meth:`window_scroll_left`,
+        :meth:`get_html` and :meth:`number_of_siblings`. Other methods
+        execute immediately, and thus *before* the calls that have
+        been queued.
+
+        The calls are executed in the order they were queued. An
+        error in one call does not prevent the others from running:
+        the error is raised when the value of the corresponding
+        handle is read. If the block raises an exception, the queued
+        calls are not executed.
+
+        Nested batches are merged into the outermost batch.
+        """
+        if self._batch is not None:
+            yield
+            return
+
+        self._batch = queue = []
+        try:
+            yield
+        finally:
+            self._batch = None
+
+        self._execute_batch(queue)
+
+    def _execute_batch(self, queue):
+        if not queue:
+            return
+
+        results = self._run_library(
+            _BATCH_BODY, *[[name, list(args)] for (name, args, _) in queue])
+
+        for ((_, _, handle), result) in zip(queue, results):
+            if "error" in result:
+                handle._fail(WebDriverException(result["error"]))
+            else:
+                handle._resolve(result.get("value"))
+
+    def _run_library(self, body, *args):
+        """
+        Executes a script which uses the library of helpers installed
+        in the page. The script is first sent without the library. If
+        the page reports that the library is missing (because this is
+        a new document) or is outdated, the script is sent again,
+        prefixed with the source of the library, which installs it.
+
+        :param body: The script. The library is available to it in the
+                     variable ``lib``.
+        :type body: :class:`str`
+        :param args: The arguments to pass to the script.
+        :returns: The value returned by the script.
+        """
+        ret = self.driver.execute_script(_LIBRARY_CHECK + body, *args)
+        if isinstance(ret, dict) and ret.get(_LIBRARY_MISSING):
+            ret = self.driver.execute_script(_LIBRARY_INSTALL + body, *args)
+        return ret
+
+    def _call_now(self, name, *args):
+        """
+        Calls a function of the library of helpers immediately, even
+        if a batch is active.
+
+        :param name: The name of the function.
+        :type name: :class:`str`
+        :param args: The arguments to pass to the function.
+        :returns: The value returned by the function.
+        """
+        return self._run_library(_CALL_BODY, name, list(args))
+
+    def _call(self, name, *args, transform=None):
+        """
+        Calls a function of the library of helpers, or queues the call
+        if a batch is active.
+
+        :param name: The name of the function.
+        :type name: :class:`str`
+        :param args: The arguments to pass to the function.
+        :param transform: A function to apply to the value returned
+                          by the function.
+        :returns: The value returned by the function, or a
+                  :class:`BatchResult` if a batch is active.
+        """
+        if self._batch is not None:
+            handle = BatchResult(transform)
+            self._batch.append((name, args, handle))
+            return handle
+
+        ret = self._call_now(name, *args)
+        return transform(ret) if transform else ret
+
     def find_element(self, locator):
-        return WebDriverWait(self.driver, self.timeout).until(
-            EC.presence_of_element_located(locator))
+        if self.in_page_waits and locator[0] in _IN_PAGE_LOCATORS:
+            return self.wait_in_page(_FIND_PREDICATE, locator[0], locator[1],
+                                     False)
+
+        return self.wait(EC.presence_of_element_located(locator))
 
     def find_elements(self, locator):
-        return WebDriverWait(self.driver, self.timeout).until(
-            EC.presence_of_all_elements_located(locator))
+        if self.in_page_waits and locator[0] in _IN_PAGE_LOCATORS:
+            return self.wait_in_page(_FIND_PREDICATE, locator[0], locator[1],
+                                     True)
+
+        return self.wait(EC.presence_of_all_elements_located(locator))
 
     def find_clickable_element(self, locator):
-        return WebDriverWait(self.driver, self.timeout).until(
-            EC.element_to_be_clickable(locator))
+        return self.wait(EC.element_to_be_clickable(locator))
 
-    def find_descendants_by_text_re(self, parent, re, immediate=False):
+    def find_descendants_by_text_re(self, parent, re, immediate=False,
+                                    first=False, limit=None):
         """
         :param parent: The parent element into which to search.
         :type parent:
@@ -98,26 +698,35 @@ class Util(object):
                           wait until there **are** descendants to
                           return. If ``True`` it will return immediately.
         :type immediate: :class:`bool`
+        :param first: Whether to return only the first matching
+                      descendant rather than a list. The search stops at
+                      the first match. If ``immediate`` is true and
+                      nothing matches, ``None`` is returned.
+        :type first: :class:`bool`
+        :param limit: The maximum number of descendants to
+                      return. The search stops once this number is
+                      reached. ``None`` means no limit.
+        :type limit: :class:`int`
         :returns: The descendants whose text (as returned by
                   ``jQuery().text()``) match the regular expression.
 
+        The search is performed in the page, which keeps a cache of
+        the compiled regular expressions and, for each parent, an
+        index of the texts of its descendants. The texts are computed
+        lazily and the index is discarded whenever the subtree of the
+        parent is mutated, so repeated polls on an unchanging subtree
+        do not recompute the texts.
         """
+        if first:
+            limit = 1
 
         def cond(*_):
-            return self.driver.execute_script("""
-            var parent = arguments[0];
-            if (typeof parent === "string")
-                parent = document.querySelector(parent);
-            var re = new RegExp(arguments[1]);
-            var ret = [];
-            var nodes = parent.querySelectorAll("*");
-            for(var i = 0, node; (node = nodes[i]) !== undefined; ++i)
-                if (re.test(node.textContent.trim()))
-                    ret.push(node);
-            return ret;
-            """, parent, re)
-
-        return self.wait(cond) if not immediate else cond()
+            return self._call_now("textSearch", parent, re, limit)
+
+        ret = self.wait(cond) if not immediate else cond()
+        if first:
+            return ret[0] if ret else None
+        return ret
 
     #
     # The key sending methods are here as a sort of insurance policy
@@ -188,23 +797,10 @@ class Util(object):
             .perform()
 
     def get_text_excluding_children(self, element):
-        return self.driver.execute_script("""
-        var parent = arguments[0];
-        var child = parent.firstChild;
-        var ret = "";
-        while(child) {
-            if (child.nodeType === Node.TEXT_NODE)
-                ret += child.textContent;
-            child = child.nextSibling;
-        }
-        return ret;
-        """, element)
+        return self._call("textExcludingChildren", element)
 
     def element_screen_position(self, element):
-        return self.driver.execute_script("""
-        var rect = arguments[0].getBoundingClientRect();
-        return {left: rect.left, top: rect.top};
-        """, element)
+        return self._call("screenPosition", element)
 
     def element_screen_center(self, element):
         """
@@ -214,37 +810,20 @@ class Util(object):
                 coordinate.
 
         """
-        pos = self.element_screen_position(element)
-        size = element.size
-        pos["top"] += int(size["height"] / 2)
-        pos["left"] += int(size["width"] / 2)
-        return pos
+        def center(geometry):
+            rect = geometry["rect"]
+            return {
+                "left": rect["left"] + int(rect["width"] / 2),
+                "top": rect["top"] + int(rect["height"] / 2),
+            }
+
+        return self._call("geometry", element, transform=center)
 
     def element_screen_coordinates(self, element):
-        return self.driver.execute_script("""
-        var rect = arguments[0].getBoundingClientRect();
-        return {
-        top: rect.top,
-        left: rect.left,
-        bottom: rect.bottom,
-        right: rect.right,
-        width: rect.width,
-        height: rect.height,
-        };
-        """, element)
+        return self._call("screenCoordinates", element)
 
     def element_page_coordinates(self, element):
-        return self.driver.execute_script("""
-        var rect = arguments[0].getBoundingClientRect();
-        return {
-          top: rect.top + document.body.scrollTop,
-          left: rect.left + document.body.scrollLeft,
-          bottom: rect.bottom + document.body.scrollTop,
-          right: rect.right + document.body.srollLeft,
-          width: rect.width,
-          height: rect.height,
-        };
-        """, element)
+        return self._call("pageCoordinates", element)
 
     def visible_to_user(self, element, *ignorable):
         """
@@ -267,67 +846,127 @@ class Util(object):
         """
         if not element.is_displayed():
             return False
-        return self.driver.execute_script("""
-        var el = arguments[0];
-        var ignorable = arguments[1];
-
-        var old_displays = ignorable.map(function (x) {
-            var old = x.style.display;
-            x.style.display = "none";
-            return old;
-        });
-        try {
-            var rect = el.getBoundingClientRect();
-            // Sigh... we need to round the numbers to avoid running into
-            // factional pixels causing the following test to fail.
-            rect = {
-              left: Math.ceil(rect.left),
-              right: Math.floor(rect.right),
-              top: Math.ceil(rect.top),
-              bottom: Math.floor(rect.bottom)
-            }
-            var ret = false;
-
-            var efp = document.elementFromPoint.bind(document);
-            var at_corner;
-            ret = ((at_corner = efp(rect.left, rect.top)) === el) ||
-                   el.contains(at_corner) ||
-                  ((at_corner = efp(rect.left, rect.bottom)) === el) ||
-                   el.contains(at_corner) ||
-                  ((at_corner = efp(rect.right, rect.top)) === el) ||
-                   el.contains(at_corner) ||
-                  ((at_corner = efp(rect.right, rect.bottom)) === el) ||
-                   el.contains(at_corner);
-        }
-        finally {
-            var ix = 0;
-            ignorable.forEach(function (x) {
-                x.style.display = old_displays[ix];
-                ix++;
-            });
-        }
-        return ret;
-        """, element, ignorable)
+        return self._call_now("visibleToUser", element, list(ignorable))
+
+    def elements_layout(self, elements, ignorable=(), numpy=False,
+                        with_elements=False):
+        """
+        Gets the geometry and visibility of many elements in a single
+        round trip. The results are returned as columns: each field of
+        the returned dictionary is a list which has one entry per
+        element.
+
+        :param elements: The elements to check.
+        :type elements: :class:`list` of
+                        :class:`selenium.webdriver.remote.webelement.WebElement`
+                        or :class:`str`. When a string is specified, it
+                        is interpreted as a CSS selector.
+        :param ignorable: The elements that can be ignored when
+                          checking visibility. See
+                          :meth:`visible_to_user`.
+        :type ignorable: :class:`list` of
+                         :class:`selenium.webdriver.remote.webelement.WebElement`
+        :param numpy: Whether to return NumPy arrays rather than lists.
+        :type numpy: :class:`bool`
+        :param with_elements: Whether to add an ``elements`` column
+                              holding the elements. This is useful
+                              when ``elements`` is a CSS selector.
+        :type with_elements: :class:`bool`
+        :returns: A dictionary with the columns ``top``, ``left``,
+                  ``bottom``, ``right``, ``width``, ``height``,
+                  ``displayed`` and ``visible``. ``displayed`` has
+                  the same meaning as in :meth:`element_geometry`,
+                  ``visible`` as in :meth:`visible_to_user`.
+        :rtype: :class:`dict`
+        """
+        return self._call(
+            "elementsLayout", elements, list(ignorable), True,
+            with_elements,
+            transform=_to_numpy_columns if numpy else None)
+
+    def elements_screen_coordinates(self, elements, numpy=False):
+        """
+        The bulk equivalent of :meth:`element_screen_coordinates`.
+
+        :param elements: The elements. See :meth:`elements_layout`.
+        :param numpy: Whether to return NumPy arrays rather than lists.
+        :type numpy: :class:`bool`
+        :returns: A dictionary with the columns ``top``, ``left``,
+                  ``bottom``, ``right``, ``width`` and ``height``.
+        :rtype: :class:`dict`
+        """
+        return self._call(
+            "elementsLayout", elements, [], False, False,
+            transform=_to_numpy_columns if numpy else None)
+
+    def elements_visible_to_user(self, elements, *ignorable):
+        """
+        The bulk equivalent of :meth:`visible_to_user`.
+
+        :param elements: The elements. See :meth:`elements_layout`.
+        :param ignorable: The elements that can be ignored.
+        :type ignorable: :class:`list` of
+                         :class:`selenium.webdriver.remote.webelement.WebElement`
+        :returns: Whether each element is visible.
+        :rtype: :class:`list` of :class:`bool`
+        """
+        return self._call(
+            "elementsLayout", elements, list(ignorable), True,
+            False, transform=lambda columns: columns["visible"])
 
     def get_window_inner_size(self):
-        return self.driver.execute_script("""
-        return {height: window.innerHeight, width: window.innerWidth};
-        """)
+        return self._call("windowInnerSize")
 
     def completely_visible_to_user(self, element):
-        if not element.is_displayed():
-            return False
-        # We floor all dimensions to avoid issues caused by
-        # fractions of pixels. (Sigh...)
-        pos = {k: math.floor(v) for (k, v) in
-               self.element_screen_position(element).items()}
-        size = {k: math.floor(v)
-                for (k, v) in element.size.items()}
-        window_size = self.driver.get_window_size()
-        return (pos["top"] >= 0 and
-                pos["left"] >= 0 and
-                pos["top"] + size["height"] <= window_size["height"] and
-                pos["left"] + size["width"] <= window_size["width"])
+        """
+        Determines whether an element is displayed and entirely within
+        the viewport.
+
+        :param element: The element to check.
+        :type element: :class:`selenium.webdriver.remote.webelement.WebElement`
+        :returns: Whether the element is completely visible.
+        :rtype: :class:`bool`
+        """
+        def visible(geometry):
+            if not geometry["displayed"]:
+                return False
+            # We floor all dimensions to avoid issues caused by
+            # fractions of pixels. (Sigh...)
+            pos = {k: math.floor(v) for (k, v) in geometry["rect"].items()}
+            viewport = geometry["viewport"]
+            return (pos["top"] >= 0 and
+                    pos["left"] >= 0 and
+                    pos["top"] + pos["height"] <= viewport["height"] and
+                    pos["left"] + pos["width"] <= viewport["width"])
+
+        return self._call("geometry", element, transform=visible)
+
+    def element_geometry(self, element):
+        """
+        Gets a snapshot of the geometry of an element and of the
+        window in a single round trip.
+
+        The ``displayed`` field is computed in the page: an element is
+        displayed if neither it nor any of its ancestors has
+        ``display: none``, if its visibility is ``visible``, if its
+        opacity is not 0 and if it has a non-empty box. This
+        approximates, but is not identical to, what
+        ``WebElement.is_displayed`` reports.
+
+        :param element: The element.
+        :type element: :class:`selenium.webdriver.remote.webelement.WebElement`
+        :returns: The geometry. The field ``rect`` has the fields
+                  ``top``, ``left``, ``bottom``, ``right``, ``width``
+                  and ``height`` of the element's bounding client
+                  rect. The field ``size`` has the fields ``width``
+                  and ``height`` of the element. The field
+                  ``viewport`` has the fields ``width`` and ``height``
+                  of the viewport. The field ``scroll`` has the
+                  fields ``x`` and ``y`` of the window's scroll
+                  offsets. The field ``displayed`` is a boolean.
+        :rtype: :class:`dict`
+        """
+        return self._call("geometry", element)
 
     def get_selection_text(self):
         """
@@ -336,25 +975,14 @@ class Util(object):
         :returns: The text.
         :rtype: class:`basestring`
         """
-        return self.driver.execute_script("""
-        var texts = [];
-        var sel = window.getSelection();
-        var limit = sel.rangeCount;
-        for (var i = 0; i < limit; ++i) {
-           texts.push(sel.getRangeAt(i).toString());
-        }
-        return texts.join("");
-        """)
+        return self._call("selectionText")
 
     def is_something_selected(self):
         """
         :returns: Whether something is selected.
         :rtype: class:`bool`
         """
-        return self.driver.execute_script("""
-        var sel = window.getSelection();
-        return sel.rangeCount && !sel.getRangeAt(0).collapsed;
-        """)
+        return self._call("isSomethingSelected")
 
     def scroll_top(self, element):
         """
@@ -364,9 +992,7 @@ class Util(object):
         :type element: :class:`selenium.webdriver.remote.webelement.WebElement`
         :returns: The top of the scrolling area.
         """
-        return self.driver.execute_script("""
-        return arguments[0].scrollTop;
-        """, element)
+        return self._call("scrollTop", element)
 
     def window_scroll_top(self):
         """
@@ -374,9 +1000,7 @@ class Util(object):
 
         :returns: The top of the scrolling area.
         """
-        return self.driver.execute_script("""
-        return window.scrollY;
-        """)
+        return self._call("windowScrollTop")
 
     def window_scroll_left(self):
         """
@@ -384,29 +1008,113 @@ class Util(object):
 
         :returns: The left of the scrolling area.
         """
-        return self.driver.execute_script("""
-        return window.scrollX;
-        """)
+        return self._call("windowScrollLeft")
 
     def wait(self, condition):
         """
-        Waits for a condition to be true.
+        Waits for a condition to be true. The interval between polls
+        is set by :attr:`poll_scheduler`, and statistics about the
+        wait are recorded in :attr:`last_wait`.
 
         :param condition: Should be a callable that operates in the
                           same way ``WebDriverWait.until`` expects.
         :returns: Whatever ``WebDriverWait.until`` returns.
         """
-        return WebDriverWait(self.driver, self.timeout).until(condition)
+        self.last_wait = stats = WaitStats()
+        return wait_until(self.driver, condition, self.timeout,
+                          self.poll_scheduler, stats=stats)
+
+    def wait_in_page(self, predicate, *args):
+        """
+        Waits for a condition to be true, by evaluating it in the page
+        rather than by polling from Python. The wait costs a single
+        round trip: the predicate is evaluated immediately, then
+        whenever the DOM changes, on each animation frame and, as a
+        fallback for browsers that throttle animation frames, every
+        250ms. The wait ends as soon as the predicate returns a truthy
+        value.
+
+        The wait does not survive a navigation. Pages with a Content
+        Security Policy which forbids ``eval`` cannot use this method.
+
+        :param predicate: The body of a JavaScript function which
+                          returns a truthy value when the condition is
+                          met. Like a script passed to
+                          ``execute_script``, it gets its arguments
+                          through ``arguments``. It must return a
+                          value that Selenium can marshal.
+        :type predicate: :class:`str`
+        :param args: The arguments to pass to the predicate.
+        :returns: The value returned by the predicate.
+        :raises selenium.common.exceptions.TimeoutException: If the
+                timeout occurs.
+        """
+        ret = self._page_wait(predicate, args)
+        if ret.get("timeout"):
+            raise TimeoutException("timed out waiting in the page")
+        return ret["value"]
+
+    def _page_wait(self, predicate, args):
+        timeout = self.timeout
+        self.last_wait = stats = WaitStats()
+        stats.polls = 1
+        start = time.monotonic()
+        try:
+            with self.allow_script_timeout(timeout):
+                ret = self.driver.execute_async_script(
+                    _PAGE_WAIT_SNIPPET, predicate, list(args),
+                    int(timeout * 1000))
+        except TimeoutException:
+            # Selenium timed out the script at about the same time
+            # the page would have. The page cleans up after itself.
+            ret = {"timeout": True, "value": None}
+        finally:
+            stats.elapsed = time.monotonic() - start
+
+        if "error" in ret:
+            raise WebDriverException(ret["error"])
+
+        return ret
+
+    @contextlib.contextmanager
+    def allow_script_timeout(self, timeout):
+        """
+        Makes sure that, for the duration of the block, asynchronous
+        scripts are allowed to run for more than ``timeout``
+        seconds. This is for scripts that enforce their own timeout in
+        the page: the script timeout of the driver must leave them a
+        margin, or Selenium may time the script out before the page
+        does. The script timeout of the driver is changed only if it
+        is too short, and is restored when the block exits.
+
+        :param timeout: The timeout, in seconds.
+        :type timeout: :class:`float`
+        """
+        restore = None
+        wanted = timeout + 1
+        if wanted > self._script_timeout:
+            restore = self._script_timeout
+            self.driver.set_script_timeout(wanted)
+            self._script_timeout = wanted
+
+        try:
+            yield
+        finally:
+            if restore is not None:
+                self.driver.set_script_timeout(restore)
+                self._script_timeout = restore
 
     def wait_until_not(self, condition):
         """
-        Waits for a condition to be false.
+        Waits for a condition to be false. See :meth:`wait`.
 
         :param condition: Should be a callable that operates in the
                           same way ``WebDriverWait.until_not`` expects.
         :returns: Whatever ``WebDriverWait.until_not`` returns.
         """
-        return WebDriverWait(self.driver, self.timeout).until_not(condition)
+        self.last_wait = stats = WaitStats()
+        return wait_until(self.driver, condition, self.timeout,
+                          self.poll_scheduler, until_not=True, stats=stats)
 
     def get_html(self, element):
         """
@@ -415,9 +1123,7 @@ class Util(object):
         :returns: The HTML of an element.
         :rtype: :class:`str`
         """
-        return self.driver.execute_script("""
-        return arguments[0].outerHTML;
-        """, element)
+        return self._call("html", element)
 
     def number_of_siblings(self, element):
         """
@@ -426,9 +1132,7 @@ class Util(object):
         :returns: The number of siblings.
         :rtype: :class:`int`
         """
-        return self.driver.execute_script("""
-        return arguments[0].parentNode.childNodes.length;
-        """, element)
+        return self._call("numberOfSiblings", element)
 
     def assert_same(self, first, second):
         """
@@ -546,6 +1250,8 @@ class Condition(object):
         self.check = check
         self.last_return = None
         self.called = False
+        self.polls = 0
+        """The number of polls made by the last wait."""
 
     def __call__(self, *args, **kwargs):
         self.last_return = self.check(*args, **kwargs)
@@ -564,6 +1270,48 @@ class Condition(object):
             self.util.wait(self)
         except TimeoutException:
             pass
+        self.polls = self.util.last_wait.polls
+        return self.last_return
+
+
+class PageCondition(object):
+
+    """
+    The counterpart of :class:`Condition` for checks performed in the
+    page with :meth:`Util.wait_in_page`. Failing to attain the
+    condition does not result in a ``TimeoutException``: :meth:`wait`
+    returns the last value of the predicate.
+    """
+
+    def __init__(self, util, predicate, *args):
+        """
+        :param util: The ``Util`` object to use to perform the wait.
+        :type util: :class:`Util`
+        :param predicate: The predicate to evaluate. See
+                          :meth:`Util.wait_in_page`.
+        :type predicate: :class:`str`
+        :param args: The arguments to pass to the predicate.
+        """
+        self.util = util
+        self.predicate = predicate
+        self.args = args
+        self.last_return = None
+        self.called = False
+        self.polls = 0
+        """The number of polls made by the last wait."""
+
+    def wait(self):
+        """
+        Wait until the predicate is true, or the timeout occurs.
+
+        :returns: Whatever the predicate last returned, whether there
+                  was a timeout or not.
+        """
+        # pylint: disable=protected-access
+        ret = self.util._page_wait(self.predicate, self.args)
+        self.last_return = ret.get("value")
+        self.called = True
+        self.polls = self.util.last_wait.polls
         return self.last_return
 
 
@@ -0,0 +1,148 @@
+import os
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import time
+from unittest import TestCase
+
+from selenic.remote import broker
+
+# A stand-in for Sauce Connect, which logs its starts and stops.
+STUB_TUNNEL = """#!{python}
+import os
+import signal
+import sys
+import time
+
+log = {log!r}
+
+def stop(*_):
+    with open(log, 'a') as f:
+        f.write("stop\\n")
+    sys.exit(0)
+
+signal.signal(signal.SIGTERM, stop)
+with open(log, 'a') as f:
+    f.write("start\\n")
+
+if {ready!r}:
+    readyfile = sys.argv[sys.argv.index("--readyfile") + 1]
+    open(readyfile, 'w').close()
+while True:
+    time.sleep(1)
+"""
+
+
+class BrokerTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, "log")
+        self.conf = {
+            "SAUCELABS_CREDENTIALS": "user:key",
+            "SC_TUNNEL_PATH": self.make_stub("sc"),
+            # This is not passed to the daemon.
+            "OTHER": object(),
+        }
+        self.directory = os.path.join(self.tmpdir, "broker")
+        self.leases = []
+
+    def tearDown(self):
+        for lease in self.leases:
+            lease.detach()
+        shutil.rmtree(self.tmpdir)
+
+    def make_stub(self, name, ready=True):
+        stub = os.path.join(self.tmpdir, name)
+        with open(stub, 'w') as f:
+            f.write(STUB_TUNNEL.format(python=sys.executable, log=self.log,
+                                       ready=ready))
+        os.chmod(stub, stat.S_IRWXU)
+        return stub
+
+    def attach(self, **kwargs):
+        lease = broker.attach("saucelabs", self.conf, self.directory,
+                              **kwargs)
+        self.leases.append(lease)
+        return lease
+
+    def events(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            return f.read().split()
+
+    def wait_for_events(self, expected):
+        end = time.monotonic() + 10
+        while self.events() != expected and time.monotonic() < end:
+            time.sleep(0.1)
+        self.assertEqual(self.events(), expected)
+
+    def test_shares_tunnel(self):
+        first = self.attach()
+        second = self.attach()
+        self.assertEqual(first.tunnel_id, second.tunnel_id)
+        self.assertTrue(first.tunnel_id.startswith("sc-tunnel-for-"))
+        self.assertEqual(self.events(), ["start"])
+
+        first.detach()
+        time.sleep(0.5)
+        self.assertEqual(self.events(), ["start"])
+
+        second.detach()
+        self.wait_for_events(["start", "stop"])
+
+    def test_restarts_after_last_detach(self):
+        lease = self.attach()
+        lease.detach()
+        self.wait_for_events(["start", "stop"])
+
+        lease = self.attach()
+        self.assertEqual(self.events(), ["start", "stop", "start"])
+        lease.detach()
+        self.wait_for_events(["start", "stop", "start", "stop"])
+
+    def test_failed_daemon(self):
+        self.conf["SC_TUNNEL_PATH"] = os.path.join(self.tmpdir, "missing")
+        with self.assertRaisesRegex(
+                Exception, "^the tunnel broker exited prematurely"):
+            self.attach()
+
+    def test_timeout(self):
+        self.conf["SC_TUNNEL_PATH"] = self.make_stub("slow-sc", ready=False)
+        with self.assertRaisesRegex(
+                Exception, "^timed out waiting for the tunnel broker"):
+            self.attach(timeout=1)
+        # The daemon and the tunnel it was starting are gone.
+        self.wait_for_events(["start", "stop"])
+
+    def socket_path(self):
+        (name,) = [name for name in os.listdir(self.directory)
+                   if name.endswith(".sock")]
+        return os.path.join(self.directory, name)
+
+    def test_survives_process_dying_while_attaching(self):
+        lease = self.attach()
+        # This process dies before reading the reply of the daemon.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path())
+        sock.sendall(b"attach\n")
+        sock.close()
+        time.sleep(0.5)
+
+        self.assertEqual(self.attach().tunnel_id, lease.tunnel_id)
+        self.assertEqual(self.events(), ["start"])
+
+    def test_unresponsive_daemon(self):
+        path = os.path.join(self.tmpdir, "hung.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(path)
+            listener.listen(1)
+            start = time.monotonic()
+            self.assertIsNone(broker._connect(path, 0.5))
+            self.assertLess(time.monotonic() - start, 5)
+        finally:
+            listener.close()
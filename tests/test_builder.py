@@ -0,0 +1,284 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock
+
+from selenium import webdriver
+
+from selenic import forget, outil
+from selenic.builder import Builder, clear_config_cache, preload_config, \
+    get_shared_service, stop_shared_services, quit_drivers, wait_for_drivers
+
+CONFIG = """
+import os
+from selenic import Config
+
+os.environ["SELENIC_TEST_LOADS"] = \\
+    str(int(os.environ.get("SELENIC_TEST_LOADS", "0")) + 1)
+CONFIG = Config("Linux", "CHROME", "70")
+VALUE = builder_args.get("value")
+"""
+
+
+FIREFOX_CONFIG = """
+from selenium.webdriver.firefox.webdriver import FirefoxProfile, FirefoxBinary
+from selenic import Config
+
+CONFIG = Config("Linux", "FIREFOX", "70")
+FIREFOX_BINARY = FirefoxBinary("firefox")
+FIREFOX_PROFILE = FirefoxProfile()
+FIREFOX_PROFILE.set_preference("selenic.test", "value")
+"""
+
+
+class StubFirefox(object):
+
+    """
+    Stands in for ``webdriver.Firefox``, which deletes the directory
+    of its profile when it quits.
+    """
+
+    desired_capabilities = {"browserName": "firefox",
+                            "browserVersion": "70.0",
+                            "platformName": "linux"}
+
+    def __init__(self, profile, binary, capabilities=None):
+        if not os.path.isdir(profile.path):
+            raise Exception("the profile directory does not exist")
+        self.profile = profile
+
+    def quit(self):
+        shutil.rmtree(self.profile.path)
+        shutil.rmtree(self.profile.tempfolder)
+
+
+class Unhashable(object):
+    __hash__ = None
+
+
+class ConfigCacheTestCase(TestCase):
+
+    def setUp(self):
+        forget()
+        clear_config_cache()
+        os.environ["SELENIC_TEST_LOADS"] = "0"
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "config.py")
+        self.write(CONFIG)
+
+    def tearDown(self):
+        clear_config_cache()
+        del os.environ["SELENIC_TEST_LOADS"]
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, content):
+        with open(self.path, 'w') as config_file:
+            config_file.write(content)
+
+    @property
+    def loads(self):
+        return int(os.environ["SELENIC_TEST_LOADS"])
+
+    def test_reuses_loaded_config(self):
+        first = Builder(self.path, {"value": 1})
+        second = Builder(self.path, {"value": 1})
+        self.assertEqual(self.loads, 1)
+        self.assertIs(first.config, second.config)
+        self.assertIsNot(first.local_conf, second.local_conf)
+
+    def test_keyed_by_options(self):
+        self.assertEqual(Builder(self.path, {"value": 1}).VALUE, 1)
+        self.assertEqual(Builder(self.path, {"value": 2}).VALUE, 2)
+        self.assertEqual(self.loads, 2)
+
+    def test_reloads_modified_file(self):
+        Builder(self.path, {})
+        self.write(CONFIG + "\nOTHER = 1\n")
+        self.assertEqual(Builder(self.path, {}).OTHER, 1)
+        self.assertEqual(self.loads, 2)
+
+    def test_nested_options(self):
+        Builder(self.path, {"value": [{"a": {1}}]})
+        Builder(self.path, {"value": [{"a": {1}}]})
+        self.assertEqual(self.loads, 1)
+
+    def test_unhashable_options(self):
+        unhashable = Unhashable()
+        Builder(self.path, {"value": unhashable})
+        Builder(self.path, {"value": unhashable})
+        self.assertEqual(self.loads, 2)
+
+    def test_cache_disabled(self):
+        Builder(self.path, {}, cache=False)
+        Builder(self.path, {}, cache=False)
+        self.assertEqual(self.loads, 2)
+
+    def test_preload(self):
+        preload_config(self.path, {})
+        Builder(self.path, {})
+        self.assertEqual(self.loads, 1)
+
+    def test_firefox_profile_per_driver(self):
+        self.write(FIREFOX_CONFIG)
+        with mock.patch.object(webdriver, "Firefox", StubFirefox):
+            first = Builder(self.path, {}).get_driver()
+            first.quit()
+            builder = Builder(self.path, {})
+            second = builder.get_driver()
+
+        configured = builder.FIREFOX_PROFILE
+        self.assertTrue(os.path.isdir(configured.path))
+        self.assertNotEqual(second.profile.path, configured.path)
+        self.assertEqual(
+            second.profile.default_preferences["selenic.test"], "value")
+        second.quit()
+
+
+STUB_SERVICE = """#!{python}
+import http.server
+import sys
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        if self.path == "/shutdown":
+            sys.exit(0)
+
+    def log_message(self, *_):
+        pass
+
+
+port = int([arg for arg in sys.argv if arg.startswith("--port=")][0][7:])
+http.server.HTTPServer(("localhost", port), Handler).serve_forever()
+"""
+
+
+class SharedServiceTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "chromedriver")
+        with open(self.path, 'w') as stub:
+            stub.write(STUB_SERVICE.format(python=sys.executable))
+        os.chmod(self.path, stat.S_IRWXU)
+        self.log_path = os.path.join(self.tmpdir, "log")
+        # We do not want to touch the lock files of the user.
+        allocator = outil.PortAllocator(os.path.join(self.tmpdir, "ports"))
+        patcher = mock.patch.object(outil, "_allocator", allocator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        stop_shared_services()
+        outil.get_port_allocator().close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_shares_and_restarts(self):
+        service = get_shared_service("CHROME", self.path, self.log_path)
+        self.assertIs(get_shared_service("CHROME", self.path, self.log_path),
+                      service)
+
+        leased = outil.get_port_allocator().leased
+        self.assertIn(service.port, leased)
+
+        service.process.kill()
+        service.process.wait()
+        restarted = get_shared_service("CHROME", self.path, self.log_path)
+        self.assertIsNot(restarted, service)
+        process = restarted.process
+        self.assertIsNone(process.poll())
+        # The port of the dead service was released.
+        self.assertEqual(len(outil.get_port_allocator().leased), len(leased))
+        self.assertIn(restarted.port, outil.get_port_allocator().leased)
+
+        stop_shared_services()
+        self.assertIsNotNone(process.poll())
+        self.assertNotIn(restarted.port, outil.get_port_allocator().leased)
+
+    def test_unknown_browser(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "^no shared service for OPERA$"):
+            get_shared_service("OPERA", self.path)
+
+
+class StubDriver(object):
+
+    def __init__(self, index, fail_quit=False):
+        self.index = index
+        self.fail_quit = fail_quit
+        self.quitted = False
+
+    def quit(self):
+        self.quitted = True
+        if self.fail_quit:
+            raise ConnectionRefusedError()
+
+
+class StubBuilder(Builder):
+
+    """
+    A builder which creates stub drivers. The drivers are created in
+    the reverse of the order of the calls, to check that the results
+    are reported in order anyway.
+    """
+
+    def __init__(self, n, fail=(), fail_quit=()):
+        self.n = n
+        self.fail = fail
+        self.fail_quit = fail_quit
+        self.drivers = []
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def get_driver(self, desired_capabilities=None):
+        with self._lock:
+            index = self._calls
+            self._calls += 1
+        time.sleep(0.02 * (self.n - index))
+        if index in self.fail:
+            raise Exception("cannot start driver " + str(index))
+        driver = StubDriver(index, index in self.fail_quit)
+        with self._lock:
+            self.drivers.append(driver)
+        return driver
+
+
+class GetDriversTestCase(TestCase):
+
+    def test_results_in_order(self):
+        builder = StubBuilder(4)
+        drivers = wait_for_drivers(builder.get_drivers(4))
+        self.assertEqual([driver.index for driver in drivers], [0, 1, 2, 3])
+        # The last driver started first.
+        self.assertEqual(builder.drivers[0].index, 3)
+
+    def test_get_driver_async(self):
+        self.assertEqual(StubBuilder(1).get_driver_async().result().index, 0)
+
+    def test_one_failure(self):
+        builder = StubBuilder(3, fail=(1,))
+        futures = builder.get_drivers(3)
+        self.assertEqual(futures[0].result().index, 0)
+        self.assertEqual(futures[2].result().index, 2)
+        self.assertRegex(str(futures[1].exception()),
+                         "^cannot start driver 1$")
+
+    def test_wait_for_drivers_tears_down_on_failure(self):
+        builder = StubBuilder(3, fail=(1,))
+        with self.assertRaisesRegex(Exception, "^cannot start driver 1$"):
+            wait_for_drivers(builder.get_drivers(3))
+        self.assertEqual(len(builder.drivers), 2)
+        self.assertTrue(all(driver.quitted for driver in builder.drivers))
+
+    def test_quit_drivers_survives_errors(self):
+        builder = StubBuilder(3, fail_quit=(0,))
+        quit_drivers(builder.get_drivers(3))
+        self.assertEqual(len(builder.drivers), 3)
+        self.assertTrue(all(driver.quitted for driver in builder.drivers))
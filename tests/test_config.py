@@ -1,6 +1,7 @@
 from unittest import TestCase
 
-from selenic import Config, get_config, forget
+from selenic import Config, get_config, forget, query_configs, registry, \
+    configs
 
 # pylint: disable=no-name-in-module
 from nose.tools import assert_equal, assert_raises
@@ -91,3 +92,52 @@ class GetConfigTestCase(TestCase):
         # In this loop we get the configs by using the full names
         for (key, value) in table.items():
             self.assertEqual(get_config(value, key, "30").platform, value)
+
+
+class QueryConfigsTestCase(TestCase):
+
+    def setUp(self):
+        forget()
+        self.linux_ch_59 = Config("Linux", "ch", "59")
+        self.linux_ch_60 = Config("Linux", "ch", "60.0")
+        self.win_ch_65 = Config("Windows 10", "ch", "65")
+        self.linux_ff_60 = Config("Linux", "ff", "60")
+        self.linux_ch_beta = Config("Linux", "ch", "beta")
+
+    def test_everything(self):
+        self.assertEqual(query_configs(),
+                         [self.linux_ch_59, self.linux_ch_60, self.win_ch_65,
+                          self.linux_ff_60, self.linux_ch_beta])
+
+    def test_exact(self):
+        self.assertEqual(query_configs("linux", "ff"), [self.linux_ff_60])
+
+    def test_wildcards(self):
+        self.assertEqual(query_configs("WIN*"), [self.win_ch_65])
+        self.assertEqual(query_configs(None, "ch", "6?*"),
+                         [self.linux_ch_60, self.win_ch_65])
+
+    def test_range(self):
+        self.assertEqual(query_configs("Linux", "CHROME", ">=60"),
+                         [self.linux_ch_60])
+        self.assertEqual(query_configs(None, None, ">=60,<65"),
+                         [self.linux_ch_60, self.linux_ff_60])
+        self.assertEqual(query_configs(None, None, "==60"),
+                         [self.linux_ch_60, self.linux_ff_60])
+
+    def test_invalid_range(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "^invalid version range: >=x$"):
+            query_configs(None, None, ">=x")
+
+    def test_replacement_keeps_order(self):
+        replacement = Config("Linux", "ch", "59")
+        self.assertEqual(list(registry)[0], replacement)
+        self.assertEqual(len(registry), 5)
+        self.assertEqual(query_configs("Linux", "ch", "59"), [replacement])
+
+    def test_forget_clears_in_place(self):
+        forget()
+        self.assertIs(registry.configs, configs)
+        self.assertEqual(len(configs), 0)
+        self.assertEqual(query_configs(), [])
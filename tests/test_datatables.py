@@ -0,0 +1,294 @@
+import contextlib
+from unittest import TestCase
+
+from selenium.common.exceptions import TimeoutException, \
+    WebDriverException
+
+from selenic import datatables, tables
+from selenic.datatables import Datatable, setup_redraw_checks, \
+    wait_for_redraws
+from selenic.util import Util
+
+
+class FakeElement(object):
+
+    tag_name = "input"
+
+    def __init__(self, driver, label):
+        self.driver = driver
+        self.label = label
+
+    def send_keys(self, keys):
+        self.driver.log.append(("keys", self.label))
+
+
+class FakeDriver(object):
+
+    """
+    Simulates a page with a DataTables table. The scripts of
+    :mod:`selenic.datatables` are recognized and answered from
+    ``rows``, and the commands issued are recorded in ``log``.
+    """
+
+    name = "chrome"
+    desired_capabilities = {"browserName": "chrome", "version": "70",
+                            "platform": "Linux"}
+
+    def __init__(self, rows=(), page_length=2, page=0, fields=()):
+        self.rows = list(rows)
+        self.fields = {label: FakeElement(self, label) for label in fields}
+        self.page_length = page_length
+        self.page = page
+        self.log = []
+        self.script_timeout = None
+        self.quitted = False
+        self.redraw_setups = []
+        self.redraw_waits = []
+        self.redraw_timeout = False
+        self.records_display = len(self.rows)
+        self.results_timeout = False
+
+    def set_script_timeout(self, timeout):
+        self.script_timeout = timeout
+
+    def quit(self):
+        self.quitted = True
+
+    def execute_script(self, script, *args):
+        if self.quitted:
+            raise WebDriverException("the driver quit")
+
+        if script == datatables._RESULT_ROWS_SNIPPET:
+            self.log.append(("result",) + args[1:])
+            if not self.rows:
+                return None
+            return {"rows": self.rows[slice(*args[1:])]}
+
+        if script == tables._SEARCH_FIELDS_SNIPPET:
+            known = args[2]
+            changed = []
+            if known == -1:
+                for (label, el) in self.fields.items():
+                    changed += [label, el]
+            return {"fresh": known == -1, "generation": 1,
+                    "changed": changed, "removed": []}
+
+        if script == "arguments[0].value = arguments[1];":
+            return None
+
+        if script == datatables._REDRAW_DROP_SNIPPET:
+            self.log.append(("drop redraw", args[0]))
+            return None
+
+        if script == datatables._RECORDS_DISPLAY_SNIPPET:
+            self.log.append(("records",))
+            return self.records_display
+
+        if script == datatables._ROWS_INFO_SNIPPET:
+            pages = -(-len(self.rows) // self.page_length)
+            return {"serverSide": True, "page": self.page, "pages": pages}
+
+        raise ValueError("unexpected script")
+
+    def execute_async_script(self, script, *args):
+        if self.quitted:
+            raise WebDriverException("the driver quit")
+
+        if script == datatables._PAGE_ROWS_SNIPPET:
+            (_, page, columns) = args
+            self.log.append(("page", page, self.script_timeout))
+            self.page = page
+            if columns is False:
+                return None
+            start = page * self.page_length
+            return self.rows[start:start + self.page_length]
+
+        if script == datatables._REDRAW_SETUP_SNIPPET:
+            self.log.append(("setup redraw",))
+            self.redraw_setups.append(args[0])
+            return None
+
+        if script == datatables._REDRAW_CHECK_SNIPPET:
+            self.log.append(("wait redraw",))
+            self.redraw_waits.append(args[0])
+            if self.redraw_timeout:
+                raise TimeoutException()
+            return None
+
+        if script == datatables._SEARCH_SNIPPET:
+            self.log.append(("search", args[1], self.script_timeout))
+            return None
+
+        if script == datatables._RESULTS_SNIPPET:
+            self.log.append(("results", args[1], args[2],
+                             self.script_timeout))
+            if self.results_timeout:
+                raise TimeoutException()
+            return self.records_display
+
+        if "init.dt" in script:
+            return None
+
+        raise ValueError("unexpected script")
+
+
+class IterRowsTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = FakeDriver([["a"], ["b"], ["c"]], page=1)
+        self.table = Datatable(Util(self.driver), cssid="table")
+
+    def test_server_side(self):
+        self.assertEqual(list(self.table.iter_rows()), [["a"], ["b"], ["c"]])
+        # The script timeout leaves room for a slow server, and the
+        # page initially shown is restored.
+        self.assertEqual(self.driver.log,
+                         [("page", 0, 3), ("page", 1, 3), ("page", 1, 3)])
+        self.assertEqual(self.driver.script_timeout, 2)
+
+    def test_closed_early(self):
+        with contextlib.closing(self.table.iter_rows()) as rows:
+            self.assertEqual(next(rows), ["a"])
+        self.assertEqual(self.driver.log[-1], ("page", 1, 3))
+
+    def test_abandoned_after_quit(self):
+        rows = self.table.iter_rows()
+        next(rows)
+        self.driver.quit()
+        rows.close()
+        self.assertEqual(self.driver.log, [("page", 0, 3)])
+
+
+class WaitForResultsTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = FakeDriver(["a", "b", "c"])
+        self.table = Datatable(Util(self.driver), cssid="table")
+
+    def test_from_api(self):
+        self.assertEqual(self.table.wait_for_results_from_api(3), 3)
+        # The script timeout outlasts the wait in the page.
+        self.assertEqual(self.driver.log, [("results", 3, 2000, 3)])
+        self.assertEqual(self.driver.script_timeout, 2)
+
+    def test_results_from_api(self):
+        self.table.results_from_api = True
+        self.assertEqual(self.table.wait_for_results(2), 3)
+        self.assertEqual(self.driver.log, [("results", 2, 2000, 3)])
+
+    def test_script_timeout(self):
+        self.driver.results_timeout = True
+        self.assertEqual(self.table.wait_for_results_from_api(2), 3)
+        self.assertEqual(self.driver.log,
+                         [("results", 2, 2000, 3), ("records",)])
+
+
+class GetResultTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = FakeDriver(["a", "b", "c"])
+        self.table = Datatable(Util(self.driver), cssid="table")
+
+    def test_index(self):
+        self.assertEqual(self.table.get_result(1), "b")
+        self.assertEqual(self.driver.log, [("result", 1, 2, None)])
+
+    def test_negative_index(self):
+        self.assertEqual(self.table.get_result(-2), "b")
+        self.assertEqual(self.driver.log, [("result", -2, -1, None)])
+
+    def test_last(self):
+        self.assertEqual(self.table.get_result(-1), "c")
+        self.assertEqual(self.driver.log, [("result", -1, None, None)])
+
+    def test_slice(self):
+        self.assertEqual(self.table.get_result(slice(None, None, -2)),
+                         ["c", "a"])
+        self.assertEqual(self.driver.log, [("result", None, None, -2)])
+
+    def test_empty_slice(self):
+        self.assertEqual(self.table.get_result(slice(2, 1)), [])
+
+    def test_index_out_of_range(self):
+        for number in (3, -4):
+            with self.assertRaisesRegex(IndexError,
+                                        "^list index out of range$"):
+                self.table.get_result(number)
+
+    def test_zero_step(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "^slice step cannot be zero$"):
+            self.table.get_result(slice(0, None, 0))
+        self.assertEqual(self.driver.log, [])
+
+
+class ApplyFiltersTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = FakeDriver(fields=["Name", "Date", "Other"])
+        self.table = Datatable(Util(self.driver), cssid="table")
+        self.table.filter_columns = {"Name": 0, "Date": 1}
+
+    def test_mapped(self):
+        self.table.apply_filters({"Name": "a", "Date": "b"})
+        name = self.driver.fields["Name"]
+        date = self.driver.fields["Date"]
+        # The script timeout leaves room for a slow server.
+        self.assertEqual(self.driver.log,
+                         [("search", [[0, "a", name], [1, "b", date]], 3)])
+        self.assertEqual(self.driver.script_timeout, 2)
+
+    def test_unmapped(self):
+        self.table.apply_filters({"Name": "a", "Other": "b"})
+        # The check is set up before the first field is set.
+        self.assertEqual(self.driver.log,
+                         [("setup redraw",), ("keys", "Name"),
+                          ("keys", "Other"), ("wait redraw",)])
+
+    def test_empty(self):
+        self.table.apply_filters({})
+        self.assertEqual(self.driver.log, [])
+
+    def test_column_searches(self):
+        self.table.apply_column_searches({None: "a", 2: "b"})
+        self.assertEqual(self.driver.log,
+                         [("search", [[None, "a", None], [2, "b", None]],
+                           3)])
+
+
+class RedrawTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.util = Util(self.driver)
+        self.tables = [Datatable(self.util, cssid=cssid)
+                       for cssid in ("a", "b")]
+
+    def test_setup_several(self):
+        tokens = setup_redraw_checks(self.util, self.tables)
+        self.assertEqual(len(set(tokens)), 2)
+        self.assertEqual(self.driver.redraw_setups,
+                         [[["a", tokens[0]], ["b", tokens[1]]]])
+        self.assertEqual([table.redraw_token for table in self.tables],
+                         tokens)
+
+    def test_tokens_are_unique(self):
+        table = self.tables[0]
+        first = table.setup_redraw_check()
+        second = table.setup_redraw_check()
+        self.assertNotEqual(first, second)
+        self.assertEqual(table.redraw_token, second)
+
+    def test_wait_uses_last_token(self):
+        table = self.tables[0]
+        table.setup_redraw_check()
+        token = table.setup_redraw_check()
+        table.wait_for_redraw()
+        self.assertEqual(self.driver.redraw_waits, [[token]])
+
+    def test_timeout_drops_checks(self):
+        tokens = setup_redraw_checks(self.util, self.tables)
+        self.driver.redraw_timeout = True
+        with self.assertRaises(TimeoutException):
+            wait_for_redraws(self.util, tokens)
+        self.assertEqual(self.driver.log[-1], ("drop redraw", tokens))
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+
+def run(statement):
+    """
+    Runs a statement in a new interpreter.
+
+    :returns: What the statement printed.
+    :rtype: :class:`str`
+    """
+    return subprocess.run(
+        [sys.executable, "-c", statement], stdout=subprocess.PIPE,
+        check=True, universal_newlines=True).stdout.strip()
+
+
+class ImportTestCase(TestCase):
+
+    def test_does_not_import_selenium(self):
+        self.assertEqual(run(
+            "import sys, selenic, selenic.config; "
+            "print(sorted(name for name in sys.modules "
+            "if name.split('.')[0] in ('selenium', 'distutils')))"), "[]")
+
+    def test_builder_is_loaded_on_demand(self):
+        self.assertEqual(run(
+            "import sys, selenic; selenic.Builder; "
+            "print('selenic.builder' in sys.modules)"), "True")
+
+    def test_star_import(self):
+        self.assertEqual(run(
+            "from selenic import *; names = dir(); "
+            "print(all(name in names for name in ('Builder', 'Config', "
+            "'wait_for_drivers', 'get_config')))"), "True")
+
+    def test_all(self):
+        import selenic
+        for name in selenic.__all__:
+            self.assertTrue(hasattr(selenic, name), name)
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+from selenic.instrument import CommandRecorder, DIRECT
+
+
+class FakeExecutor(object):
+
+    def execute(self, command, params):
+        return {"value": None}
+
+
+class FakeDriver(object):
+
+    def __init__(self):
+        self.command_executor = FakeExecutor()
+
+
+class CommandRecorderTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.recorder = CommandRecorder(buckets=(10, 100))
+        self.recorder.install(self.driver)
+
+    def test_records_per_test(self):
+        execute = self.driver.command_executor.execute
+        with self.recorder.test("a"):
+            execute("executeScript", {})
+            execute("executeScript", {})
+        with self.recorder.test("b"):
+            execute("findElement", {})
+
+        a = self.recorder.summary("a")
+        self.assertEqual(a["all"]["count"], 2)
+        self.assertEqual(a["by_command"]["executeScript"]["histogram"],
+                         [2, 0, 0])
+        self.assertEqual(a["by_helper"][DIRECT]["commands"],
+                         {"executeScript": 2})
+        self.assertEqual(list(self.recorder.summary("b")["by_command"]),
+                         ["findElement"])
+
+    def test_tests_per_thread(self):
+        execute = self.driver.command_executor.execute
+        started = threading.Event()
+        resume = threading.Event()
+
+        def other():
+            with self.recorder.test("other"):
+                started.set()
+                resume.wait()
+                execute("getTitle", {})
+
+        thread = threading.Thread(target=other)
+        with self.recorder.test("main"):
+            thread.start()
+            started.wait()
+            execute("findElement", {})
+            resume.set()
+            thread.join()
+
+        self.assertEqual(list(self.recorder.summary("main")["by_command"]),
+                         ["findElement"])
+        self.assertEqual(list(self.recorder.summary("other")["by_command"]),
+                         ["getTitle"])
+
+    def test_install_twice(self):
+        self.recorder.install(self.driver)
+        with self.assertRaises(ValueError):
+            CommandRecorder().install(self.driver)
+
+    def test_export_json(self):
+        self.driver.command_executor.execute("getTitle", {})
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.recorder.export_json(path)
+            with open(path) as f:
+                data = json.load(f)
+        finally:
+            os.unlink(path)
+        self.assertEqual(data["buckets"], [10, 100])
+        self.assertEqual(data["tests"][0]["test"], None)
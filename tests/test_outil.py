@@ -0,0 +1,298 @@
+import fcntl
+import os
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase, mock
+
+from selenic import outil
+from selenic.outil import PortAllocator
+
+SCRIPT = """#!/bin/sh
+echo run >> "{log}"
+echo "ChromeDriver {version} (abc)"
+"""
+
+
+class ProbeVersionTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_cache_dir = os.environ.get("SELENIC_CACHE_DIR")
+        os.environ["SELENIC_CACHE_DIR"] = os.path.join(self.tmpdir, "cache")
+        self.log = os.path.join(self.tmpdir, "log")
+        self.binary = os.path.join(self.tmpdir, "chromedriver")
+        self.write_binary("2.40")
+        outil._version_cache.clear()
+
+    def tearDown(self):
+        outil._version_cache.clear()
+        if self.old_cache_dir is None:
+            del os.environ["SELENIC_CACHE_DIR"]
+        else:
+            os.environ["SELENIC_CACHE_DIR"] = self.old_cache_dir
+        shutil.rmtree(self.tmpdir)
+
+    def write_binary(self, version):
+        with open(self.binary, 'w') as binary:
+            binary.write(SCRIPT.format(log=self.log, version=version))
+        os.chmod(self.binary, stat.S_IRWXU)
+
+    @property
+    def runs(self):
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as log:
+            return len(log.readlines())
+
+    def test_caches_in_memory(self):
+        self.assertEqual(outil.probe_version(self.binary),
+                         "ChromeDriver 2.40 (abc)")
+        outil.probe_version(self.binary)
+        self.assertEqual(self.runs, 1)
+
+    def test_caches_on_disk(self):
+        outil.probe_version(self.binary)
+        # This simulates another process.
+        outil._version_cache.clear()
+        self.assertEqual(outil.probe_version(self.binary),
+                         "ChromeDriver 2.40 (abc)")
+        self.assertEqual(self.runs, 1)
+
+    def test_binary_change_invalidates(self):
+        outil.probe_version(self.binary)
+        self.write_binary("2.41.1")
+        self.assertEqual(outil.probe_version(self.binary),
+                         "ChromeDriver 2.41.1 (abc)")
+        self.assertEqual(self.runs, 2)
+
+
+PROC_NET_TCP = (
+    "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when "
+    "retrnsmt   uid  timeout inode\n"
+    "   0: 0100007F:1F40 00000000:0000 0A 00000000:00000000 00:00000000 "
+    "00000000  1000        0 907 1 0000000000000000 100 0 0 10 0\n"
+    "   1: 00000000:07E8 00000000:0000 0A 00000000:00000000 00:00000000 "
+    "00000000     0        0 662 1 0000000000000000 100 0 0 10 0\n"
+    "   2: 0100007F:9BDA 0100007F:1F40 01 00000000:00000000 00:00000000 "
+    "00000000  1000        0 1234 1 0000000000000000 20 4 30 10 -1\n"
+    "   3: 0100007F:2328 0100007F:94CF 06 00000000:00000000 03:0000113D "
+    "00000000     0        0 0 3 0000000000000000\n"
+)
+
+PROC_NET_TCP6 = (
+    "  sl  local_address                         "
+    "remote_address                        st tx_queue rx_queue tr "
+    "tm->when retrnsmt   uid  timeout inode\n"
+    "   0: 00000000000000000000000000000000:2382 "
+    "00000000000000000000000000000000:0000 0A 00000000:00000000 "
+    "00:00000000 00000000  1000        0 4321 1 0000000000000000 100 0 0 "
+    "10 0\n"
+)
+
+
+class PortTableTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_parse(self):
+        # 0x9BDA is the local side of a connection; 0x2328 is in
+        # TIME_WAIT and is skipped.
+        self.assertEqual(outil.parse_proc_net_tcp(PROC_NET_TCP),
+                         {0x1F40, 0x07E8, 0x9BDA})
+
+    def test_parse_tcp6(self):
+        self.assertEqual(outil.parse_proc_net_tcp(PROC_NET_TCP6), {9090})
+
+    def test_get_local_ports(self):
+        paths = (self.write("tcp", PROC_NET_TCP),
+                 self.write("tcp6", PROC_NET_TCP6))
+        self.assertEqual(outil.get_local_ports(paths),
+                         {8000, 2024, 39898, 9090})
+
+    def test_get_local_ports_missing_file(self):
+        paths = (self.write("tcp", PROC_NET_TCP),
+                 os.path.join(self.tmpdir, "tcp6"))
+        self.assertEqual(outil.get_local_ports(paths), {8000, 2024, 39898})
+
+    def test_get_local_ports_no_proc(self):
+        self.assertIsNone(
+            outil.get_local_ports((os.path.join(self.tmpdir, "tcp"), )))
+
+
+LEASE_IN_CHILD = """
+import sys
+from selenic.outil import PortAllocator
+
+allocator = PortAllocator(sys.argv[1])
+print(allocator.lease([int(port) for port in sys.argv[2:]]))
+"""
+
+
+class PortAllocatorTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.allocator = PortAllocator(self.tmpdir)
+        # High ports that are unlikely to be in use.
+        self.candidates = [61001, 61002, 61003]
+
+    def tearDown(self):
+        self.allocator.close()
+        shutil.rmtree(self.tmpdir)
+
+    def lease_in_child(self, candidates):
+        result = subprocess.run(
+            [sys.executable, "-c", LEASE_IN_CHILD, self.tmpdir] +
+            [str(port) for port in candidates],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        return (result.returncode, result.stdout.strip())
+
+    def test_lease_from_os(self):
+        port = self.allocator.lease()
+        self.assertEqual(self.allocator.leased, [port])
+        self.assertEqual(self.allocator.stats.leases, 1)
+
+    def test_leases_are_exclusive_across_allocators(self):
+        other = PortAllocator(self.tmpdir)
+        try:
+            self.assertEqual(self.allocator.lease(self.candidates), 61001)
+            self.assertEqual(other.lease(self.candidates), 61002)
+            self.assertEqual(other.stats.contended, 1)
+            self.assertEqual(other.stats.contention, 0.5)
+        finally:
+            other.close()
+
+    def test_leases_are_exclusive_across_processes(self):
+        self.allocator.lease(self.candidates)
+        self.assertEqual(self.lease_in_child(self.candidates), (0, "61002"))
+
+    def test_leases_end_with_the_process(self):
+        self.assertEqual(self.lease_in_child(self.candidates), (0, "61001"))
+        self.assertEqual(self.allocator.lease(self.candidates), 61001)
+
+    def test_release(self):
+        self.allocator.lease(self.candidates)
+        self.allocator.release(61001)
+        self.assertEqual(self.allocator.leased, [])
+        self.assertEqual(self.lease_in_child(self.candidates), (0, "61001"))
+
+    def test_skips_used_ports(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind(("localhost", 0))
+            sock.listen(1)
+            used = sock.getsockname()[1]
+            if outil.get_local_ports() is None:
+                self.skipTest("no /proc/net/tcp")
+            self.assertEqual(self.allocator.lease([used, 61001]), 61001)
+            self.assertEqual(self.allocator.stats.in_use, 1)
+        finally:
+            sock.close()
+
+    def test_failure(self):
+        other = PortAllocator(self.tmpdir)
+        try:
+            other.lease(self.candidates[:1])
+            with self.assertRaisesRegex(
+                    Exception, "^cannot lease any of the ports: 61001$"):
+                self.allocator.lease(self.candidates[:1])
+            self.assertEqual(self.allocator.stats.failures, 1)
+        finally:
+            other.close()
+
+    def test_reuses_own_unused_ports(self):
+        ports = [self.allocator.lease(self.candidates) for _ in range(5)]
+        self.assertEqual(ports, [61001, 61002, 61003, 61001, 61002])
+        self.assertEqual(self.allocator.leased, self.candidates)
+        self.assertEqual(self.allocator.stats.reused, 2)
+
+    def test_does_not_reuse_bound_ports(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind(("localhost", 0))
+            sock.listen(1)
+            used = sock.getsockname()[1]
+            if outil.get_local_ports() is None:
+                self.skipTest("no /proc/net/tcp")
+            # We lease it before it is bound, as callers do.
+            sock.close()
+            self.assertEqual(self.allocator.lease([used]), used)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(("localhost", used))
+            sock.listen(1)
+            with self.assertRaises(Exception):
+                self.allocator.lease([used])
+        finally:
+            sock.close()
+
+    def test_release_deletes_lock_file(self):
+        port = self.allocator.lease()
+        self.assertEqual(os.listdir(self.tmpdir), ["{0}.lock".format(port)])
+        self.allocator.release(port)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_lease_after_deleted_lock_file(self):
+        # Another allocator releases the port, and deletes the lock
+        # file, after we open the file but before we lock it. The lock
+        # we get then excludes no one, so we must lease the port anew.
+        path = os.path.join(self.tmpdir, "61001.lock")
+        flock = fcntl.flock
+        calls = []
+
+        def racing_flock(fd, operation):
+            calls.append(fd)
+            if len(calls) == 1:
+                os.unlink(path)
+            flock(fd, operation)
+
+        with mock.patch.object(outil.fcntl, "flock", racing_flock):
+            self.assertEqual(self.allocator.lease(self.candidates), 61001)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.lease_in_child(self.candidates), (0, "61002"))
+
+    def test_returns_bound_ports(self):
+        if outil.get_local_ports() is None:
+            self.skipTest("no /proc/net/tcp")
+        port = self.allocator.lease()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind(("localhost", port))
+            sock.listen(1)
+            other = self.allocator.lease()
+            self.assertEqual(self.allocator.leased, [other])
+            self.assertEqual(self.allocator.stats.returned, 1)
+            self.assertFalse(os.path.exists(
+                os.path.join(self.tmpdir, "{0}.lock".format(port))))
+        finally:
+            sock.close()
+
+    def test_max_held(self):
+        if outil.get_local_ports() is None:
+            self.skipTest("no /proc/net/tcp")
+        allocator = PortAllocator(self.tmpdir, max_held=2)
+        try:
+            ports = [allocator.lease() for _ in range(4)]
+            self.assertEqual(len(allocator.leased), 2)
+            self.assertEqual(ports[2:], ports[:2])
+            self.assertEqual(allocator.stats.reused, 2)
+        finally:
+            allocator.close()
+
+    def test_release_unleased(self):
+        self.allocator.release(61001)
+        self.assertEqual(self.allocator.leased, [])
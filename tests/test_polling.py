@@ -0,0 +1,86 @@
+from unittest import TestCase
+
+from selenium.common.exceptions import NoSuchElementException, \
+    TimeoutException
+
+from selenic.polling import FixedPoll, ExponentialBackoff, LatencyAware, \
+    WaitStats, wait_until
+
+
+class Countdown(object):
+
+    def __init__(self, count, value="done"):
+        self.count = count
+        self.value = value
+
+    def __call__(self, _driver):
+        self.count -= 1
+        return self.value if self.count <= 0 else False
+
+
+class ExponentialBackoffTestCase(TestCase):
+
+    def test_grows_to_ceiling(self):
+        sched = ExponentialBackoff(floor=0.1, ceiling=0.5, factor=2)
+        self.assertEqual([sched.next_interval(n, 0) for n in range(1, 6)],
+                         [0.1, 0.2, 0.4, 0.5, 0.5])
+
+    def test_rejects_bad_bounds(self):
+        with self.assertRaises(ValueError):
+            ExponentialBackoff(floor=1, ceiling=0.5)
+
+
+class LatencyAwareTestCase(TestCase):
+
+    def test_follows_round_trip(self):
+        sched = LatencyAware(multiplier=2, floor=0, ceiling=10, smoothing=0.5)
+        self.assertEqual(sched.next_interval(1, 0.1), 0.2)
+        self.assertEqual(sched.next_interval(2, 0.3), 0.4)
+        self.assertEqual(sched.round_trip, 0.2)
+
+    def test_clamps(self):
+        sched = LatencyAware(floor=0.05, ceiling=0.5)
+        self.assertEqual(sched.next_interval(1, 0.001), 0.05)
+        self.assertEqual(sched.next_interval(1, 5), 0.5)
+
+
+class WaitUntilTestCase(TestCase):
+
+    def test_counts_polls(self):
+        stats = WaitStats()
+        self.assertEqual(wait_until(None, Countdown(3), 5, FixedPoll(0),
+                                    stats=stats), "done")
+        self.assertEqual(stats.polls, 3)
+
+    def test_times_out(self):
+        stats = WaitStats()
+        with self.assertRaises(TimeoutException):
+            wait_until(None, Countdown(1000), 0.05, FixedPoll(0.01),
+                       stats=stats)
+        self.assertGreater(stats.polls, 1)
+        self.assertGreaterEqual(stats.elapsed, 0.05)
+
+    def test_until_not(self):
+        polls = []
+
+        def cond(_driver):
+            polls.append(1)
+            return "present" if len(polls) < 4 else ""
+
+        stats = WaitStats()
+        self.assertEqual(wait_until(None, cond, 5, FixedPoll(0),
+                                    until_not=True, stats=stats), "")
+        self.assertEqual(len(polls), 4)
+        self.assertEqual(stats.polls, 4)
+
+    def test_ignored_exceptions(self):
+        calls = []
+
+        def cond(_driver):
+            calls.append(1)
+            if len(calls) < 3:
+                raise NoSuchElementException()
+            return True
+
+        self.assertTrue(wait_until(None, cond, 5, FixedPoll(0)))
+        self.assertEqual(len(calls), 3)
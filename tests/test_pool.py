@@ -0,0 +1,186 @@
+from unittest import TestCase
+
+from selenium.common.exceptions import WebDriverException
+
+from selenic.pool import DriverPool, PoolStats
+
+
+class FakeSwitchTo(object):
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        self.driver.current_window_handle = handle
+
+
+class FakeDriver(object):
+
+    def __init__(self, fail_reset=False):
+        self.fail_reset = fail_reset
+        self.fail_quit = False
+        self.window_handles = ["home"]
+        self.current_window_handle = "home"
+        self.switch_to = FakeSwitchTo(self)
+        self.urls = []
+        self.quitted = False
+
+    def close(self):
+        self.window_handles.remove(self.current_window_handle)
+
+    def execute_script(self, script, *args):
+        if self.fail_reset:
+            raise self.fail_reset
+
+    def delete_all_cookies(self):
+        pass
+
+    def get(self, url):
+        self.urls.append(url)
+
+    def quit(self):
+        self.quitted = True
+        if self.fail_quit:
+            raise ConnectionError("the driver is gone")
+
+
+class HandlelessDriver(FakeDriver):
+
+    @property
+    def current_window_handle(self):
+        raise ConnectionError("the driver is gone")
+
+    @current_window_handle.setter
+    def current_window_handle(self, value):
+        pass
+
+
+class FakeBuilder(object):
+
+    def __init__(self, fail_reset=False, driver_class=FakeDriver):
+        self.fail_reset = fail_reset
+        self.driver_class = driver_class
+        self.drivers = []
+
+    def get_driver(self, desired_capabilities=None):
+        driver = self.driver_class(self.fail_reset)
+        self.drivers.append(driver)
+        return driver
+
+
+class DriverPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.builder = FakeBuilder()
+        self.pool = DriverPool(self.builder, max_uses=2)
+
+    def test_reuses_released_driver(self):
+        driver = self.pool.acquire()
+        driver.window_handles.append("popup")
+        driver.current_window_handle = "popup"
+        self.pool.release(driver)
+        self.assertEqual(driver.window_handles, ["home"])
+        self.assertEqual(driver.current_window_handle, "home")
+        self.assertEqual(driver.urls, ["about:blank"])
+
+        self.assertIs(self.pool.acquire(), driver)
+        self.assertEqual(len(self.builder.drivers), 1)
+
+    def test_retires_after_max_uses(self):
+        for _ in range(2):
+            with self.pool.lease() as driver:
+                pass
+        self.assertTrue(driver.quitted)
+        self.assertIsNot(self.pool.acquire(), driver)
+        self.assertEqual(self.pool.stats.retired, 1)
+
+    def test_retires_on_webdriver_exception(self):
+        with self.assertRaises(WebDriverException):
+            with self.pool.lease() as driver:
+                raise WebDriverException()
+        self.assertTrue(driver.quitted)
+
+    def test_keeps_driver_on_other_exception(self):
+        with self.assertRaises(AssertionError):
+            with self.pool.lease() as driver:
+                raise AssertionError()
+        self.assertFalse(driver.quitted)
+        self.assertIs(self.pool.acquire(), driver)
+
+    def test_retires_on_failed_reset(self):
+        pool = DriverPool(FakeBuilder(
+            fail_reset=WebDriverException("the browser is gone")))
+        driver = pool.acquire()
+        pool.release(driver)
+        self.assertTrue(driver.quitted)
+        self.assertEqual(pool.stats.retired, 1)
+
+    def test_retires_on_other_reset_error(self):
+        driver = self.pool.acquire()
+        driver.fail_reset = ConnectionError("the driver is gone")
+        driver.fail_quit = True
+        self.pool.release(driver)
+        self.assertTrue(driver.quitted)
+        self.assertEqual(self.pool.stats.retired, 1)
+        self.assertIsNot(self.pool.acquire(), driver)
+
+    def test_retires_without_windows(self):
+        driver = self.pool.acquire()
+        driver.window_handles = []
+        self.pool.release(driver)
+        self.assertTrue(driver.quitted)
+
+    def test_lease_keeps_block_exception(self):
+        with self.assertRaises(AssertionError):
+            with self.pool.lease() as driver:
+                driver.fail_reset = ConnectionError("the driver is gone")
+                driver.fail_quit = True
+                raise AssertionError()
+        self.assertTrue(driver.quitted)
+
+    def test_spawn_failure_quits_driver(self):
+        builder = FakeBuilder(driver_class=HandlelessDriver)
+        pool = DriverPool(builder)
+        with self.assertRaises(ConnectionError):
+            pool.acquire()
+        self.assertTrue(builder.drivers[0].quitted)
+
+    def test_release_unknown_driver(self):
+        with self.assertRaisesRegex(
+                ValueError, "^the driver was not leased from this pool$"):
+            self.pool.release(FakeDriver())
+
+    def test_prewarm_and_close(self):
+        self.pool.prewarm(3)
+        self.assertEqual(len(self.builder.drivers), 3)
+        driver = self.pool.acquire()
+        self.assertEqual(len(self.builder.drivers), 3)
+
+        self.pool.close()
+        self.assertEqual([d.quitted for d in self.builder.drivers].count(True),
+                         2)
+        self.pool.release(driver)
+        self.assertTrue(driver.quitted)
+        with self.assertRaisesRegex(Exception, "^the pool is closed$"):
+            self.pool.acquire()
+
+    def test_stats(self):
+        with self.pool.lease():
+            pass
+        summary = self.pool.stats.summary()
+        self.assertEqual(summary["spawn"]["count"], 1)
+        self.assertEqual(summary["lease"]["count"], 1)
+        self.assertEqual(summary["reset"]["count"], 1)
+        self.assertEqual(summary["retired"], 0)
+
+
+class PoolStatsTestCase(TestCase):
+
+    def test_summary(self):
+        stats = PoolStats()
+        stats.spawn_times = [1.0, 3.0]
+        summary = stats.summary()
+        self.assertEqual(summary["spawn"],
+                         {"count": 2, "total": 4.0, "mean": 2.0, "max": 3.0})
+        self.assertEqual(summary["reset"],
+                         {"count": 0, "total": 0, "mean": 0.0, "max": 0.0})
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from selenic.config import ConfigTuple
+from selenic.shard import TimingStore, shard
+
+A = ConfigTuple("LINUX", "CHROME", "70")
+B = ConfigTuple("LINUX", "FIREFOX", "60")
+C = ConfigTuple("WINDOWS 10", "INTERNETEXPLORER", "11")
+D = ConfigTuple("OS X 10.13", "CHROME", "70")
+
+
+class TimingStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "timings.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        store = TimingStore(self.path)
+        store.record_startup(A, 4.0)
+        store.record_test(A, "t1", 2.0)
+        store.record_test(A, "t2", 3.0)
+        store.save()
+
+        store = TimingStore(self.path)
+        self.assertEqual(store.startup(A), 4.0)
+        self.assertEqual(store.test(A, "t1"), 2.0)
+        self.assertEqual(store.run(A), 5.0)
+        self.assertIsNone(store.startup(B))
+        self.assertIsNone(store.run(B))
+
+    def test_blends_measures(self):
+        store = TimingStore(self.path, smoothing=0.5)
+        store.record_run(A, 10.0)
+        store.record_run(A, 20.0)
+        self.assertEqual(store.run(A), 15.0)
+
+
+class ShardTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = TimingStore(os.path.join(self.tmpdir, "timings.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_balances_configs(self):
+        for (config, run) in ((A, 100.0), (B, 60.0), (C, 50.0), (D, 10.0)):
+            self.store.record_run(config, run)
+            self.store.record_startup(config, 0.0)
+
+        shards = shard(2, [A, B, C, D], store=self.store)
+        self.assertEqual([s.items for s in shards],
+                         [[(A, None), (D, None)], [(B, None), (C, None)]])
+        self.assertEqual([s.estimate for s in shards], [110.0, 110.0])
+
+    def test_startup_cost_groups_tests(self):
+        self.store.record_startup(A, 0.0)
+        self.store.record_test(A, "t1", 35.0)
+        self.store.record_startup(C, 30.0)
+        self.store.record_test(C, "t2", 10.0)
+        self.store.record_test(C, "t3", 10.0)
+
+        shards = shard(2, [A, C], {A: ["t1"], C: ["t2", "t3"]},
+                       store=self.store)
+        self.assertEqual(shards[0].items, [(A, "t1")])
+        self.assertEqual(shards[0].estimate, 35.0)
+        # Moving a test of C to the first shard would finish it at 45
+        # seconds were it not for the startup of C.
+        self.assertEqual(shards[1].configs, [C])
+        self.assertEqual(shards[1].items, [(C, "t2"), (C, "t3")])
+        self.assertEqual(shards[1].estimate, 50.0)
+
+    def test_unknown_durations_use_the_mean(self):
+        self.store.record_run(A, 30.0)
+        self.store.record_run(B, 10.0)
+        shards = shard(3, [A, B, C], store=self.store, default_startup=0.0)
+        self.assertEqual(sorted(s.estimate for s in shards),
+                         [10.0, 20.0, 30.0])
+
+    def test_deterministic(self):
+        first = shard(3, [A, B, C, D], ["t1", "t2", "t3"])
+        second = shard(3, [D, C, B, A], ["t1", "t2", "t3"])
+        self.assertEqual([s.items for s in first],
+                         [s.items for s in second])
+        self.assertEqual(sum(len(s.items) for s in first), 12)
+
+    def test_more_workers_than_items(self):
+        shards = shard(3, [A])
+        self.assertEqual([len(s.items) for s in shards], [1, 0, 0])
+
+    def test_requires_workers(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "^workers must be at least 1$"):
+            shard(0, [A])
@@ -0,0 +1,155 @@
+import itertools
+from unittest import TestCase
+
+from selenium.common.exceptions import StaleElementReferenceException
+
+from selenic import tables
+from selenic.tables import Table
+from selenic.util import Util
+
+
+class FakeElement(object):
+
+    def __init__(self, label, tag_name="input"):
+        self.label = label
+        self.tag_name = tag_name
+        self.value = ""
+        self.stale_for = 0
+        """The number of calls to ``send_keys`` which fail as stale."""
+        self.keys = []
+
+    def send_keys(self, keys):
+        if self.stale_for:
+            self.stale_for -= 1
+            raise StaleElementReferenceException()
+        self.keys.append(keys)
+
+
+class FakeDriver(object):
+
+    """
+    Simulates a page whose search fields are tracked by the page-side
+    registry of :mod:`selenic.tables`.
+    """
+
+    name = "chrome"
+    desired_capabilities = {"browserName": "chrome", "version": "70",
+                            "platform": "Linux"}
+
+    def __init__(self, labels):
+        self._generations = itertools.count(1)
+        self.fields = {}
+        self.scans = []
+        self.sent = []
+        for label in labels:
+            self.replace(label)
+
+    def replace(self, label):
+        """
+        Replaces a field by a new element, as a redraw would.
+        """
+        self.fields[label] = (FakeElement(label), next(self._generations))
+
+    def set_script_timeout(self, timeout):
+        pass
+
+    def find_elements(self, by, value):
+        return [object()]
+
+    def execute_script(self, script, *args):
+        if script == tables._SEARCH_FIELDS_SNIPPET:
+            (_, _, known, force) = args
+            self.scans.append(force)
+            if force:
+                for label in self.fields:
+                    self.fields[label] = (self.fields[label][0],
+                                          next(self._generations))
+            changed = []
+            for (label, (el, generation)) in self.fields.items():
+                if generation > known:
+                    changed += [label, el]
+            self.sent.append(changed[::2])
+            return {
+                "fresh": known == -1,
+                "generation": max(g for (_, g) in self.fields.values()),
+                "changed": changed,
+                "removed": [],
+            }
+
+        # This is the script that fills a field.
+        (el, value) = args
+        el.value = value
+        return None
+
+
+class FakeTable(Table):
+
+    initialized_locator = ("id", "table")
+
+    def __init__(self, *args, **kwargs):
+        super(FakeTable, self).__init__(*args, **kwargs)
+        self.redraws = []
+
+    def setup_redraw_check(self):
+        self.redraws.append("setup")
+
+    def wait_for_redraw(self):
+        self.redraws.append("wait")
+
+
+class TableTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = FakeDriver(["Name", "Date"])
+        self.table = FakeTable(Util(self.driver), cssid="table",
+                               field_selectors=["#filters"])
+
+    def test_fill_field(self):
+        self.table.fill_field("Name", "abc")
+        el = self.driver.fields["Name"][0]
+        self.assertEqual(el.value, "ab")
+        self.assertEqual(el.keys, ["c"])
+        self.assertEqual(self.table.redraws, ["setup", "wait"])
+
+    def test_apply_filters(self):
+        self.table.apply_filters({"Name": "abc", "Date": "2000"})
+        self.assertEqual(self.driver.fields["Name"][0].keys, ["c"])
+        self.assertEqual(self.driver.fields["Date"][0].keys, ["0"])
+        self.assertEqual(self.table.redraws, ["setup", "wait"])
+
+    def test_stale_field_is_rescanned(self):
+        self.table.fill_field("Name", "abc")
+        stale = self.driver.fields["Name"][0]
+        stale.stale_for = 1
+        # The page has not noticed yet, so the registry still holds
+        # the stale element until the rescan is forced.
+        self.driver.fields["Name"] = (FakeElement("Name"),
+                                      self.driver.fields["Name"][1])
+
+        self.table.fill_field("Name", "def")
+        self.assertEqual(self.driver.scans[-2:], [False, True])
+        self.assertEqual(self.driver.fields["Name"][0].keys, ["f"])
+        self.assertIs(self.table._found_fields["Name"],
+                      self.driver.fields["Name"][0])
+
+    def test_stale_several_times(self):
+        self.table.fill_field("Name", "abc")
+        el = self.driver.fields["Name"][0]
+        el.stale_for = 3
+        self.table.fill_field("Name", "def")
+        self.assertEqual(self.driver.scans[-4:], [False, True, True, True])
+        self.assertEqual(el.keys, ["c", "f"])
+
+    def test_stale_until_timeout(self):
+        self.table.util.push_timeout(0.3)
+        self.table.fill_field("Name", "abc")
+        self.driver.fields["Name"][0].stale_for = float("inf")
+        with self.assertRaises(StaleElementReferenceException):
+            self.table.fill_field("Name", "def")
+
+    def test_fetches_only_changed_fields(self):
+        self.table.fill_field("Name", "abc")
+        self.driver.replace("Date")
+        self.table.fill_field("Date", "2000")
+        self.assertEqual(self.driver.fields["Date"][0].keys, ["0"])
+        self.assertEqual(self.driver.sent, [["Name", "Date"], ["Date"]])
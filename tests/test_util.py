@@ -0,0 +1,333 @@
+from unittest import TestCase, skipIf
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from selenium.common.exceptions import TimeoutException
+
+from selenic import util
+from selenic.util import Util, Condition, PageCondition
+
+
+class FakeDriver(object):
+
+    """
+    Simulates a page in which the library of helpers is installed
+    when a script carrying its source is executed, and lost when the
+    page is reloaded.
+    """
+
+    name = "chrome"
+    desired_capabilities = {"browserName": "chrome", "version": "70",
+                            "platform": "Linux"}
+
+    def __init__(self):
+        self.installed = False
+        self.scripts = []
+
+    def set_script_timeout(self, timeout):
+        pass
+
+    def reload(self):
+        self.installed = False
+
+    def execute_script(self, script, *args):
+        self.scripts.append(script)
+        if script.startswith(util._LIBRARY_INSTALL):
+            self.installed = True
+        elif not self.installed:
+            return {util._LIBRARY_MISSING: True}
+
+        if script.endswith(util._BATCH_BODY):
+            return [{"value": call[0]} for call in args]
+
+        return args[0]
+
+
+class LibraryDriver(FakeDriver):
+
+    """
+    Answers the calls to the functions of the library of helpers
+    with ``answers``, which maps function names to functions called
+    with the arguments of the call. The calls are recorded in
+    ``calls``.
+    """
+
+    def __init__(self, answers):
+        super(LibraryDriver, self).__init__()
+        self.answers = answers
+        self.calls = []
+
+    def execute_script(self, script, *args):
+        ret = super(LibraryDriver, self).execute_script(script, *args)
+        if not self.installed:
+            return ret
+
+        if script.endswith(util._BATCH_BODY):
+            return [{"value": self.call(*call)} for call in args]
+
+        if script.endswith(util._CALL_BODY):
+            return self.call(*args)
+
+        return ret
+
+    def call(self, name, args):
+        self.calls.append((name, args))
+        return self.answers[name](*args)
+
+
+class LibraryTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.util = Util(self.driver)
+
+    def test_installs_once(self):
+        self.assertEqual(self.util.window_scroll_top(), "windowScrollTop")
+        self.assertEqual(len(self.driver.scripts), 2)
+        self.assertEqual(self.util.window_scroll_left(), "windowScrollLeft")
+        self.assertEqual(len(self.driver.scripts), 3)
+        self.assertFalse(
+            self.driver.scripts[-1].startswith(util._LIBRARY_INSTALL))
+
+    def test_reinstalls_after_reload(self):
+        self.util.window_scroll_top()
+        self.driver.reload()
+        self.assertEqual(self.util.window_scroll_top(), "windowScrollTop")
+        self.assertEqual(len(self.driver.scripts), 4)
+        self.assertTrue(self.driver.installed)
+
+    def test_batch(self):
+        with self.util.batch():
+            top = self.util.window_scroll_top()
+            size = self.util.get_window_inner_size()
+        self.assertEqual(top.value, "windowScrollTop")
+        self.assertEqual(size.value, "windowInnerSize")
+        self.assertEqual(len(self.driver.scripts), 2)
+        self.assertTrue(self.driver.scripts[-1].endswith(util._BATCH_BODY))
+
+
+class PageWaitDriver(FakeDriver):
+
+    """
+    Records the script timeouts set, and answers in-page waits with
+    the value of their first argument.
+    """
+
+    def __init__(self):
+        super(PageWaitDriver, self).__init__()
+        self.script_timeouts = []
+        self.script_timeout_expires = False
+
+    def set_script_timeout(self, timeout):
+        self.script_timeouts.append(timeout)
+
+    def execute_async_script(self, script, predicate, args, timeout):
+        self.script_timeouts.append(("wait", timeout))
+        if self.script_timeout_expires:
+            raise TimeoutException("script timeout")
+        return {"value": args[0]}
+
+
+class PageWaitTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = PageWaitDriver()
+        self.util = Util(self.driver)
+
+    def test_script_timeout_outlasts_page_timeout(self):
+        self.assertEqual(self.util.wait_in_page("return arguments[0]", 1), 1)
+        # The default timeouts are equal, so the script timeout must
+        # be raised for the duration of the wait.
+        self.assertEqual(self.driver.script_timeouts,
+                         [2, 3, ("wait", 2000), 2])
+
+    def test_script_timeout_is_wait_timeout(self):
+        self.driver.script_timeout_expires = True
+        with self.assertRaisesRegex(TimeoutException,
+                                    "timed out waiting in the page"):
+            self.util.wait_in_page("return arguments[0]", 1)
+        # The script timeout is restored.
+        self.assertEqual(self.driver.script_timeouts[-1], 2)
+        self.assertEqual(
+            PageCondition(self.util, "return arguments[0]", "x").wait(),
+            None)
+
+    def test_page_condition(self):
+        cond = PageCondition(self.util, "return arguments[0]", "x")
+        self.assertNotIsInstance(cond, Condition)
+        self.assertEqual(cond.wait(), "x")
+        self.assertTrue(cond.called)
+        self.assertEqual(cond.polls, 1)
+
+
+class GeometryTestCase(TestCase):
+
+    def setUp(self):
+        self.geometry = {
+            "rect": {"top": 20, "left": 10, "bottom": 30, "right": 41,
+                     "width": 31, "height": 10},
+            "viewport": {"width": 100, "height": 50},
+            "displayed": True,
+        }
+        self.driver = LibraryDriver({"geometry": lambda _: self.geometry})
+        self.util = Util(self.driver)
+
+    def set_rect(self, **kwargs):
+        self.geometry["rect"].update(kwargs)
+
+    def test_element_screen_center(self):
+        self.assertEqual(self.util.element_screen_center("el"),
+                         {"left": 25, "top": 25})
+        self.assertEqual(self.driver.calls, [("geometry", ["el"])])
+
+    def test_element_screen_center_fractions(self):
+        self.set_rect(left=10.5, width=3, height=0.5)
+        self.assertEqual(self.util.element_screen_center("el"),
+                         {"left": 11.5, "top": 20})
+
+    def test_completely_visible(self):
+        self.assertTrue(self.util.completely_visible_to_user("el"))
+
+    def test_completely_visible_at_viewport_bounds(self):
+        self.set_rect(top=0, left=0, width=100, height=50)
+        self.assertTrue(self.util.completely_visible_to_user("el"))
+
+    def test_completely_visible_floors_dimensions(self):
+        # The fractions of pixels do not push the element out of the
+        # viewport...
+        self.set_rect(top=0.5, left=0.5, width=99.9, height=49.9)
+        self.assertTrue(self.util.completely_visible_to_user("el"))
+        # ... but an element that starts before the viewport is not
+        # completely visible.
+        self.set_rect(top=-0.5)
+        self.assertFalse(self.util.completely_visible_to_user("el"))
+
+    def test_completely_visible_outside_viewport(self):
+        for rect in ({"left": -1}, {"top": -1}, {"left": 70},
+                     {"top": 41}):
+            self.setUp()
+            self.set_rect(**rect)
+            self.assertFalse(self.util.completely_visible_to_user("el"),
+                             rect)
+
+    def test_completely_visible_not_displayed(self):
+        self.geometry["displayed"] = False
+        self.assertFalse(self.util.completely_visible_to_user("el"))
+
+
+class LayoutTestCase(TestCase):
+
+    def setUp(self):
+        self.driver = LibraryDriver({"elementsLayout": self.layout})
+        self.util = Util(self.driver)
+
+    @staticmethod
+    def layout(elements, ignorable, visibility, with_elements):
+        ret = {
+            "top": [0, 10],
+            "left": [5, 5],
+            "bottom": [10, 20],
+            "right": [15, 15],
+            "width": [10, 10],
+            "height": [10, 10],
+        }
+        if visibility:
+            ret["displayed"] = [True, False]
+            ret["visible"] = [True, False]
+        if with_elements:
+            ret["elements"] = ["a", "b"]
+        return ret
+
+    def test_elements_layout(self):
+        layout = self.util.elements_layout(".item", ["#overlay"],
+                                           with_elements=True)
+        self.assertEqual(layout["top"], [0, 10])
+        self.assertEqual(layout["visible"], [True, False])
+        self.assertEqual(layout["elements"], ["a", "b"])
+        self.assertEqual(self.driver.calls,
+                         [("elementsLayout",
+                           [".item", ["#overlay"], True, True])])
+
+    @skipIf(numpy is None, "numpy is not installed")
+    def test_elements_layout_numpy(self):
+        layout = self.util.elements_layout(".item", numpy=True,
+                                           with_elements=True)
+        self.assertIsInstance(layout["top"], numpy.ndarray)
+        self.assertEqual(layout["top"].tolist(), [0, 10])
+        self.assertEqual(layout["visible"].tolist(), [True, False])
+        # The elements are left alone.
+        self.assertEqual(layout["elements"], ["a", "b"])
+
+    def test_elements_visible_to_user(self):
+        self.assertEqual(
+            self.util.elements_visible_to_user(".item", "#overlay"),
+            [True, False])
+        self.assertEqual(self.driver.calls,
+                         [("elementsLayout",
+                           [".item", ["#overlay"], True, False])])
+
+    def test_elements_visible_to_user_batch(self):
+        with self.util.batch():
+            visible = self.util.elements_visible_to_user(".item")
+        self.assertEqual(visible.value, [True, False])
+
+
+class TextSearchTestCase(TestCase):
+
+    def setUp(self):
+        self.matches = ["a", "b", "c"]
+        self.driver = LibraryDriver({"textSearch": self.search})
+        self.util = Util(self.driver)
+
+    def search(self, parent, re, limit):
+        return self.matches[:limit]
+
+    def test_all(self):
+        self.assertEqual(self.util.find_descendants_by_text_re("#p", "x"),
+                         ["a", "b", "c"])
+        self.assertEqual(self.driver.calls,
+                         [("textSearch", ["#p", "x", None])])
+
+    def test_first(self):
+        self.assertEqual(
+            self.util.find_descendants_by_text_re("#p", "x", first=True),
+            "a")
+        # The search stops at the first match.
+        self.assertEqual(self.driver.calls, [("textSearch", ["#p", "x", 1])])
+
+    def test_first_overrides_limit(self):
+        self.util.find_descendants_by_text_re("#p", "x", first=True, limit=2)
+        self.assertEqual(self.driver.calls, [("textSearch", ["#p", "x", 1])])
+
+    def test_limit(self):
+        self.assertEqual(
+            self.util.find_descendants_by_text_re("#p", "x", limit=2),
+            ["a", "b"])
+        self.assertEqual(self.driver.calls, [("textSearch", ["#p", "x", 2])])
+
+    def test_no_match(self):
+        self.matches = []
+        self.assertEqual(
+            self.util.find_descendants_by_text_re("#p", "x", immediate=True),
+            [])
+        self.assertIsNone(
+            self.util.find_descendants_by_text_re("#p", "x", immediate=True,
+                                                  first=True))
+        self.assertEqual(len(self.driver.calls), 2)
+
+    def test_waits_for_match(self):
+        self.matches = []
+
+        def search(parent, re, limit):
+            if len(self.driver.calls) == 3:
+                self.matches = ["a"]
+            return self.matches[:limit]
+
+        self.driver.answers["textSearch"] = search
+        self.assertEqual(
+            self.util.find_descendants_by_text_re("#p", "x", first=True),
+            "a")
+        self.assertEqual(len(self.driver.calls), 3)